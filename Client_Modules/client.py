@@ -4,16 +4,21 @@ Amit Skarbin
 """
 
 
-import pickle
 import sys
 import threading
-import cv2
 from Client_Modules.client_network_module import ClientNetworkModule
 from Client_Modules.client_streaming import ClientStreamingModule
 from Client_Modules.client_file_management_module \
     import ClientFileManagementModule
-from Constants.constants import JPEG_COMPRESSION_QUALITY, PICKLE_PROTOCOL_VERSION
+from Client_Modules.client_transfer_module import ClientTransferModule
+from Client_Modules.client_channel_module import ClientChannelModule
+from Constants.constants import FPS, JPEG_COMPRESSION_QUALITY, \
+    DELTA_ENCODING_ENABLED, SPLIT_STREAMS_ENABLED, SCREEN_FPS, \
+    SCREEN_RESOLUTION, SCREEN_JPEG_QUALITY, SCREEN_BITRATE_SHARE, \
+    CAMERA_FPS, CAMERA_RESOLUTION, CAMERA_JPEG_QUALITY
 from Protocols.protocol import Protocol
+from Protocols.frame_protocol import FrameProtocol, CHANNEL_COMBINED, \
+    CHANNEL_SCREEN, CHANNEL_CAMERA
 
 class Client:
     """
@@ -24,8 +29,13 @@ class Client:
         streaming_module (ClientStreamingModule): Handles video streaming.
         file_management_module (ClientFileManagementModule): Manages file
         operations.
+        transfer_module (ClientTransferModule): Runs file transfers in the
+        background.
 
         username (str): The username of the client.
+        stream_id (int): The stream id assigned by the server at handshake.
+        channels (list): The independently encoded channels of the stream,
+        see ClientChannelModule.
         running (bool): Indicates whether the streaming is active.
     """
 
@@ -38,13 +48,23 @@ class Client:
             port (int): The port number on which the server is listening.
         """
         self.network_module = ClientNetworkModule(host, port)
-        self.streaming_module = ClientStreamingModule()
+        if SPLIT_STREAMS_ENABLED:
+            self.streaming_module = ClientStreamingModule(
+                CAMERA_RESOLUTION, screen_resolution=SCREEN_RESOLUTION)
+        else:
+            self.streaming_module = ClientStreamingModule()
         self.file_management_module = ClientFileManagementModule(
-            self.network_module.file_socket)
+            self.network_module.file_socket,
+            self.network_module.reconnect_file_socket)
+        self.transfer_module = ClientTransferModule(
+            self.file_management_module)
         self.username = None
+        self.stream_id = None
         self.test_over = False
         self.stream_thread = None
         self.listen_thread = None
+        self.send_lock = threading.Lock()
+        self.channels = self.create_channels()
         self.running = False
 
     def start_stream(self, username):
@@ -71,15 +91,23 @@ class Client:
         If "TEST_OVER" message is received, it indicates
         the server has ended the test, and sets
         `test_over` flag to True. s
+        "TARGET_BITRATE:<bits per second>" caps the stream's bitrate, 0
+        removes the cap.
         Raises:
             Exception: Logs any network communication errors encountered.
         """
         try:
+            Protocol.send(self.network_module.listen_socket, "LISTEN_SESSION")
+            Protocol.send(self.network_module.listen_socket, self.username)
             while self.running:
                 message = Protocol.recv(self.network_module.listen_socket)
                 if message == "TEST_OVER":
                     self.test_over = True
                     print("Received TEST_OVER from server, stopping client.")
+                elif message.startswith("TARGET_BITRATE:"):
+                    bitrate = int(message.split(":", 1)[1])
+                    for channel in self.channels:
+                        channel.set_target_bitrate(bitrate or None)
         except Exception as e:
             print(f"listen to server have an error: {e}")
 
@@ -87,7 +115,7 @@ class Client:
         """
         Stops the video streaming process and releases resources.
         """
-        self.streaming_module.camera.release()
+        self.streaming_module.release()
         self.network_module.close_sockets()
 
         print("Streaming stopped")
@@ -95,48 +123,81 @@ class Client:
     def stream_video(self):
         """
         Continuously captures and sends video frames to the server.
+
+        The stream socket is switched to a streaming session once, after
+        which every message on it is a frame record until "STOP" is sent.
+        Every channel captures, encodes and sends as its own paced pipeline,
+        see ClientChannelModule.
         """
-        while self.running:
+        try:
+            self.stream_id = FrameProtocol.open_session(
+                self.network_module.stream_socket, self.username)
+        except Exception as e:
+            print(f"Connection closed: {e}")
+            self.running = False
+        if self.running:
+            for channel in self.channels:
+                channel.start(self.stream_id)
+            for channel in self.channels:
+                channel.wait()
 
-            screen_np = self.streaming_module.capture_screen()
-            cam_frame = self.streaming_module.capture_camera_frame()
-            if cam_frame is None:
-                break
+        try:
+            Protocol.send(self.network_module.stream_socket, "STOP")
+        except Exception as e:
+            print(f"Connection closed: {e}")
+        self.stop_stream()
 
-            combined_frame = self.streaming_module.combine_frames(screen_np,
-                                                                  cam_frame)
-            if not self.send_frame(combined_frame):
-                break
+    def create_channels(self):
+        """
+        Creates the channels of the stream, either one combined channel or
+        independent screen and camera channels.
 
-        self.stop_stream()
+        The combined channel is sent without delta encoding: its camera
+        half changes in every frame, so its changed tiles would make most
+        frames keyframes anyway.
 
-    def send_frame(self, frame):
+        Returns:
+            list: The ClientChannelModule of every channel.
+        """
+        sock = self.network_module.stream_socket
+        streaming = self.streaming_module
+        if not SPLIT_STREAMS_ENABLED:
+            return [ClientChannelModule(CHANNEL_COMBINED,
+                                        streaming.capture_combined_frame,
+                                        streaming.combined_shape(), sock,
+                                        self.send_lock, FPS,
+                                        JPEG_COMPRESSION_QUALITY, False)]
+        screen_width, screen_height = streaming.screen_resolution
+        camera_width, camera_height = streaming.resolution
+        return [ClientChannelModule(CHANNEL_SCREEN, streaming.capture_screen,
+                                    (screen_height, screen_width, 3), sock,
+                                    self.send_lock, SCREEN_FPS,
+                                    SCREEN_JPEG_QUALITY,
+                                    DELTA_ENCODING_ENABLED,
+                                    SCREEN_BITRATE_SHARE),
+                ClientChannelModule(CHANNEL_CAMERA,
+                                    streaming.capture_camera_frame,
+                                    (camera_height, camera_width, 3), sock,
+                                    self.send_lock, CAMERA_FPS,
+                                    CAMERA_JPEG_QUALITY, False,
+                                    1.0 - SCREEN_BITRATE_SHARE)]
+
+    def send_frame(self, frame, capture_time):
         """
-        Encodes and sends a video frame to the server.
+        Encodes and sends a video frame on the first channel.
 
         Args:
             frame (numpy.ndarray): The video frame to send.
+            capture_time (float): The time the frame was captured.
 
         Returns:
             bool: True if the frame was sent successfully, False otherwise.
         """
-
-        Protocol.send(self.network_module.stream_socket, "STREAM")
-        result, encoded_frame = cv2. \
-            imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY,
-                                     JPEG_COMPRESSION_QUALITY])
-        if not result:
-            return False
-
-        frame_and_username = (encoded_frame, self.username)
-        data = pickle.dumps(frame_and_username,
-                            protocol=PICKLE_PROTOCOL_VERSION)
-        try:
-            Protocol.send_bin(self.network_module.stream_socket, data)
-            return True
-        except Exception as e:
-            print(f"Connection closed: {e}")
+        channel = self.channels[0]
+        encoded = channel.encode_frame((capture_time, frame))
+        if encoded is None:
             return False
+        return channel.send_encoded_frame(encoded)
 
     def stop_client(self):
         """
@@ -144,8 +205,10 @@ class Client:
         """
 
         # Ensure the running flag is False to stop threads
+        # The streaming thread sends "STOP" to end its session
         self.running = False
-        Protocol.send(self.network_module.stream_socket, "STOP")
+        for channel in self.channels:
+            channel.stop()
         # Wait for the streaming and listening threads to finish
         if self.stream_thread and self.stream_thread.is_alive():
             self.stream_thread.join()
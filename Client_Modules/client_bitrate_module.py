@@ -0,0 +1,137 @@
+"""
+client for adaptive bitrate
+Amit Skarbin
+"""
+
+import threading
+import time
+from Constants.constants import FPS, JPEG_COMPRESSION_QUALITY, \
+    JPEG_QUALITY_MIN, JPEG_QUALITY_MAX, JPEG_QUALITY_STEP, \
+    RESOLUTION_SCALE_MIN, FPS_MIN, BITRATE_ADJUST_INTERVAL, \
+    PIPELINE_QUEUE_SIZE
+
+
+class ClientBitrateModule:
+    """
+    Adapts JPEG quality, resolution and frame rate to the network.
+
+    Every sent frame reports how long the send took, how many bytes it was
+    and how full the send queue is. Once per adjust interval the module
+    lowers quality first, then resolution, then frame rate while the
+    network is congested, and raises them back in the opposite order when
+    there is headroom. A target bitrate published by the server caps the
+    stream as well.
+
+    Attributes:
+        quality (int): The JPEG quality to encode with.
+        scale (float): The resolution scale to encode at, 1.0 is full size.
+        fps (float): The frame rate to capture at.
+        target_bitrate (int): The bitrate in bits per second set by the
+        server, or None.
+    """
+
+    def __init__(self, max_fps=FPS, queue_size=PIPELINE_QUEUE_SIZE,
+                 quality=JPEG_COMPRESSION_QUALITY):
+        """
+        Initializes the module at the configured quality and full rate.
+
+        Args:
+            max_fps (float): The highest frame rate to use.
+            queue_size (int): The capacity of the send queue.
+            quality (int): The JPEG quality to start at.
+        """
+        self.max_fps = max_fps
+        self.queue_size = queue_size
+        self.quality = quality
+        self.scale = 1.0
+        self.fps = max_fps
+        self.target_bitrate = None
+        self.lock = threading.Lock()
+        self.reset_window()
+
+    def reset_window(self):
+        """
+        Starts a new measurement window.
+        """
+        self.window_start = time.monotonic()
+        self.window_bytes = 0
+        self.window_send_time = 0.0
+        self.window_frames = 0
+        self.window_congested = False
+
+    def set_target_bitrate(self, bitrate):
+        """
+        Sets the bitrate published by the server.
+
+        Args:
+            bitrate (int): Bits per second, or None to remove the cap.
+        """
+        with self.lock:
+            self.target_bitrate = bitrate
+
+    def frame_sent(self, size, send_time, queue_depth, dropped):
+        """
+        Records one sent frame and adjusts the settings when the window ends.
+
+        Args:
+            size (int): The bytes sent for the frame.
+            send_time (float): Seconds the send took.
+            queue_depth (int): Frames waiting in the send queue.
+            dropped (bool): Whether frames were dropped since the last one.
+
+        Returns:
+            bool: True if the settings changed.
+        """
+        with self.lock:
+            self.window_bytes += size
+            self.window_send_time += send_time
+            self.window_frames += 1
+            if dropped or queue_depth >= self.queue_size:
+                self.window_congested = True
+            elapsed = time.monotonic() - self.window_start
+            if elapsed < BITRATE_ADJUST_INTERVAL:
+                return False
+            bitrate = self.window_bytes * 8 / elapsed
+            busy = self.window_send_time / elapsed  # Share of time sending
+            congested = self.window_congested or busy > 0.5 or \
+                (self.target_bitrate is not None and
+                 bitrate > self.target_bitrate)
+            headroom = not self.window_congested and busy < 0.2 and \
+                (self.target_bitrate is None or
+                 bitrate < 0.8 * self.target_bitrate)
+            self.reset_window()
+            if congested:
+                return self.decrease()
+            if headroom:
+                return self.increase()
+            return False
+
+    def decrease(self):
+        """
+        Lowers quality, then resolution, then frame rate by one step.
+        """
+        if self.quality > JPEG_QUALITY_MIN:
+            self.quality = max(self.quality - JPEG_QUALITY_STEP,
+                               JPEG_QUALITY_MIN)
+        elif self.scale > RESOLUTION_SCALE_MIN:
+            self.scale = max(self.scale * 0.75, RESOLUTION_SCALE_MIN)
+        elif self.fps > FPS_MIN:
+            self.fps = max(self.fps * 0.75, FPS_MIN)
+        else:
+            return False
+        return True
+
+    def increase(self):
+        """
+        Raises frame rate, then resolution, then quality by one step.
+        """
+        if self.fps < self.max_fps:
+            self.fps = min(self.fps + 1, self.max_fps)
+        elif self.scale < 1.0:
+            self.scale = min(self.scale / 0.75, 1.0)
+        elif self.quality < JPEG_QUALITY_MAX:
+            self.quality = min(self.quality + JPEG_QUALITY_STEP // 2,
+                               JPEG_QUALITY_MAX)
+        else:
+            return False
+        return True
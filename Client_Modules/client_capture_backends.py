@@ -0,0 +1,173 @@
+"""
+client for screen capture backends
+Amit Skarbin
+"""
+
+import abc
+import time
+import cv2
+import numpy as np
+
+try:
+    import mss
+except ImportError:  # Optional fast backend
+    mss = None
+
+
+class CaptureBackend(abc.ABC):
+    """
+    Base class of the screen capture backends.
+
+    A backend grabs the screen already scaled to the streaming resolution,
+    as a BGR array. It writes into a caller's buffer when given one, so the
+    screen can land directly in a preallocated frame; otherwise the
+    returned array is a buffer the backend reuses, valid until the next
+    grab.
+
+    Attributes:
+        resolution (tuple): (width, height) of the grabbed frames.
+    """
+
+    def __init__(self, resolution):
+        """
+        Initializes the backend with its output resolution.
+
+        Args:
+            resolution (tuple): (width, height) of the grabbed frames.
+        """
+        self.resolution = resolution
+        self.frame = np.empty((resolution[1], resolution[0], 3), np.uint8)
+
+    @abc.abstractmethod
+    def grab(self, dst=None):
+        """
+        Grabs the current screen.
+
+        Args:
+            dst (numpy.ndarray): Optional. A (height, width, 3) uint8 array
+            or view to write the screen into.
+
+        Returns:
+            numpy.ndarray: The screen at the output resolution, in BGR.
+        """
+
+    def close(self):
+        """
+        Releases the backend's resources.
+        """
+
+
+class MssCaptureBackend(CaptureBackend):
+    """
+    Fast native capture through mss (XShm on Linux, BitBlt on Windows).
+
+    The grabbed BGRA pixels are used in place and downscaled before the
+    color conversion, so the only full screen pass is the resize itself.
+    mss handles belong to the thread that created them, so the handle is
+    created by the first grab, on the thread that captures.
+    """
+
+    def __init__(self, resolution, monitor_index=1):
+        """
+        Initializes the backend for one monitor.
+
+        Args:
+            resolution (tuple): (width, height) of the grabbed frames.
+            monitor_index (int): The mss monitor number, 1 is the primary.
+        """
+        super().__init__(resolution)
+        self.monitor_index = monitor_index
+        self.screen = None
+        self.monitor = None
+        self.scaled = np.empty((resolution[1], resolution[0], 4), np.uint8)
+
+    def grab(self, dst=None):
+        dst = self.frame if dst is None else dst
+        if self.screen is None:
+            self.screen = mss.mss()
+            self.monitor = self.screen.monitors[self.monitor_index]
+        shot = self.screen.grab(self.monitor)
+        pixels = np.frombuffer(shot.raw, np.uint8).reshape(
+            shot.height, shot.width, 4)
+        cv2.resize(pixels, self.resolution, dst=self.scaled,
+                   interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.scaled, cv2.COLOR_BGRA2BGR, dst=dst)
+        return dst
+
+    def close(self):
+        if self.screen is not None:
+            self.screen.close()
+            self.screen = None
+
+
+class PyAutoGuiCaptureBackend(CaptureBackend):
+    """
+    Portable capture through pyautogui screenshots.
+    """
+
+    def __init__(self, resolution):
+        super().__init__(resolution)
+        import pyautogui
+        self.pyautogui = pyautogui
+        self.scaled = np.empty((resolution[1], resolution[0], 3), np.uint8)
+
+    def grab(self, dst=None):
+        dst = self.frame if dst is None else dst
+        screen = np.asarray(self.pyautogui.screenshot())
+        # Downscale first so the color conversion works on the small frame
+        cv2.resize(screen, self.resolution, dst=self.scaled,
+                   interpolation=cv2.INTER_AREA)
+        cv2.cvtColor(self.scaled, cv2.COLOR_RGB2BGR, dst=dst)
+        return dst
+
+
+class SyntheticCaptureBackend(CaptureBackend):
+    """
+    Generates moving test frames, for headless testing and benchmarking.
+    """
+
+    def __init__(self, resolution):
+        super().__init__(resolution)
+        width, height = resolution
+        gradient = np.linspace(0, 255, width, dtype=np.uint8)
+        self.background = np.empty_like(self.frame)
+        self.background[:] = gradient[np.newaxis, :, np.newaxis]
+        self.start_time = time.monotonic()
+
+    def grab(self, dst=None):
+        dst = self.frame if dst is None else dst
+        width, height = self.resolution
+        np.copyto(dst, self.background)
+        # A bar sweeping across the screen once every two seconds
+        position = int((time.monotonic() - self.start_time) * width / 2)
+        bar = position % width
+        dst[:, bar:bar + width // 16] = (0, 0, 255)
+        cv2.putText(dst, time.strftime("%H:%M:%S"),
+                    (10, height - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.6,
+                    (255, 255, 255), 1)
+        return dst
+
+
+def create_capture_backend(name, resolution):
+    """
+    Creates a screen capture backend by name.
+
+    Args:
+        name (str): "mss", "pyautogui", "synthetic", or "auto" for mss when
+        it is installed and pyautogui otherwise.
+        resolution (tuple): (width, height) of the grabbed frames.
+
+    Returns:
+        CaptureBackend: The created backend.
+    """
+    if name == "auto":
+        name = "mss" if mss is not None else "pyautogui"
+    if name == "mss":
+        if mss is None:
+            raise ImportError("The mss capture backend needs the mss package")
+        return MssCaptureBackend(resolution)
+    if name == "pyautogui":
+        return PyAutoGuiCaptureBackend(resolution)
+    if name == "synthetic":
+        return SyntheticCaptureBackend(resolution)
+    raise ValueError(f"Unknown screen capture backend: {name}")
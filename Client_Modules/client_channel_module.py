@@ -0,0 +1,250 @@
+"""
+client for stream channels
+Amit Skarbin
+"""
+
+import time
+import cv2
+import numpy as np
+from Client_Modules.client_pipeline_module import ClientPipelineModule
+from Client_Modules.client_delta_encoding_module \
+    import ClientDeltaEncodingModule
+from Client_Modules.client_bitrate_module import ClientBitrateModule
+from Client_Modules.client_frame_arena_module import ClientFrameArenaModule
+from Client_Modules.client_static_scene_module import ClientStaticSceneModule
+from Protocols.frame_protocol import FrameProtocol
+
+
+class ClientChannelModule:
+    """
+    One independently encoded video channel of the client's stream.
+
+    A channel has its own capture source, pipeline, frame rate, JPEG quality,
+    bitrate adaptation and sequence numbers. All channels share the stream
+    socket, so sends are serialized with a shared lock. Frames are captured
+    into buffers of the channel's frame arena. A frame that did not change
+    is sent as a heartbeat, so the server keeps showing the last one.
+
+    Attributes:
+        channel (int): The CHANNEL_* value sent with every frame.
+        pipeline (ClientPipelineModule): The capture, encode and send stages
+        of the running channel.
+        delta_encoding_module (ClientDeltaEncodingModule): Encodes frames as
+        changed tiles, or None to send every frame whole.
+        static_scene_module (ClientStaticSceneModule): Detects unchanged
+        frames of channels without delta encoding, which finds them exactly.
+        bitrate_module (ClientBitrateModule): Adapts quality, resolution and
+        frame rate to the network.
+        frame_sequence (int): The sequence number of the next frame.
+        frame_arena (ClientFrameArenaModule): The buffers frames are
+        captured into.
+    """
+
+    def __init__(self, channel, capture, frame_shape, stream_socket,
+                 send_lock, fps, quality, delta_encoding, bitrate_share=1.0):
+        """
+        Initializes the channel.
+
+        Args:
+            channel (int): The CHANNEL_* value of the channel.
+            capture (function): Captures a frame into the buffer it is
+            given and returns it, or returns None to stop.
+            frame_shape (tuple): The (height, width, 3) shape of captured
+            frames.
+            stream_socket (socket.socket): The socket frames are sent on.
+            send_lock (threading.Lock): Serializes sends on the socket.
+            fps (float): The highest frame rate of the channel.
+            quality (int): The starting JPEG quality of the channel.
+            delta_encoding (bool): Whether to send changed tiles.
+            bitrate_share (float): The share of a server bitrate cap given
+            to this channel.
+        """
+        self.channel = channel
+        self.capture = capture
+        self.frame_arena = ClientFrameArenaModule(frame_shape)
+        self.scaled = None  # Reused when the bitrate module scales down
+        self.stream_socket = stream_socket
+        self.send_lock = send_lock
+        self.delta_encoding_module = ClientDeltaEncodingModule() \
+            if delta_encoding else None
+        self.static_scene_module = None if delta_encoding \
+            else ClientStaticSceneModule()
+        self.bitrate_module = ClientBitrateModule(fps, quality=quality)
+        self.bitrate_share = bitrate_share
+        self.stream_id = None
+        self.frame_sequence = 0
+        self.dropped_frames = 0
+        self.pipeline = None
+        self.running = False
+
+    def start(self, stream_id):
+        """
+        Starts the channel's pipeline.
+
+        Args:
+            stream_id (int): The stream id assigned at handshake.
+        """
+        self.stream_id = stream_id
+        self.running = True
+        self.pipeline = ClientPipelineModule(self.capture_frame,
+                                             self.encode_frame,
+                                             self.send_encoded_frame,
+                                             self.bitrate_module.fps,
+                                             release=self.release_frame)
+        self.pipeline.start()
+
+    def stop(self):
+        """
+        Stops the channel's pipeline.
+        """
+        self.running = False
+        if self.pipeline is not None:
+            self.pipeline.stop()
+
+    def wait(self):
+        """
+        Blocks until the channel's pipeline has finished.
+        """
+        if self.pipeline is not None:
+            self.pipeline.wait()
+
+    def set_target_bitrate(self, bitrate):
+        """
+        Applies the channel's share of the bitrate published by the server.
+
+        Args:
+            bitrate (int): Bits per second for the whole stream, or None to
+            remove the cap.
+        """
+        self.bitrate_module.set_target_bitrate(
+            None if bitrate is None else int(bitrate * self.bitrate_share))
+
+    def capture_frame(self):
+        """
+        Captures a frame from the channel's source.
+
+        Returns:
+            tuple: (capture_time, frame), or None if capture failed or the
+            channel is stopping.
+        """
+        if not self.running:
+            return None
+        capture_time = time.time()
+        buffer = self.frame_arena.acquire()
+        frame = self.capture(buffer)
+        if frame is None:
+            self.frame_arena.release(buffer)
+            return None
+        return capture_time, frame
+
+    def release_frame(self, captured):
+        """
+        Returns a captured frame's buffer to the arena once the pipeline is
+        done with it.
+
+        Args:
+            captured (tuple): (capture_time, frame) from capture_frame.
+        """
+        self.frame_arena.release(captured[1])
+
+    def encode_frame(self, captured):
+        """
+        Encodes a captured frame as JPEG, or as its changed tiles when delta
+        encoding is enabled.
+
+        Args:
+            captured (tuple): (capture_time, frame) from capture_frame.
+
+        Returns:
+            tuple: (capture_time, encoding) where encoding is ("key", jpeg)
+            or ("key", jpeg, sample) with the static scene sample of the
+            frame, ("delta", frame_size, tile_indices, jpeg) or
+            ("heartbeat",) for an unchanged frame, or None if encoding
+            failed.
+        """
+        capture_time, frame = captured
+        sample = None
+        if self.static_scene_module is not None:
+            if self.static_scene_module.unchanged(frame):
+                return capture_time, ("heartbeat",)
+            sample = self.static_scene_module.sample(frame)
+        quality = self.bitrate_module.quality
+        scale = self.bitrate_module.scale
+        if scale < 1.0:
+            height, width = frame.shape[:2]
+            shape = (int(height * scale), int(width * scale), 3)
+            if self.scaled is None or self.scaled.shape != shape:
+                self.scaled = np.empty(shape, np.uint8)
+            frame = cv2.resize(frame, (shape[1], shape[0]), dst=self.scaled,
+                               interpolation=cv2.INTER_AREA)
+        if self.delta_encoding_module is not None:
+            encoding = self.delta_encoding_module.encode(frame, quality)
+            if encoding is None:
+                return None
+            if encoding[0] == "delta" and not len(encoding[2]):
+                encoding = ("heartbeat",)  # No tile changed
+            return capture_time, encoding
+        result, encoded_frame = cv2. \
+            imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, quality])
+        if not result:
+            return None
+        return capture_time, ("key", encoded_frame, sample)
+
+    def send_encoded_frame(self, encoded):
+        """
+        Sends an encoded frame to the server and reports the send to the
+        bitrate module.
+
+        Args:
+            encoded (tuple): (capture_time, encoding) from encode_frame.
+
+        Returns:
+            bool: True if the frame was sent successfully, False otherwise.
+        """
+        capture_time, encoding = encoded
+        try:
+            with self.send_lock:
+                send_start = time.perf_counter()
+                if encoding[0] == "delta":
+                    frame_size, tile_indices, encoded_tiles = encoding[1:]
+                    size = FrameProtocol.send_delta(
+                        self.stream_socket, self.stream_id,
+                        self.frame_sequence, capture_time, frame_size,
+                        self.delta_encoding_module.tile_size, tile_indices,
+                        encoded_tiles, self.channel)
+                elif encoding[0] == "heartbeat":
+                    size = FrameProtocol.send_heartbeat(
+                        self.stream_socket, self.stream_id,
+                        self.frame_sequence, capture_time, self.channel)
+                else:
+                    size = FrameProtocol.send_frame(
+                        self.stream_socket, self.stream_id,
+                        self.frame_sequence, capture_time, encoding[1],
+                        self.channel)
+                send_time = time.perf_counter() - send_start
+            if encoding[0] == "key" and len(encoding) > 2:
+                self.static_scene_module.sent(encoding[2])
+            self.frame_sequence += 1
+            self.adapt_bitrate(size, send_time)
+            return True
+        except Exception as e:
+            print(f"Connection closed: {e}")
+            return False
+
+    def adapt_bitrate(self, size, send_time):
+        """
+        Feeds a sent frame to the bitrate module and applies a new frame
+        rate to the pipeline.
+
+        Args:
+            size (int): The bytes sent for the frame.
+            send_time (float): Seconds the send took.
+        """
+        if self.pipeline is None:
+            return
+        dropped = self.pipeline.dropped_frames != self.dropped_frames
+        self.dropped_frames = self.pipeline.dropped_frames
+        if self.bitrate_module.frame_sent(size, send_time,
+                                          self.pipeline.send_queue.qsize(),
+                                          dropped):
+            self.pipeline.pacer.set_fps(self.bitrate_module.fps)
@@ -0,0 +1,168 @@
+"""
+client for delta encoding
+Amit Skarbin
+"""
+
+import cv2
+import numpy as np
+from Constants.constants import DELTA_TILE_SIZE, DELTA_KEYFRAME_INTERVAL, \
+    DELTA_MAX_CHANGED_RATIO
+from Protocols.frame_protocol import TILE_INDEX_TYPE
+
+
+class ClientDeltaEncodingModule:
+    """
+    Encodes frames as changed tiles against the previous frame.
+
+    The frame is split into square tiles and the tiles that differ from the
+    previous frame are found with one vectorized comparison. Only those
+    tiles are encoded, stacked into one JPEG. A full keyframe is sent
+    periodically, and whenever most of the frame changed or its size did.
+    The comparison masks and the tile strip are reused between frames.
+
+    Attributes:
+        tile_size (int): The side of the square tiles in pixels.
+        keyframe_interval (int): Frames between forced keyframes.
+        max_changed_ratio (float): Above this share of changed tiles a
+        keyframe is sent instead of a delta.
+    """
+
+    def __init__(self, tile_size=DELTA_TILE_SIZE,
+                 keyframe_interval=DELTA_KEYFRAME_INTERVAL,
+                 max_changed_ratio=DELTA_MAX_CHANGED_RATIO):
+        """
+        Initializes the encoder with no previous frame.
+
+        Args:
+            tile_size (int): The side of the square tiles, a multiple of 16
+            so tiles line up with JPEG blocks.
+            keyframe_interval (int): Frames between forced keyframes.
+            max_changed_ratio (float): The share of changed tiles above which
+            a keyframe is sent.
+        """
+        self.tile_size = tile_size
+        self.keyframe_interval = keyframe_interval
+        self.max_changed_ratio = max_changed_ratio
+        self.previous = None
+        self.frames_since_keyframe = 0
+        self.differences = None
+        self.changed_pixels = None
+        self.strip = None
+
+    def request_keyframe(self):
+        """
+        Makes the next encoded frame a keyframe.
+        """
+        self.previous = None
+
+    def encode(self, frame, quality):
+        """
+        Encodes a frame as a keyframe or as its changed tiles.
+
+        Args:
+            frame (numpy.ndarray): The BGR frame to encode.
+            quality (int): The JPEG quality.
+
+        Returns:
+            tuple: ("key", jpeg) for a keyframe, ("delta", frame_size,
+            tile_indices, jpeg) for changed tiles, with empty tiles when
+            nothing changed, or None if encoding failed.
+        """
+        params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+        changed = None
+        if self.previous is not None and \
+                self.previous.shape == frame.shape and \
+                self.frames_since_keyframe < self.keyframe_interval:
+            changed = self.changed_tiles(frame)
+        if changed is None or \
+                len(changed) > self.max_changed_ratio * self.tile_count(frame):
+            result, encoded = cv2.imencode('.jpg', frame, params)
+            if not result:
+                return None
+            self.remember(frame)
+            self.frames_since_keyframe = 0
+            return "key", encoded
+        self.frames_since_keyframe += 1
+        frame_size = (frame.shape[1], frame.shape[0])
+        if not len(changed):
+            return "delta", frame_size, changed, b""
+        result, encoded = cv2.imencode('.jpg', self.stack_tiles(frame,
+                                                                changed),
+                                       params)
+        if not result:
+            return None
+        self.remember(frame)
+        return "delta", frame_size, changed, encoded
+
+    def tile_grid(self, frame):
+        """
+        Returns the (rows, cols) of tiles covering a frame.
+        """
+        height, width = frame.shape[:2]
+        return -(-height // self.tile_size), -(-width // self.tile_size)
+
+    def tile_count(self, frame):
+        """
+        Returns the number of tiles covering a frame.
+        """
+        rows, cols = self.tile_grid(frame)
+        return rows * cols
+
+    def changed_tiles(self, frame):
+        """
+        Finds the tiles that differ from the previous frame.
+
+        Args:
+            frame (numpy.ndarray): The new frame, same shape as the previous.
+
+        Returns:
+            numpy.ndarray: Row-major indices of the changed tiles.
+        """
+        height, width = frame.shape[:2]
+        rows, cols = self.tile_grid(frame)
+        size = self.tile_size
+        if self.differences is None or self.differences.shape != frame.shape:
+            self.differences = np.empty(frame.shape, bool)
+            # Padded to whole tiles, the padding stays False
+            self.changed_pixels = np.zeros((rows * size, cols * size), bool)
+        np.not_equal(frame, self.previous, out=self.differences)
+        np.any(self.differences, axis=2,
+               out=self.changed_pixels[:height, :width])
+        changed = self.changed_pixels.reshape(rows, size, cols, size).any(
+            axis=(1, 3))
+        return np.flatnonzero(changed).astype(TILE_INDEX_TYPE)
+
+    def stack_tiles(self, frame, tile_indices):
+        """
+        Copies the given tiles into one vertical strip.
+
+        Args:
+            frame (numpy.ndarray): The frame to take the tiles from.
+            tile_indices (numpy.ndarray): Row-major indices of the tiles.
+
+        Returns:
+            numpy.ndarray: The tiles stacked top to bottom, edge tiles padded,
+            a view of a buffer reused by the next call.
+        """
+        size = self.tile_size
+        rows, cols = self.tile_grid(frame)
+        if self.strip is None or len(self.strip) < len(tile_indices) * size:
+            self.strip = np.zeros((rows * cols * size, size, 3), np.uint8)
+        # The padding of edge tiles may hold older pixels, it is cropped
+        # by the receiver
+        strip = self.strip[:len(tile_indices) * size]
+        for position, index in enumerate(tile_indices):
+            row, col = divmod(int(index), cols)
+            tile = frame[row * size:(row + 1) * size,
+                         col * size:(col + 1) * size]
+            strip[position * size:position * size + tile.shape[0],
+                  :tile.shape[1]] = tile
+        return strip
+
+    def remember(self, frame):
+        """
+        Keeps a copy of the frame to compare the next one against.
+        """
+        if self.previous is None or self.previous.shape != frame.shape:
+            self.previous = np.empty_like(frame)
+        np.copyto(self.previous, frame)
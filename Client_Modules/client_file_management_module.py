@@ -3,7 +3,11 @@ client for file management
 Amit Skarbin
 """
 
+import hashlib
 import os
+import time
+from Constants.constants import FILE_TRANSFER_RETRIES, FILE_RETRY_DELAY, \
+    FILE_TRANSFER_MODE
 from Protocols.protocol import Protocol
 from Protocols.file_protocol import FileProtocol
 
@@ -15,59 +19,168 @@ class ClientFileManagementModule:
     This module handles file-related tasks such as uploading files to the
     server requesting and receiving files from the server.
 
+    A transfer cut off by a dropped connection is retried on a new
+    connection. Bulk transfers resume from what the receiver already has.
+
     Attributes:
         file_socket (socket.socket): Socket used for file-related communication
+        reconnect (function): Returns a new connected file socket, or None
+        when transfers are not retried.
+        last_download (tuple): (path, SHA-256) of the last downloaded file,
+        so an unchanged file is not downloaded again.
+        up_to_date (bool): Whether the last request found the downloaded
+        file unchanged.
+        no_file (bool): Whether the last request found no file to download.
     """
 
-    def __init__(self, file_socket):
+    def __init__(self, file_socket, reconnect=None):
         """
         Initializes the ClientFileManagementModule with a file socket.
 
         Args:
             file_socket (socket.socket): The socket used for file operations.
+            reconnect (function): Optional. Returns a new connected file
+            socket.
         """
         self.file_socket = file_socket
+        self.reconnect = reconnect
+        self.last_download = None
+        self.up_to_date = False
+        self.no_file = False
 
     def request_last_file(self):
         """
-        Requests the last uploaded file from the server.
+        Requests the last uploaded file from the server, with the hash of
+        the copy already downloaded if it is still there.
+
+        Raises:
+            OSError: If the request could not be sent.
         """
-        try:
-            Protocol.send(self.file_socket, "REQUEST_LAST_FILE")
-        except Exception as e:
-            print(f"Error requesting file: {e}")
+        command = "REQUEST_LAST_FILE"
+        if self.last_download is not None:
+            path, digest = self.last_download
+            if digest is not None and os.path.exists(path):
+                command += ":" + digest.hex()
+        Protocol.send(self.file_socket, command)
 
     def check_if_file_upload(self):
         response = Protocol.recv(self.file_socket)
-        if response == "NO_FILE":
+        self.up_to_date = response == "SAME_FILE"
+        self.no_file = response == "NO_FILE"
+        if self.no_file:
             print("no file available for download")
             return False
+        elif self.up_to_date:
+            print("the downloaded file is up to date")
+            return False
         else:
             return True
 
-    def receive_file_from_server(self, directory):
+    def receive_file_from_server(self, directory, progress=None):
         """
-        Receives a file from the server and saves it to the specified directory
+        Requests the last file from the server and saves it to the specified
+        directory.
+
+        If the connection drops, during the request or the file, the file is
+        requested again on a new connection and resumed.
 
         Args:
             directory (str): The directory where the file will be saved.
+            progress (function): Optional. Called with (bytes done, total
+            bytes) as the file arrives.
+
+        Returns:
+            bool: True if the file was received, False if it failed or there
+            was nothing to receive, see up_to_date and no_file.
         """
-        FileProtocol.recv_file(self.file_socket, directory)
-        print(f"File received and saved to {directory}")
+        self.up_to_date = self.no_file = False
+        for attempt in range(FILE_TRANSFER_RETRIES + 1):
+            try:
+                self.request_last_file()
+                if not self.check_if_file_upload():
+                    return False
+                self.last_download = FileProtocol.recv_file(
+                    self.file_socket, directory, progress)[:2]
+                print(f"File received and saved to {directory}")
+                return True
+            except (OSError, ValueError) as e:
+                print(f"Error receiving file: {e}")
+                if not self.retry_connection(attempt):
+                    return False
+        return False
 
-    def upload_file(self, file_path, username):
+    def upload_file(self, file_path, username, progress=None):
         """
         Uploads a selected file to the server.
 
+        The file is sent from a read-only mapping, the file itself is left
+        as it is. The server files it under the username. With
+        FILE_TRANSFER_MODE "chunked" it is sent in the old framed chunks,
+        for servers that predate bulk transfers, without resuming.
+
         Args:
             file_path (str): The path of the file to upload.
             username (str): The username of the client uploading the file.
+            progress (function): Optional. Called with (bytes done, total
+            bytes) as the file is sent.
+
+        Returns:
+            bool: True if the server received the file.
         """
+        remote_name = os.path.basename(file_path)
         try:
-            directory, base_name = os.path.split(file_path)
-            new_file_name = os.path.join(directory, username + "_" + base_name)
-            os.rename(file_path, new_file_name)
-            Protocol.send(self.file_socket, "UPLOAD_FILE")
-            FileProtocol.send_file(self.file_socket, new_file_name)
-        except Exception as e:
+            view = FileProtocol.map_file(file_path)
+        except OSError as e:
             print(f"Error uploading file: {e}")
+            return False
+        with view:  # Unmapped when done
+            digest = hashlib.sha256(view).digest()
+            for attempt in range(FILE_TRANSFER_RETRIES + 1):
+                try:
+                    Protocol.send(self.file_socket, f"UPLOAD_FILE:{username}")
+                    if FILE_TRANSFER_MODE == "chunked":
+                        FileProtocol.send_file(self.file_socket, file_path,
+                                               "chunked")
+                    else:
+                        FileProtocol.send_view(self.file_socket, remote_name,
+                                               view, digest,
+                                               progress=progress,
+                                               file_path=file_path)
+                    return True
+                except (OSError, ValueError) as e:
+                    print(f"Error uploading file: {e}")
+                    if not self.retry_connection(attempt):
+                        return False
+        return False
+
+    def reset_connection(self):
+        """
+        Replaces the file socket after a transfer was abandoned midway, so
+        the next command does not land in the middle of it.
+        """
+        if self.reconnect is None:
+            return
+        try:
+            self.file_socket = self.reconnect()
+        except OSError as e:
+            print(f"Error reconnecting: {e}")
+
+    def retry_connection(self, attempt):
+        """
+        Reconnects the file socket before another attempt.
+
+        Args:
+            attempt (int): The attempt that just failed, from 0.
+
+        Returns:
+            bool: True if there is a new connection to retry on.
+        """
+        if self.reconnect is None or attempt >= FILE_TRANSFER_RETRIES:
+            return False
+        time.sleep(FILE_RETRY_DELAY)
+        try:
+            self.file_socket = self.reconnect()
+            return True
+        except OSError as e:
+            print(f"Error reconnecting: {e}")
+            return False
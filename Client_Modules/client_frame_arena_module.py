@@ -0,0 +1,67 @@
+"""
+client for preallocated frame buffers
+Amit Skarbin
+"""
+
+import threading
+import numpy as np
+from Constants.constants import PIPELINE_QUEUE_SIZE
+
+
+class ClientFrameArenaModule:
+    """
+    A pool of preallocated frame buffers for the capture hot loop.
+
+    Captures are written straight into a buffer taken from the arena and the
+    buffer is handed back once the frame is encoded or dropped, so a running
+    stream allocates no frame sized arrays. The default size covers every
+    frame the pipeline can hold at once: a full encode queue, the frame
+    being encoded and the frame being captured.
+
+    Attributes:
+        shape (tuple): The (height, width, 3) shape of the buffers.
+        allocations (int): Buffers allocated because the arena was empty.
+    """
+
+    def __init__(self, shape, count=PIPELINE_QUEUE_SIZE + 2):
+        """
+        Initializes the arena with its buffers.
+
+        Args:
+            shape (tuple): The (height, width, 3) shape of the buffers.
+            count (int): The number of buffers to preallocate.
+        """
+        self.shape = shape
+        self.buffers = [np.empty(shape, np.uint8) for _ in range(count)]
+        self.free = list(self.buffers)
+        self.owned = {id(buffer) for buffer in self.buffers}
+        self.allocations = 0
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        """
+        Takes a free buffer, allocating one only if the arena is empty.
+
+        Returns:
+            numpy.ndarray: An uninitialized buffer of the arena's shape.
+        """
+        with self.lock:
+            if self.free:
+                return self.free.pop()
+            buffer = np.empty(self.shape, np.uint8)
+            self.buffers.append(buffer)
+            self.owned.add(id(buffer))
+            self.allocations += 1
+            return buffer
+
+    def release(self, buffer):
+        """
+        Returns a buffer to the arena. Arrays not taken from it are ignored.
+
+        Args:
+            buffer (numpy.ndarray): A buffer returned by acquire.
+        """
+        with self.lock:
+            if id(buffer) in self.owned and \
+                    not any(buffer is free for free in self.free):
+                self.free.append(buffer)
@@ -4,6 +4,7 @@ Amit Skarbin
 """
 
 import socket
+from Protocols.protocol import Protocol
 
 
 class ClientNetworkModule:
@@ -33,6 +34,9 @@ class ClientNetworkModule:
         self.stream_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.file_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.listen_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        for sock in (self.stream_socket, self.file_socket,
+                     self.listen_socket):
+            Protocol.configure_socket(sock)
 
     def connect_to_server(self):
         """
@@ -43,6 +47,20 @@ class ClientNetworkModule:
         self.listen_socket.connect((self.host, self.port))
         print("Client connection established.")
 
+    def reconnect_file_socket(self):
+        """
+        Replaces the file socket with a new connection, after a transfer
+        was cut off.
+
+        Returns:
+            socket.socket: The new file socket.
+        """
+        self.file_socket.close()
+        self.file_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        Protocol.configure_socket(self.file_socket)
+        self.file_socket.connect((self.host, self.port))
+        return self.file_socket
+
     def close_sockets(self):
         """
         Closes the streaming and file sockets.
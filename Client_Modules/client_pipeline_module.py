@@ -0,0 +1,188 @@
+"""
+client for the streaming pipeline
+Amit Skarbin
+"""
+
+import queue
+import threading
+import time
+from Constants.constants import FPS, PIPELINE_QUEUE_SIZE
+
+STOP_ITEM = object()  # Tells a stage to finish
+
+
+class FramePacer:
+    """
+    Paces a loop to a target frame rate.
+
+    Attributes:
+        interval (float): Seconds between frames.
+    """
+
+    def __init__(self, fps=FPS):
+        """
+        Initializes the pacer.
+
+        Args:
+            fps (float): The target frame rate.
+        """
+        self.interval = 1.0 / fps
+        self.next_time = None
+
+    def set_fps(self, fps):
+        """
+        Changes the target frame rate from the next frame on.
+
+        Args:
+            fps (float): The new target frame rate.
+        """
+        self.interval = 1.0 / fps
+
+    def wait(self):
+        """
+        Sleeps until the next frame is due.
+        """
+        now = time.monotonic()
+        if self.next_time is None:
+            self.next_time = now
+        delay = self.next_time - now
+        if delay > 0:
+            time.sleep(delay)
+        self.next_time += self.interval
+        if self.next_time < now:
+            # Fell behind, start over instead of bursting to catch up
+            self.next_time = now + self.interval
+
+
+class ClientPipelineModule:
+    """
+    Runs capture, encode and send as separate stages.
+
+    Each stage has its own thread and the stages are connected by small
+    bounded queues. When a later stage lags, the oldest captured frame is
+    dropped so that the frames which do go out are the newest ones and the
+    capture stage keeps its pace. Encoded frames are never dropped, since
+    later frames may be encoded against them, so the encode stage waits for
+    the send stage instead and the dropping happens before encoding.
+
+    Attributes:
+        pacer (FramePacer): Paces the capture stage.
+        encode_queue (queue.Queue): Captured frames waiting for encoding.
+        send_queue (queue.Queue): Encoded frames waiting to be sent.
+        dropped_frames (int): Frames dropped because a queue was full.
+        running (bool): Indicates whether the pipeline is running.
+    """
+
+    def __init__(self, capture, encode, send, fps=FPS,
+                 queue_size=PIPELINE_QUEUE_SIZE, release=None):
+        """
+        Initializes the pipeline with its stage functions.
+
+        Args:
+            capture (function): Returns a captured item, or None to stop.
+            encode (function): Turns a captured item into an encoded item,
+            or returns None to skip it.
+            send (function): Sends an encoded item, returns False to stop.
+            fps (float): The target capture frame rate.
+            queue_size (int): The capacity of each queue between stages.
+            release (function): Optional. Called with every captured item
+            once it is encoded or dropped, to reuse its buffer.
+        """
+        self.capture = capture
+        self.encode = encode
+        self.send = send
+        self.release = release
+        self.pacer = FramePacer(fps)
+        self.encode_queue = queue.Queue(maxsize=queue_size)
+        self.send_queue = queue.Queue(maxsize=queue_size)
+        self.dropped_frames = 0
+        self.running = False
+        self.threads = []
+
+    def start(self):
+        """
+        Starts a thread for every stage.
+        """
+        self.running = True
+        self.threads = [threading.Thread(target=stage, daemon=True)
+                        for stage in (self.capture_stage, self.encode_stage,
+                                      self.send_stage)]
+        for thread in self.threads:
+            thread.start()
+
+    def stop(self):
+        """
+        Stops the stages. Frames still queued are discarded.
+        """
+        self.running = False
+
+    def wait(self):
+        """
+        Blocks until every stage has finished.
+        """
+        for thread in self.threads:
+            thread.join()
+
+    def capture_stage(self):
+        """
+        Captures frames at the paced rate.
+        """
+        while self.running:
+            self.pacer.wait()
+            item = self.capture()
+            if item is None:
+                break
+            self.put_latest(self.encode_queue, item, self.release)
+        self.running = False
+        self.put_latest(self.encode_queue, STOP_ITEM)
+
+    def encode_stage(self):
+        """
+        Encodes captured frames.
+        """
+        while True:
+            item = self.encode_queue.get()
+            if item is STOP_ITEM:
+                break
+            encoded = self.encode(item)
+            if self.release is not None:
+                self.release(item)
+            if encoded is not None:
+                self.send_queue.put(encoded)
+        self.send_queue.put(STOP_ITEM)
+
+    def send_stage(self):
+        """
+        Sends encoded frames.
+        """
+        while True:
+            item = self.send_queue.get()
+            if item is STOP_ITEM:
+                break
+            if not self.running:
+                continue  # Drain until the stop marker
+            if not self.send(item):
+                self.running = False
+
+    def put_latest(self, frame_queue, item, release=None):
+        """
+        Queues an item, dropping the oldest queued frame if the queue is full.
+
+        Args:
+            frame_queue (queue.Queue): The queue to put the item in.
+            item: The item to queue.
+            release (function): Optional. Called with a dropped item.
+        """
+        while True:
+            try:
+                frame_queue.put_nowait(item)
+                return
+            except queue.Full:
+                try:
+                    dropped = frame_queue.get_nowait()
+                    if dropped is not STOP_ITEM:
+                        self.dropped_frames += 1
+                        if release is not None:
+                            release(dropped)
+                except queue.Empty:
+                    pass
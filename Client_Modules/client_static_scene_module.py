@@ -0,0 +1,97 @@
+"""
+client for static scene detection
+Amit Skarbin
+"""
+
+import time
+import cv2
+import numpy as np
+from Constants.constants import STATIC_SAMPLE_STEP, STATIC_PIXEL_THRESHOLD, \
+    STATIC_CHANGED_RATIO, STATIC_REFRESH_INTERVAL
+
+
+class ClientStaticSceneModule:
+    """
+    Detects frames that are nearly identical to the last frame sent.
+
+    Only a sparse grid of pixels is compared, so the check costs a small
+    fraction of an encode. Frames are compared with the last frame that was
+    sent rather than the previous capture, so a slow drift still adds up to
+    a change. A frame only becomes the reference once it was actually sent,
+    so a frame lost on the way is not taken for what the server shows. A
+    static frame is resent once per refresh interval anyway.
+
+    Attributes:
+        sample_step (int): The distance between compared pixels.
+        pixel_threshold (int): The largest difference treated as noise.
+        changed_ratio (float): The share of compared pixels that may change
+        in a static frame.
+        refresh_interval (float): Seconds after which a static frame is
+        reported as changed.
+    """
+
+    def __init__(self, sample_step=STATIC_SAMPLE_STEP,
+                 pixel_threshold=STATIC_PIXEL_THRESHOLD,
+                 changed_ratio=STATIC_CHANGED_RATIO,
+                 refresh_interval=STATIC_REFRESH_INTERVAL):
+        """
+        Initializes the module with no frame sent yet.
+
+        Args:
+            sample_step (int): The distance between compared pixels.
+            pixel_threshold (int): The largest difference treated as noise.
+            changed_ratio (float): The share of compared pixels that may
+            change in a static frame.
+            refresh_interval (float): Seconds after which a static frame is
+            reported as changed.
+        """
+        self.sample_step = sample_step
+        self.pixel_threshold = pixel_threshold
+        self.changed_ratio = changed_ratio
+        self.refresh_interval = refresh_interval
+        self.reference = None
+        self.difference = None
+        self.refreshed = 0.0
+
+    def unchanged(self, frame):
+        """
+        Checks a frame against the last frame sent.
+
+        Args:
+            frame (numpy.ndarray): The captured BGR frame.
+
+        Returns:
+            bool: True if a heartbeat can be sent instead of the frame.
+        """
+        sample = frame[::self.sample_step, ::self.sample_step]
+        if self.reference is None or self.reference.shape != sample.shape or \
+                time.monotonic() - self.refreshed >= self.refresh_interval:
+            return False
+        if self.difference is None or self.difference.shape != sample.shape:
+            self.difference = np.empty(sample.shape, np.uint8)
+        cv2.absdiff(sample, self.reference, dst=self.difference)
+        changed = np.count_nonzero(
+            self.difference.max(axis=2) > self.pixel_threshold)
+        return changed <= self.changed_ratio * len(sample) * sample.shape[1]
+
+    def sample(self, frame):
+        """
+        Returns a copy of the compared pixels of a frame, to pass to sent
+        once the frame went out. The frame's buffer is reused meanwhile.
+
+        Args:
+            frame (numpy.ndarray): The captured BGR frame.
+        """
+        return frame[::self.sample_step, ::self.sample_step].copy()
+
+    def sent(self, sample):
+        """
+        Makes a sent frame the new reference.
+
+        Args:
+            sample (numpy.ndarray): The frame's sample, from sample.
+        """
+        if self.reference is None or self.reference.shape != sample.shape:
+            self.reference = np.empty(sample.shape, np.uint8)
+        np.copyto(self.reference, sample)
+        self.refreshed = time.monotonic()
@@ -4,67 +4,107 @@ Amit Skarbin
 """
 
 import cv2
-import numpy as np
-import pyautogui
+from Client_Modules.client_capture_backends import create_capture_backend
 from Constants.constants import RESOLUTION_VERTICAL, RESOLUTION_HORIZONTAL, \
-    CAPTURE_DEVICE_INDEX
+    CAPTURE_DEVICE_INDEX, SCREEN_CAPTURE_BACKEND
 class ClientStreamingModule:
     """
     Manages the streaming of video data for the client.
     This module handles the capture of screen and camera frames and combines
-    them for streaming.
+    them for streaming. Every capture can write into a caller's buffer, so
+    frames are assembled in preallocated memory.
 
     Attributes:
-        resolution (tuple): The resolution for capturing video frames.
+        resolution (tuple): The resolution for capturing camera frames.
+        screen_resolution (tuple): The resolution for capturing the screen.
         camera (cv2.VideoCapture): The camera device for capturing video frames
+        screen_capture (CaptureBackend): The backend grabbing the screen.
     """
 
     def __init__(self,
-                 resolution=(RESOLUTION_VERTICAL, RESOLUTION_HORIZONTAL)):
+                 resolution=(RESOLUTION_VERTICAL, RESOLUTION_HORIZONTAL),
+                 capture_backend=SCREEN_CAPTURE_BACKEND,
+                 screen_resolution=None):
         """
         Initializes the ClientStreamingModule with a specified resolution.
 
         Args:
             resolution (tuple): The resolution to be used for video capture.
+            capture_backend (str): The screen capture backend, see
+            create_capture_backend.
+            screen_resolution (tuple): The resolution of the screen when it
+            differs from the camera's, None to use `resolution`.
         """
         self.resolution = resolution
+        self.screen_resolution = screen_resolution or resolution
         self.camera = cv2.VideoCapture(CAPTURE_DEVICE_INDEX)
+        self.camera_frame = None  # Reused by every camera read
+        self.screen_capture = create_capture_backend(capture_backend,
+                                                     self.screen_resolution)
 
-    def capture_screen(self):
+    def capture_screen(self, dst=None):
         """
         Captures the current screen.
 
+        Args:
+            dst (numpy.ndarray): Optional. The array or view to write the
+            screen into.
+
         Returns:
-            numpy.ndarray: An array representing the captured screen frame.
+            numpy.ndarray: An array representing the captured screen frame,
+            valid until the next capture when no dst is given.
         """
-        screen = pyautogui.screenshot()
-        screen_np = np.array(screen)
-        screen_np = cv2.cvtColor(screen_np, cv2.COLOR_BGR2RGB)
-        return cv2.resize(screen_np, self.resolution)
+        return self.screen_capture.grab(dst)
 
-    def capture_camera_frame(self):
+    def capture_camera_frame(self, dst=None):
         """
         Captures a frame from the camera.
 
+        Args:
+            dst (numpy.ndarray): Optional. The array or view to write the
+            resized camera frame into.
+
         Returns:
             numpy.ndarray: An array representing the captured camera frame.
             None if the frame capture fails.
         """
-        ret, cam_frame = self.camera.read()
+        ret, self.camera_frame = self.camera.read(self.camera_frame)
         if not ret:
             print("Failed to grab frame from camera. Exiting...")
             return None
-        return cv2.resize(cam_frame, self.resolution)
+        if dst is None:
+            return cv2.resize(self.camera_frame, self.resolution)
+        cv2.resize(self.camera_frame, self.resolution, dst=dst)
+        return dst
 
-    def combine_frames(self, screen_np, cam_frame):
+    def combined_shape(self):
+        """
+        Returns the (height, width, 3) shape of a combined frame.
         """
-        Combines the screen and camera frames horizontally.
+        width, height = self.resolution
+        return height, width + self.screen_resolution[0], 3
+
+    def capture_combined_frame(self, dst):
+        """
+        Captures the camera and screen side by side into one buffer. Each
+        source is written into its half directly, so combining them copies
+        nothing.
 
         Args:
-            screen_np (numpy.ndarray): The captured screen frame.
-            cam_frame (numpy.ndarray): The captured camera frame.
+            dst (numpy.ndarray): An array of combined_shape().
 
         Returns:
-            numpy.ndarray: An array representing the combined frame.
+            numpy.ndarray: dst, or None if the camera capture fails.
+        """
+        camera_width = self.resolution[0]
+        if self.capture_camera_frame(dst[:, :camera_width]) is None:
+            return None
+        self.capture_screen(dst[:, camera_width:])
+        return dst
+
+    def release(self):
+        """
+        Releases the camera and the screen capture backend.
         """
-        return np.hstack((cam_frame, screen_np))
+        self.camera.release()
+        self.screen_capture.close()
@@ -0,0 +1,205 @@
+"""
+client for background file transfers
+Amit Skarbin
+"""
+
+import queue
+import threading
+
+
+class TransferCancelled(Exception):
+    """
+    Raised inside a transfer to stop it when it was cancelled.
+    """
+
+
+class Transfer:
+    """
+    One queued upload or download and its progress.
+
+    Attributes:
+        kind (str): "upload" or "download".
+        path (str): The file to upload, or the directory to download into.
+        username (str): The username an upload is sent under.
+        status (str): "queued", "running", "done", "failed", "cancelled",
+        or for downloads "no_file" and "up_to_date".
+        done (int): Bytes transferred.
+        total (int): Bytes to transfer, 0 until known.
+        cancel_event (threading.Event): Set to cancel the transfer.
+    """
+
+    def __init__(self, kind, path, username=None):
+        """
+        Initializes a queued transfer.
+
+        Args:
+            kind (str): "upload" or "download".
+            path (str): The file to upload, or the directory to download
+            into.
+            username (str): The username an upload is sent under.
+        """
+        self.kind = kind
+        self.path = path
+        self.username = username
+        self.status = "queued"
+        self.done = 0
+        self.total = 0
+        self.cancel_event = threading.Event()
+
+    def progress(self, done, total):
+        """
+        Records progress. Called by the transfer, which is stopped here
+        when it was cancelled.
+
+        Raises:
+            TransferCancelled: If the transfer was cancelled.
+        """
+        self.done = done
+        self.total = total
+        if self.cancel_event.is_set():
+            raise TransferCancelled()
+
+    def cancel(self):
+        """
+        Cancels the transfer, before it starts or while it runs.
+        """
+        self.cancel_event.set()
+
+
+class ClientTransferModule:
+    """
+    Runs file transfers one after another on a background thread.
+
+    The GUI queues a transfer and returns at once, so the window and the
+    live stream keep running while a large file goes through. Transfers
+    report their progress on their Transfer object, and finished ones are
+    put on a queue for the GUI to poll.
+
+    Attributes:
+        file_management_module (ClientFileManagementModule): Performs the
+        transfers.
+        current (Transfer): The running transfer, or None.
+        unfinished (list): The queued and running transfers.
+        finished (queue.Queue): Transfers that ended, in order.
+    """
+
+    def __init__(self, file_management_module):
+        """
+        Initializes the module and starts its worker thread.
+
+        Args:
+            file_management_module (ClientFileManagementModule): Performs
+            the transfers.
+        """
+        self.file_management_module = file_management_module
+        self.pending = queue.Queue()
+        self.finished = queue.Queue()
+        self.current = None
+        self.unfinished = []  # Queued or running transfers, in order
+        self.lock = threading.Lock()  # Guards current and unfinished
+        self.worker_thread = threading.Thread(target=self.run_transfers,
+                                              daemon=True)
+        self.worker_thread.start()
+
+    def upload(self, file_path, username):
+        """
+        Queues an upload.
+
+        Args:
+            file_path (str): The path of the file to upload.
+            username (str): The username of the uploading client.
+
+        Returns:
+            Transfer: The queued transfer.
+        """
+        transfer = Transfer("upload", file_path, username)
+        self.queue_transfer(transfer)
+        return transfer
+
+    def download(self, directory):
+        """
+        Queues a download of the teacher's last file.
+
+        Args:
+            directory (str): The directory to save the file in.
+
+        Returns:
+            Transfer: The queued transfer.
+        """
+        transfer = Transfer("download", directory)
+        self.queue_transfer(transfer)
+        return transfer
+
+    def queue_transfer(self, transfer):
+        """
+        Queues a transfer for the worker thread.
+
+        Args:
+            transfer (Transfer): The transfer to queue.
+        """
+        with self.lock:
+            self.unfinished.append(transfer)
+        self.pending.put(transfer)
+
+    def cancel_all(self):
+        """
+        Cancels the running transfer and every queued one.
+
+        Every unfinished transfer is cancelled, including one the worker
+        thread has taken from the queue but not started yet.
+        """
+        with self.lock:
+            for transfer in self.unfinished:
+                transfer.cancel()
+
+    def run_transfers(self):
+        """
+        Runs queued transfers until the program exits. Runs on the worker
+        thread.
+        """
+        while True:
+            transfer = self.pending.get()
+            with self.lock:
+                # Checked under the lock, so a transfer cancel_all cancelled
+                # after it was taken from the queue is never started
+                cancelled = transfer.cancel_event.is_set()
+                if not cancelled:
+                    self.current = transfer
+                    transfer.status = "running"
+            if cancelled:
+                transfer.status = "cancelled"
+            else:
+                transfer.status = self.run_transfer(transfer)
+            with self.lock:
+                self.current = None
+                self.unfinished.remove(transfer)
+            self.finished.put(transfer)
+
+    def run_transfer(self, transfer):
+        """
+        Runs one transfer.
+
+        Returns:
+            str: The final status of the transfer.
+        """
+        files = self.file_management_module
+        try:
+            if transfer.kind == "upload":
+                ok = files.upload_file(transfer.path, transfer.username,
+                                       transfer.progress)
+                return "done" if ok else "failed"
+            if files.receive_file_from_server(transfer.path,
+                                              transfer.progress):
+                return "done"
+            elif files.up_to_date:
+                return "up_to_date"
+            elif files.no_file:
+                return "no_file"
+            return "failed"
+        except TransferCancelled:
+            # The connection is midway through the file, start a new one
+            files.reset_connection()
+            return "cancelled"
+        except Exception as e:
+            print(f"Error in {transfer.kind}: {e}")
+            return "failed"
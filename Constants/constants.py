@@ -4,16 +4,96 @@ Amit Skarbin
 """
 import cv2
 CHUNK_SIZE = 4096  # bytes
+# File transfers: "bulk" sends one header and the raw body, "chunked" the
+# old framed 4096 byte chunks for servers that predate bulk transfers
+FILE_TRANSFER_MODE = "bulk"
+FILE_BUFFER_SIZE = 1024 * 1024  # bytes read or written per file I/O call
+FILE_TRANSFER_RETRIES = 3  # Reconnects before a transfer is given up
+FILE_RETRY_DELAY = 1.0  # seconds before reconnecting
+# bytes of the exam file sent per call, so concurrent downloads interleave
+DISTRIBUTION_SLICE_SIZE = 256 * 1024
+# File body compression: "auto" measures a sample of each file against the
+# link speed, or always "none", "zlib" or "lzma"
+FILE_COMPRESSION = "auto"
+COMPRESSION_LINK_SPEED = 2 * 1024 * 1024  # bytes per second assumed
+COMPRESSION_SAMPLE_SIZE = 192 * 1024  # bytes compressed to measure a file
+COMPRESSION_MIN_SIZE = 64 * 1024  # smaller files are sent uncompressed
+COMPRESSION_QUEUE_SIZE = 4  # compressed pieces waiting to be sent
+
+# Socket options applied to every connection
+TCP_NODELAY_ENABLED = True  # Send small frames without Nagle delay
+SOCKET_SEND_BUFFER_SIZE = 1024 * 1024  # bytes, 0 keeps the OS default
+SOCKET_RECV_BUFFER_SIZE = 1024 * 1024  # bytes, 0 keeps the OS default
 
 # Constants for the client
 FPS = 10
 RESOLUTION_VERTICAL = 320
 RESOLUTION_HORIZONTAL = 240
 CAPTURE_DEVICE_INDEX = 0  # Index of the camera capture device
+# Screen capture backend: "auto", "mss", "pyautogui" or "synthetic"
+SCREEN_CAPTURE_BACKEND = "auto"
 JPEG_COMPRESSION_QUALITY = 50  # Compression quality for JPEG images
-PICKLE_PROTOCOL_VERSION = 4  # Protocol version for pickle
 # Time to wait between frames, calculated from FPS
 WAIT_TIME_PER_FRAME = int(1000 / FPS)
+PIPELINE_QUEUE_SIZE = 2  # Frames queued between pipeline stages
+# Send changed tiles instead of full frames, for split screen streams
+DELTA_ENCODING_ENABLED = True
+DELTA_TILE_SIZE = 32  # pixels, a multiple of 16 to match JPEG blocks
+DELTA_KEYFRAME_INTERVAL = 50  # Frames between forced full keyframes
+DELTA_MAX_CHANGED_RATIO = 0.5  # Send a keyframe when more tiles changed
+# Adaptive bitrate bounds
+JPEG_QUALITY_MIN = 20
+JPEG_QUALITY_MAX = 70
+JPEG_QUALITY_STEP = 10  # Quality lowered per congested interval
+RESOLUTION_SCALE_MIN = 0.5  # Smallest share of the streaming resolution
+FPS_MIN = 2
+BITRATE_ADJUST_INTERVAL = 1.0  # seconds between adjustments
+# Send screen and camera as two independent streams instead of one
+# side by side frame
+SPLIT_STREAMS_ENABLED = True
+SCREEN_FPS = FPS
+SCREEN_RESOLUTION = (2 * RESOLUTION_VERTICAL, 2 * RESOLUTION_HORIZONTAL)
+SCREEN_JPEG_QUALITY = 60  # Readable screen text matters most
+SCREEN_BITRATE_SHARE = 0.75  # Share of a server bitrate cap for the screen
+CAMERA_FPS = 5
+CAMERA_RESOLUTION = (RESOLUTION_VERTICAL, RESOLUTION_HORIZONTAL)
+CAMERA_JPEG_QUALITY = 40
+# Static scene suppression: unchanged frames are sent as heartbeats
+STATIC_SAMPLE_STEP = 4  # Compare every 4th pixel on both axes
+STATIC_PIXEL_THRESHOLD = 16  # Differences up to this are camera noise
+STATIC_CHANGED_RATIO = 0.002  # Share of sampled pixels allowed to change
+STATIC_REFRESH_INTERVAL = 5.0  # seconds until a static frame is resent
 
 # Constants for the server
 FRAME_DECODE_COLOR_MODE = cv2.IMREAD_COLOR  # Color mode for frame decoding
+SERVER_NETWORK_ENGINE = "threaded"  # "threaded" or "asyncio"
+SERVER_LISTEN_BACKLOG = 128  # Pending connections queued at exam start
+SERVER_WORKER_THREADS = 4  # Executor size of the asyncio engine
+# Bitrate cap asked of every client's stream, bits per second, 0 for none
+TARGET_BITRATE = 0
+# Threads of the asyncio engine for file transfers, which block for the
+# whole transfer, so a class downloading at once is served together
+FILE_WORKER_THREADS = 64
+DECODE_WORKER_KIND = "thread"  # "thread" or "process" decode pool
+DECODE_WORKERS = 4  # Number of frame decode workers
+RECORDING_ENABLED = False  # Record every student's stream to disk
+RECORDINGS_ROOT = "C:/recordings"
+RECORDING_QUEUE_SIZE = 4096  # Frames waiting for the writer thread
+RECORDING_BATCH_SIZE = 4 * 1024 * 1024  # bytes written per batch at most
+RECORDING_SEGMENT_SIZE = 256 * 1024 * 1024  # bytes before a new segment
+REWIND_SECONDS = 60  # Seconds of encoded frames kept per student
+REWIND_MEMORY_LIMIT = 256 * 1024 * 1024  # bytes kept for all students
+SUBMISSIONS_ROOT = "C:/client_files"  # <root>/<exam>/<student>/<file>
+SUBMISSIONS_EXPORT_ROOT = "C:/test"  # Where exported exam archives go
+DEFAULT_EXAM_NAME = "exam"  # Used before the teacher uploads an exam file
+# Seconds an upload waits for another upload of the same content before
+# taking over from it, in case that one stalled
+SUBMISSION_CLAIM_TIMEOUT = 30.0
+
+# Constants for the teacher GUI
+DISPLAY_REFRESH_RATE = 15  # Display pump ticks per second
+# Time between display pump ticks, calculated from DISPLAY_REFRESH_RATE
+DISPLAY_REFRESH_INTERVAL = int(1000 / DISPLAY_REFRESH_RATE)
+# "mosaic" draws all students into one image, "labels" uses a Tk label and
+# image per student
+DISPLAY_RENDER_MODE = "mosaic"
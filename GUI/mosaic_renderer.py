@@ -0,0 +1,135 @@
+"""
+Mosaic renderer
+Amit Skarbin
+
+Draws all student streams of the teacher grid into one image.
+"""
+
+import tkinter as tk
+import cv2
+import numpy as np
+from PIL import Image, ImageTk
+
+
+class MosaicRenderer:
+    """
+    Renders the teacher grid as a single image.
+
+    Frames are resized straight into their tile of a preallocated canvas.
+    On every refresh the canvas is pasted into one reused PhotoImage shown
+    by one Label, so Tk creates no image per frame and a refresh costs the
+    same with 5 or 50 students. The BGR canvas is read by PIL directly,
+    without an RGB copy.
+
+    Attributes:
+        label (tk.Label): The label showing the mosaic.
+        canvas (numpy.ndarray): The mosaic in BGR.
+        tiles (dict): Maps student ids to their (x, y, width, height) tile.
+        frames (dict): Maps student ids to their last (frame, username), to
+        redraw when the layout changes.
+        render_cache (RenderCache): Fitted positions and username overlays.
+        dirty (bool): Whether the canvas changed since it was last shown.
+    """
+
+    def __init__(self, parent, render_cache):
+        """
+        Initializes the renderer with no canvas yet.
+
+        Args:
+            parent (tk.Widget): The widget the mosaic label is placed in.
+            render_cache (RenderCache): The cache of per-student drawing
+            state.
+        """
+        self.label = tk.Label(parent, borderwidth=0, highlightthickness=0)
+        self.render_cache = render_cache
+        self.canvas = None
+        self.photo = None
+        self.tiles = {}
+        self.frames = {}
+        self.dirty = False
+
+    def set_layout(self, size, tiles):
+        """
+        Sets the canvas size and the tile of every student, redrawing the
+        last frames. Nothing is reallocated or redrawn when the layout did
+        not change.
+
+        Args:
+            size (tuple): (width, height) of the canvas.
+            tiles (dict): Maps student ids to their (x, y, width, height)
+            tile.
+        """
+        width, height = size
+        if self.canvas is None or self.canvas.shape[:2] != (height, width):
+            self.canvas = np.zeros((height, width, 3), np.uint8)
+            self.photo = ImageTk.PhotoImage("RGB", (width, height))
+            self.label.configure(image=self.photo)
+            self.tiles = {}
+        if tiles != self.tiles:
+            self.canvas[:] = 0
+            self.tiles = dict(tiles)
+            self.render_cache.invalidate_geometry()
+            self.dirty = True
+            for student_id, (frame, username) in list(self.frames.items()):
+                self.draw(student_id, frame, username)
+
+    def draw(self, student_id, frame, username):
+        """
+        Draws a student's frame into its tile, fitted with its aspect ratio.
+
+        Args:
+            student_id (str): The unique identifier of the student.
+            frame (numpy.ndarray): The BGR frame to draw.
+            username (str): The name drawn over the frame.
+        """
+        self.frames[student_id] = (frame, username)
+        tile = self.tiles.get(student_id)
+        if tile is None:
+            return
+        (left, top, width, height), changed = self.render_cache.fit(
+            student_id, tile, frame.shape)
+        if changed:
+            # New layout or frame size, clear the old letterbox
+            x, y, tile_width, tile_height = tile
+            self.canvas[y:y + tile_height, x:x + tile_width] = 0
+        view = self.canvas[top:top + height, left:left + width]
+        cv2.resize(frame, (width, height), dst=view,
+                   interpolation=cv2.INTER_AREA)
+        self.render_cache.draw_overlay(student_id, username, view)
+        self.dirty = True
+
+    def forget(self, student_id):
+        """
+        Drops a removed student's last frame.
+
+        Args:
+            student_id (str): The unique identifier of the student.
+        """
+        self.frames.pop(student_id, None)
+
+    def present(self):
+        """
+        Shows the canvas if it changed since the last call.
+        """
+        if not self.dirty or self.canvas is None:
+            return
+        height, width = self.canvas.shape[:2]
+        self.photo.paste(Image.frombuffer("RGB", (width, height), self.canvas,
+                                          "raw", "BGR", 0, 1))
+        self.dirty = False
+
+    def student_at(self, x, y):
+        """
+        Finds the student whose tile contains a point of the label.
+
+        Args:
+            x (int): The horizontal position in pixels.
+            y (int): The vertical position in pixels.
+
+        Returns:
+            str: The student id, or None if the point is not on a tile.
+        """
+        for student_id, (left, top, width, height) in self.tiles.items():
+            if left <= x < left + width and top <= y < top + height:
+                return student_id
+        return None
@@ -0,0 +1,120 @@
+"""
+Render cache
+Amit Skarbin
+
+Per-student drawing state reused between frames of the teacher display.
+"""
+
+import cv2
+import numpy as np
+
+OVERLAY_FONT = cv2.FONT_HERSHEY_SIMPLEX
+OVERLAY_SCALE = 0.6
+OVERLAY_THICKNESS = 2
+OVERLAY_ORIGIN = (10, 20)  # Baseline start of the username, in pixels
+
+
+class RenderCache:
+    """
+    Keeps what drawing a student's frame needs, so it is not recomputed for
+    every frame.
+
+    The fitted position of a student's frame in its tile is kept until the
+    layout or the frame size changes, and the username is rendered once
+    into an alpha mask that is then blended onto each frame.
+
+    Attributes:
+        geometries (dict): Maps student ids to (tile, frame shape, fitted
+        (left, top, width, height)).
+        overlays (dict): Maps student ids to (username, alpha, (left, top)).
+    """
+
+    def __init__(self):
+        """
+        Initializes an empty cache.
+        """
+        self.geometries = {}
+        self.overlays = {}
+
+    def fit(self, student_id, tile, frame_shape):
+        """
+        Returns where a frame is drawn in a tile, keeping its aspect ratio.
+
+        Args:
+            student_id (str): The unique identifier of the student.
+            tile (tuple): (x, y, width, height) of the student's tile.
+            frame_shape (tuple): The shape of the frame.
+
+        Returns:
+            tuple: ((left, top, width, height), changed) where changed is
+            True if the position was just computed, so the tile needs to be
+            cleared.
+        """
+        frame_shape = frame_shape[:2]
+        geometry = self.geometries.get(student_id)
+        if geometry is not None and geometry[:2] == (tile, frame_shape):
+            return geometry[2], False
+        x, y, width, height = tile
+        frame_height, frame_width = frame_shape
+        scale = min(width / frame_width, height / frame_height)
+        fit_width = max(int(frame_width * scale), 1)
+        fit_height = max(int(frame_height * scale), 1)
+        rect = (x + (width - fit_width) // 2, y + (height - fit_height) // 2,
+                fit_width, fit_height)
+        self.geometries[student_id] = (tile, frame_shape, rect)
+        return rect, True
+
+    def draw_overlay(self, student_id, username, view):
+        """
+        Blends the username onto a frame from its pre-rendered mask.
+
+        Args:
+            student_id (str): The unique identifier of the student.
+            username (str): The name to draw.
+            view (numpy.ndarray): The BGR frame or canvas view to draw on.
+        """
+        overlay = self.overlays.get(student_id)
+        if overlay is None or overlay[0] != username:
+            overlay = (username,) + self.render_overlay(username)
+            self.overlays[student_id] = overlay
+        _, alpha, (left, top) = overlay
+        region = view[top:top + alpha.shape[0], left:left + alpha.shape[1]]
+        alpha = alpha[:region.shape[0], :region.shape[1]]
+        # White text over the frame, anti-aliased edges blended
+        np.copyto(region, region + (255 - region) * alpha, casting='unsafe')
+
+    def render_overlay(self, username):
+        """
+        Renders a username into an alpha mask of its own size.
+
+        Returns:
+            tuple: (alpha, (left, top)) where alpha is a float32 array of
+            shape (height, width, 1) and (left, top) its position in the
+            frame.
+        """
+        margin = OVERLAY_THICKNESS
+        (text_width, text_height), baseline = cv2.getTextSize(
+            username, OVERLAY_FONT, OVERLAY_SCALE, OVERLAY_THICKNESS)
+        mask = np.zeros((text_height + baseline + 2 * margin,
+                         text_width + 2 * margin), np.uint8)
+        cv2.putText(mask, username, (margin, text_height + margin),
+                    OVERLAY_FONT, OVERLAY_SCALE, 255, OVERLAY_THICKNESS)
+        alpha = (mask / np.float32(255))[:, :, np.newaxis]
+        return alpha, (OVERLAY_ORIGIN[0] - margin,
+                       OVERLAY_ORIGIN[1] - text_height - margin)
+
+    def invalidate_geometry(self):
+        """
+        Forgets every fitted position, after the layout changed.
+        """
+        self.geometries.clear()
+
+    def forget(self, student_id):
+        """
+        Drops a removed student's state.
+
+        Args:
+            student_id (str): The unique identifier of the student.
+        """
+        self.geometries.pop(student_id, None)
+        self.overlays.pop(student_id, None)
@@ -6,10 +6,13 @@ A GUI for the student client to enter their name and start streaming.
 """
 
 import os
+import queue
 import sys
 from tkinter import Tk, StringVar, messagebox, filedialog, ttk
 from Client_Modules.client import Client
 
+TRANSFER_POLL_INTERVAL = 100  # ms between transfer progress updates
+
 
 class ClientGUI:
     """
@@ -74,6 +77,19 @@ class ClientGUI:
         ttk.Button(main_frame, text="Open File", command=self.open_file).grid(
             row=3, column=0, sticky='EW', columnspan=2)
 
+        # Background transfer progress
+        self.transfer_var = StringVar()
+        ttk.Label(main_frame, textvariable=self.transfer_var).grid(
+            row=4, column=0, sticky='W')
+        ttk.Button(main_frame, text="Cancel Transfers",
+                   command=self.client.transfer_module.cancel_all).grid(
+            row=4, column=1, sticky='EW')
+        self.transfer_progress = ttk.Progressbar(main_frame,
+                                                 mode='determinate')
+        self.transfer_progress.grid(row=5, column=0, sticky='EW',
+                                    columnspan=2)
+        self.watch_transfers()
+
         # Enable window resizing
         self.window.resizable(True, True)
         self.window.columnconfigure(0, weight=1)
@@ -209,39 +225,73 @@ class ClientGUI:
 
     def select_file_to_upload(self):
         """
-        Opens a file dialog to select a file and uploads it to the server.
+        Opens a file dialog to select a file and queues its upload to the
+        server.
         """
         if self.check_stream_started():
             username = self.username_var.get()
             file_path = filedialog.askopenfilename()
             if file_path:
-                self.client.file_management_module.upload_file(file_path,
-                                                               username)
-                messagebox.showinfo("Upload",
-                                    "File successfully uploaded "
-                                    "to the teacher.")
+                self.client.transfer_module.upload(file_path, username)
 
     def download_file(self):
         """
-        Requests the last file from the server and saves it if available.
-        Shows a message if no file is available.
+        Queues a download of the last file from the server. The result is
+        shown by watch_transfers.
         """
         if self.check_stream_started():
             directory = "C:/testKeeper"
             if not os.path.exists(directory):
                 os.makedirs(directory)
+            self.client.transfer_module.download(directory)
 
-            # Request the last file from the server
-            self.client.file_management_module.request_last_file()
-            check = self.client.file_management_module.check_if_file_upload()
-            if not check:
-                messagebox.showinfo("Download",
-                                    "No file available for download.")
-            else:
-                self.client.file_management_module.receive_file_from_server(
-                    directory)
-                messagebox.showinfo("Download Complete",
-                                    f"File saved to {directory}")
+    def watch_transfers(self):
+        """
+        Shows the progress of the running transfer and the result of
+        finished ones. Runs every TRANSFER_POLL_INTERVAL ms.
+        """
+        transfers = self.client.transfer_module
+        current = transfers.current
+        if current is not None and current.total:
+            self.transfer_progress['value'] = \
+                100 * current.done / current.total
+            self.transfer_var.set(f"{current.kind.capitalize()} "
+                                  f"{current.done * 100 // current.total}%")
+        while True:
+            try:
+                transfer = transfers.finished.get_nowait()
+            except queue.Empty:
+                break
+            self.transfer_progress['value'] = 0
+            self.transfer_var.set("")
+            self.show_transfer_result(transfer)
+        self.window.after(TRANSFER_POLL_INTERVAL, self.watch_transfers)
+
+    def show_transfer_result(self, transfer):
+        """
+        Tells the student how a transfer ended.
+
+        Args:
+            transfer (Transfer): The finished transfer.
+        """
+        if transfer.status == "cancelled":
+            messagebox.showinfo("Transfer", f"The {transfer.kind} was "
+                                            f"cancelled.")
+        elif transfer.status == "failed":
+            messagebox.showerror("Transfer", f"File {transfer.kind} failed.")
+        elif transfer.kind == "upload":
+            messagebox.showinfo("Upload",
+                                "File successfully uploaded "
+                                "to the teacher.")
+        elif transfer.status == "up_to_date":
+            messagebox.showinfo("Download",
+                                "You already have the latest file.")
+        elif transfer.status == "no_file":
+            messagebox.showinfo("Download",
+                                "No file available for download.")
+        else:
+            messagebox.showinfo("Download Complete",
+                                f"File saved to {transfer.path}")
 
     def run(self):
         """
@@ -6,15 +6,22 @@ GUI for the teacher to monitor video streams from students.
 """
 
 import os
-import shutil
 import threading
 import tkinter as tk
 from tkinter import Label, messagebox, filedialog, Toplevel, ttk
 from PIL import Image, ImageTk
 import math
 from Server_Modules.server import Server
+from Server_Modules.server_composite_module import ServerCompositeModule
+from Protocols.frame_protocol import CHANNEL_CAMERA, CHANNELS
+from Constants.constants import DISPLAY_REFRESH_INTERVAL, \
+    DISPLAY_RENDER_MODE, SUBMISSIONS_EXPORT_ROOT
+from GUI.mosaic_renderer import MosaicRenderer
+from GUI.render_cache import RenderCache
 import cv2
 
+STREAMS_PADDING = 30  # pixels around the student streams
+
 
 class ServerGUI:
     """
@@ -33,14 +40,21 @@ class ServerGUI:
             port (int): The port number on which the server is listening.
             resolution (tuple): The resolution for displaying video streams.
         """
-        self.server = Server(host, port, self.new_frame_received)
+        self.server = Server(host, port, self.new_frame_received,
+                             use_frame_slots=True, use_rewind=True)
         self.window = tk.Tk()
         self.window.title("Teacher's Dashboard")
         self.resolution = resolution
         self.aspect_ratio = resolution[1] / resolution[0]
         self.student_frames = {}
+        self.tile_sizes = {}
+        self.student_addresses = {}
+        self.composite_module = ServerCompositeModule()
         self.filename = None
         self.fullscreen_student_id = None
+        self.fullscreen_size = None
+        self.render_cache = RenderCache()
+        self.mosaic = None
         self.setup_gui()
 
     def setup_gui(self):
@@ -53,7 +67,7 @@ class ServerGUI:
         style.configure('TLabel', font=('Arial', 12), padding=5)
 
         # Main layout frame
-        self.streams_frame = ttk.Frame(self.window, padding="30 30 30 30")
+        self.streams_frame = ttk.Frame(self.window, padding=STREAMS_PADDING)
         self.streams_frame.pack(fill=tk.BOTH, expand=True)
         self.streams_frame.columnconfigure(0, weight=1)
         self.streams_frame.rowconfigure(0, weight=1)
@@ -73,6 +87,13 @@ class ServerGUI:
                                            font=('Arial', 16))
         self.placeholder_label.pack(fill=tk.BOTH, expand=True)
 
+        if DISPLAY_RENDER_MODE == "mosaic":
+            self.mosaic = MosaicRenderer(self.streams_frame,
+                                         self.render_cache)
+            self.mosaic.label.bind('<Double-Button-1>',
+                                   self.on_mosaic_double_click)
+            self.mosaic.label.bind('<Button-3>', self.on_mosaic_right_click)
+
         # Window properties
         self.window.protocol("WM_DELETE_WINDOW", self.on_closing)
         self.window.bind('<Configure>', self.on_window_resize)
@@ -84,6 +105,9 @@ class ServerGUI:
         # Start server
         self.start_server()
 
+        # Start pulling frames for display
+        self.display_pump()
+
     def on_window_resize(self, event=None):
         """
         Responds to the window resize event to update the layout
@@ -127,19 +151,23 @@ class ServerGUI:
 
     def download_all_files(self):
         """
-        Moves all files from 'C:\\client_files' to 'C:/test/'
-        with a filename prefix.
+        Exports every submission of the current exam into one zip archive
+        in SUBMISSIONS_EXPORT_ROOT, on a background thread.
         """
-        source_directory = "C:\\client_files"
-        destination_directory = f"C:/test/{self.filename}"
-        if not os.path.exists(destination_directory):
-            os.makedirs(destination_directory)
-        for file_name in os.listdir(source_directory):
-            source_file = os.path.join(source_directory, file_name)
-            destination_file = os.path.join(destination_directory, file_name)
-            shutil.move(source_file, destination_file)
-        messagebox.showinfo("Download Complete",
-                            f"File saved to {destination_directory}")
+        submissions = self.server.file_management_module.submission_module
+        archive_path = os.path.join(SUBMISSIONS_EXPORT_ROOT,
+                                    f"{submissions.exam}.zip")
+
+        def export():
+            try:
+                count = submissions.export(archive_path)
+                self.window.after(0, messagebox.showinfo, "Download Complete",
+                                  f"{count} files saved to {archive_path}")
+            except Exception as e:
+                self.window.after(0, messagebox.showerror, "Download",
+                                  f"Export failed: {e}")
+
+        threading.Thread(target=export, daemon=True).start()
 
     def start_server(self):
         """
@@ -155,13 +183,89 @@ class ServerGUI:
         # Hide the placeholder message when a student connects
         self.placeholder_label.pack_forget()
         self.logo_label.pack_forget()
+        if self.mosaic is not None:
+            # All students share the mosaic label
+            self.mosaic.label.grid(row=0, column=0, sticky='nsew')
+            self.student_frames[student_id] = self.mosaic.label
+            self.update_layout()
+            return
         frame_label = Label(self.streams_frame)
         frame_label.bind('<Double-Button-1>',
                          lambda e, sid=student_id: self.toggle_fullscreen(sid))
+        frame_label.bind('<Button-3>',
+                         lambda e, sid=student_id: self.open_rewind_view(sid))
         frame_label.grid(row=999, column=999)  # Initially place out of view
         self.student_frames[student_id] = frame_label
         self.update_layout()
 
+    def on_mosaic_double_click(self, event):
+        """
+        Toggles fullscreen for the student under the cursor in the mosaic.
+        """
+        student_id = self.mosaic.student_at(event.x, event.y)
+        if student_id is not None:
+            self.toggle_fullscreen(student_id)
+
+    def on_mosaic_right_click(self, event):
+        """
+        Opens the rewind view of the student under the cursor in the mosaic.
+        """
+        student_id = self.mosaic.student_at(event.x, event.y)
+        if student_id is not None:
+            self.open_rewind_view(student_id)
+
+    def open_rewind_view(self, student_id):
+        """
+        Opens a window to scrub back through a student's last seconds.
+
+        The window covers what the server's rewind buffer holds when it
+        opens. A frame is only decoded when the slider is moved to it.
+
+        Args:
+            student_id (str): The unique identifier of the student.
+        """
+        rewind_module = self.server.rewind_module
+        client_address = self.student_addresses.get(student_id)
+        if rewind_module is None or client_address is None:
+            return
+        timeline = rewind_module.timeline(client_address)
+        if timeline is None:
+            messagebox.showinfo("Rewind", "Nothing to rewind yet.")
+            return
+        start, end = timeline
+        channels = rewind_module.channels(client_address)
+        composite_module = ServerCompositeModule()
+
+        view = Toplevel(self.window)
+        view.title(f"Rewind {student_id}")
+        image_label = Label(view)
+        image_label.pack()
+        time_label = ttk.Label(view)
+        time_label.pack()
+
+        def show(position):
+            timestamp = start + float(position)
+            frame = None
+            for channel in channels:
+                channel_frame = rewind_module.decode_at(
+                    (client_address, channel), timestamp)
+                if channel_frame is not None:
+                    frame = composite_module.update(student_id, channel,
+                                                    channel_frame)
+            time_label.configure(text=f"-{end - timestamp:.1f} s")
+            if frame is None:
+                return
+            height, width = frame.shape[:2]
+            photo = ImageTk.PhotoImage(Image.frombuffer(
+                "RGB", (width, height), frame, "raw", "BGR", 0, 1))
+            image_label.configure(image=photo)
+            image_label.image = photo  # Keep a reference
+
+        slider = ttk.Scale(view, from_=0, to=end - start, length=400,
+                           command=show)
+        slider.pack(fill=tk.X, padx=10, pady=10)
+        slider.set(end - start)
+
     def toggle_fullscreen(self, student_id):
         """
         Toggles the fullscreen mode for a selected student stream.
@@ -181,6 +285,10 @@ class ServerGUI:
         Args:
             student_id (str): The unique identifier of the student.
         """
+        if self.mosaic is not None:
+            self.update_mosaic_layout()
+            return
+
         # Hide all frames
         for sid, frame_label in self.student_frames.items():
             frame_label.grid_forget()
@@ -203,30 +311,97 @@ class ServerGUI:
 
         # Set the size of the frame label to the window size
         frame_label.config(width=window_width, height=window_height)
+        # Frames are resized to it until the next layout change
+        self.fullscreen_size = (window_width, window_height)
 
     def new_frame_received(self, client_address, frame, username):
         """
         Handles new frames received from clients.
+
+        Frames are pulled by display_pump, so this is only called with a
+        None frame when a client disconnects.
         """
         student_id = f"{client_address[0]}:{client_address[1]}"
         if frame is None:
-            self.remove_student_stream(student_id)
-            if self.fullscreen_student_id == student_id:
-                self.fullscreen_student_id = None
-                self.window.attributes('-fullscreen', False)
+            self.window.after(0, self.student_disconnected, student_id)
         else:
             self.window.after(0, self.update_video_display,
                               student_id, frame, username)
 
+    def student_disconnected(self, student_id):
+        """
+        Removes a disconnected student's stream and leaves fullscreen if it
+        was shown.
+        """
+        self.remove_student_stream(student_id)
+        if self.fullscreen_student_id == student_id:
+            self.fullscreen_student_id = None
+            self.window.attributes('-fullscreen', False)
+
+    def display_pump(self):
+        """
+        Displays the latest frame of every student at the display refresh
+        rate.
+
+        Runs on the Tk thread. Only the newest frame per student is sent to
+        the decode pool, sized for the student's tile; older ones were
+        already dropped by the server's frame slots, and frames of students
+        hidden behind a fullscreen stream are dropped without decoding.
+        Frames decoded since the last tick are composited with the student's
+        other channel and shown.
+        """
+        processing = self.server.frame_processing_module
+        for (client_address, channel), (username, encoded_frame) in \
+                processing.frame_slots.take_all().items():
+            student_id = f"{client_address[0]}:{client_address[1]}"
+            self.student_addresses[student_id] = client_address
+            if self.fullscreen_student_id not in (None, student_id) \
+                    and student_id in self.student_frames:
+                continue
+            processing.decode_module.submit(
+                (student_id, channel), encoded_frame,
+                self.decode_tile_size(student_id, channel), username)
+        for (student_id, channel), (frame, username) in \
+                processing.decode_module.take_decoded().items():
+            frame = self.composite_module.update(student_id, channel, frame)
+            self.update_video_display(student_id, frame, username)
+        if self.mosaic is not None:
+            self.mosaic.present()
+        self.window.after(DISPLAY_REFRESH_INTERVAL, self.display_pump)
+
+    def decode_tile_size(self, student_id, channel):
+        """
+        Returns the size a student's channel is shown at, or None when it
+        needs a full size decode. The camera takes the smaller part of a
+        composited tile.
+        """
+        if self.fullscreen_student_id == student_id:
+            return None
+        tile_size = self.tile_sizes.get(student_id)
+        if tile_size is None or channel != CHANNEL_CAMERA:
+            return tile_size
+        return tile_size[0] // 2, tile_size[1]
+
     def remove_student_stream(self, student_id):
         """
         Removes a student's stream from the GUI.
         """
         if student_id in self.student_frames:
-            frame_label = self.student_frames[student_id]
-            frame_label.grid_forget()
-            frame_label.destroy()
-            del self.student_frames[student_id]
+            frame_label = self.student_frames.pop(student_id)
+            if self.mosaic is None:
+                frame_label.grid_forget()
+                frame_label.destroy()
+            else:
+                self.mosaic.forget(student_id)
+                if not self.student_frames:
+                    frame_label.grid_forget()
+            self.tile_sizes.pop(student_id, None)
+            self.student_addresses.pop(student_id, None)
+            for channel in CHANNELS:
+                self.server.frame_processing_module.decode_module.forget(
+                    (student_id, channel))
+            self.composite_module.forget(student_id)
+            self.render_cache.forget(student_id)
             self.update_layout()
         if not self.student_frames:
             self.placeholder_label.pack(fill=tk.BOTH, expand=True)
@@ -235,19 +410,25 @@ class ServerGUI:
         """
         Updates the video display with a new frame from a student.
         """
+        if frame is not None and self.mosaic is not None:
+            if student_id not in self.student_frames:
+                self.add_student_stream(student_id)
+            self.mosaic.draw(student_id, frame, username)
+            return
+
         # Check if the frame is not None and the
         # student_id is in student_frames
         if frame is not None and student_id in self.student_frames:
             # Resize the frame if the student is in fullscreen mode
             if self.fullscreen_student_id == student_id:
-                frame = cv2.resize(frame, (self.streams_frame.winfo_width(),
-                                           self.streams_frame.winfo_height()))
+                frame = cv2.resize(frame, self.fullscreen_size)
 
         if frame is not None:
-            cv2.putText(frame, username, (10, 20),
-                        cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            frame_image = Image.fromarray(frame)
+            self.render_cache.draw_overlay(student_id, username, frame)
+            # PIL reads the BGR pixels directly, no RGB copy
+            height, width = frame.shape[:2]
+            frame_image = Image.frombuffer("RGB", (width, height), frame,
+                                           "raw", "BGR", 0, 1)
             frame_photo = ImageTk.PhotoImage(image=frame_image)
 
             if student_id not in self.student_frames:
@@ -260,6 +441,9 @@ class ServerGUI:
         """
         Updates the layout of the video streams in the GUI.
         """
+        if self.mosaic is not None:
+            self.update_mosaic_layout()
+            return
         if self.fullscreen_student_id:
             self.maximize_student_stream(self.fullscreen_student_id)
             return
@@ -281,6 +465,38 @@ class ServerGUI:
             col = i % cols
             frame_label.grid(row=row, column=col, sticky='nsew')
             frame_label.config(width=frame_width, height=frame_height)
+            self.tile_sizes[student_id] = (frame_width, frame_height)
+
+    def update_mosaic_layout(self):
+        """
+        Lays out the mosaic tiles: one tile filling the mosaic for a
+        fullscreen student, otherwise the same grid as the labels.
+        """
+        num_students = len(self.student_frames)
+        if num_students == 0:
+            return
+
+        window_width = self.streams_frame.winfo_width() - 2 * STREAMS_PADDING
+        window_height = self.streams_frame.winfo_height() - 2 * STREAMS_PADDING
+        if window_width <= 0 or window_height <= 0:
+            return
+        if self.fullscreen_student_id:
+            tiles = {self.fullscreen_student_id:
+                     (0, 0, window_width, window_height)}
+        else:
+            cols = int(math.sqrt(num_students))
+            rows = math.ceil(num_students / cols)
+            frame_width = window_width // cols
+            frame_height = window_height // rows
+            tiles = {}
+            for i, student_id in enumerate(sorted(self.student_frames)):
+                row = i // cols
+                col = i % cols
+                tiles[student_id] = (col * frame_width, row * frame_height,
+                                     frame_width, frame_height)
+        self.mosaic.set_layout((window_width, window_height), tiles)
+        for student_id, tile in tiles.items():
+            self.tile_sizes[student_id] = tile[2:]
 
     def on_closing(self):
         """
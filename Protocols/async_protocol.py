@@ -0,0 +1,81 @@
+"""
+Amit skarbin
+"""
+
+from Protocols.protocol import Protocol, BINARY_HEADER, BINARY_MAGIC, \
+    BINARY_VERSION, SIZE_TO_FILL, MAX_MESSAGE_SIZE, MSG_LEGACY
+
+
+class AsyncProtocol:
+    """
+    The framed protocol of Protocol over asyncio streams, for the asyncio
+    server engine. Both header formats are accepted on receive.
+    """
+
+    @staticmethod
+    async def recv_msg(reader):
+        """
+        Receive one message, detecting the header format from its first
+        two bytes.
+
+        Args:
+            reader (asyncio.StreamReader): The stream to read from.
+
+        Returns:
+            tuple: (msg_type, flags, payload) where payload is bytes.
+            Messages with the ASCII header are returned as MSG_LEGACY.
+        """
+        header = await reader.readexactly(BINARY_HEADER.size)
+        if header[:len(BINARY_MAGIC)] == BINARY_MAGIC:
+            magic, version, msg_type, flags, size = \
+                BINARY_HEADER.unpack(header)
+            if version != BINARY_VERSION:
+                raise ValueError(f"Unsupported protocol version: {version}")
+        else:
+            header += await reader.readexactly(SIZE_TO_FILL - len(header))
+            if not header.isdigit():
+                raise ValueError(f"Invalid data size received: {header}")
+            msg_type, flags, size = MSG_LEGACY, 0, int(header)
+        if size > MAX_MESSAGE_SIZE:
+            raise ValueError(f"Message too large: {size}")
+        return msg_type, flags, await reader.readexactly(size)
+
+    @staticmethod
+    async def recv(reader):
+        """
+        Receive a text message.
+
+        Args:
+            reader (asyncio.StreamReader): The stream to read from.
+
+        Returns:
+            str: The received data.
+        """
+        msg_type, flags, payload = await AsyncProtocol.recv_msg(reader)
+        return payload.decode()
+
+    @staticmethod
+    async def send(writer, data):
+        """
+        Send a text message with the ASCII header.
+
+        Args:
+            writer (asyncio.StreamWriter): The stream to write to.
+            data (str): The data to send.
+        """
+        writer.writelines(Protocol.legacy_buffers(data.encode()))
+        await writer.drain()
+
+    @staticmethod
+    async def send_msg(writer, msg_type, data, flags=0):
+        """
+        Send a message with the binary header.
+
+        Args:
+            writer (asyncio.StreamWriter): The stream to write to.
+            msg_type (int): One of the MSG_* message types.
+            data (bytes): The payload to send.
+            flags (int): Message specific flags.
+        """
+        writer.writelines(Protocol.msg_buffers(msg_type, data, flags))
+        await writer.drain()
@@ -2,18 +2,57 @@
 Amit skarbin
 """
 
+import hashlib
+import lzma
+import mmap
 import os
-from Constants.constants import CHUNK_SIZE
-from Protocols.protocol import Protocol
+import queue
+import struct
+import threading
+import time
+import zlib
+from Constants.constants import CHUNK_SIZE, FILE_TRANSFER_MODE, \
+    FILE_BUFFER_SIZE, FILE_COMPRESSION, COMPRESSION_LINK_SPEED, \
+    COMPRESSION_SAMPLE_SIZE, COMPRESSION_MIN_SIZE, COMPRESSION_QUEUE_SIZE
+from Protocols.protocol import Protocol, MSG_BINARY, MSG_FILE, \
+    MSG_FILE_OFFSET, MSG_FILE_STATUS
+
+# Bulk file header payload: body size, SHA-256 of the body and file name
+# length, then the name
+FILE_RECORD = struct.Struct("!Q32sH")
+OFFSET_RECORD = struct.Struct("!Q")
+
+# MSG_FILE_STATUS flags
+FILE_OK = 0
+FILE_CORRUPT = 1  # The received file did not match its hash
+
+# Body codecs, proposed in the MSG_FILE flags and accepted in the
+# MSG_FILE_OFFSET flags. A compressed body is sent as MSG_BINARY pieces of
+# one compressed stream, ended by an empty one.
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+CODECS = {"none": CODEC_NONE, "zlib": CODEC_ZLIB, "lzma": CODEC_LZMA}
+ZLIB_LEVEL = 1  # Fast, most of the gain on text
+LZMA_PRESET = 1
 
 
 class FileProtocol:
 
     @staticmethod
-    def send_file(sock, file_path):
+    def send_file(sock, file_path, mode=FILE_TRANSFER_MODE):
         """
-        Sends a file over a socket in chunks using only methods from the Protocol class.
+        Sends a file over a socket.
+
+        Args:
+            sock (socket.socket): The socket over which to send the file.
+            file_path (str): The path of the file to send.
+            mode (str): "bulk" for one header and the raw body, "chunked"
+            for framed chunks that any receiver understands.
         """
+        if mode == "bulk":
+            FileProtocol.send_file_bulk(sock, file_path)
+            return
         file_name = os.path.basename(file_path)
         file_name_encoded = file_name.encode()
 
@@ -32,23 +71,556 @@ class FileProtocol:
         Protocol.send_bin(sock, b'')
 
     @staticmethod
-    def recv_file(sock, directory):
+    def send_file_bulk(sock, file_path, codec=None):
+        """
+        Sends a file as one MSG_FILE header followed by its body.
+
+        The header carries the file's size and hash. The receiver answers
+        with the offset it already holds from an interrupted transfer of the
+        same file, only the rest of the body is sent, and the receiver
+        confirms the whole file matched the hash. An uncompressed body goes
+        out with sendfile.
+
+        Args:
+            sock (socket.socket): The socket over which to send the file.
+            file_path (str): The path of the file to send.
+            codec (int): The CODEC_* to propose, or None to pick one from a
+            sample of the file, see choose_codec.
+
+        Raises:
+            ValueError: If the receiver got a file that did not match.
+        """
+        with FileProtocol.map_file(file_path) as view:
+            FileProtocol.send_view(sock, os.path.basename(file_path), view,
+                                   hashlib.sha256(view).digest(),
+                                   codec=codec, file_path=file_path)
+
+    @staticmethod
+    def send_view(sock, file_name, view, digest, slice_size=FILE_BUFFER_SIZE,
+                  progress=None, codec=None, compressed=None,
+                  file_path=None):
+        """
+        Sends a file already in memory, or memory-mapped, as a bulk
+        transfer.
+
+        An uncompressed body of a file on disk goes out with sendfile when
+        the socket supports it, so the kernel copies it to the socket.
+
+        Args:
+            sock (socket.socket): The socket over which to send the file.
+            file_name (str): The name the receiver saves the file as.
+            view (memoryview): The file content.
+            digest (bytes): The SHA-256 of the content.
+            slice_size (int): The bytes handed to the socket per call.
+            progress (function): Optional. Called with (bytes done, total
+            bytes) after every slice.
+            codec (int): The CODEC_* to propose, or None to pick one from a
+            sample of the content, see choose_codec.
+            compressed (function): Optional. Returns the whole content
+            already compressed with `codec`, as from compress_slices. Used
+            instead of compressing again when the receiver wants the whole
+            body.
+            file_path (str): Optional. The file the content was mapped
+            from, to send it with sendfile.
+
+        Raises:
+            ValueError: If the receiver got a file that did not match.
+        """
+        size = len(view)
+        if codec is None:
+            codec = FileProtocol.choose_codec(view)
+        proposed = codec
+        offset, codec = FileProtocol.offer_file(sock, file_name, size, digest,
+                                                codec)
+        if codec == CODEC_NONE and file_path is not None and \
+                hasattr(sock, "sendfile"):
+            with open(file_path, 'rb') as file:
+                for start in range(offset, size, slice_size):
+                    end = min(start + slice_size, size)
+                    FileProtocol.send_body(sock, file, end - start, start)
+                    if progress is not None:
+                        progress(end, size)
+        elif codec == CODEC_NONE:
+            for start in range(offset, size, slice_size):
+                sock.sendall(view[start:start + slice_size])
+                if progress is not None:
+                    progress(min(start + slice_size, size), size)
+        elif compressed is not None and offset == 0 and codec == proposed:
+            FileProtocol.send_pieces(sock, compressed(), size, progress)
+        else:
+            FileProtocol.send_compressed(sock, view, offset, codec,
+                                         slice_size, progress)
+        FileProtocol.confirm_file(sock, file_name)
+
+    @staticmethod
+    def send_compressed(sock, view, offset, codec,
+                        slice_size=FILE_BUFFER_SIZE, progress=None):
+        """
+        Sends content from `offset` as one compressed stream.
+
+        A worker thread compresses slice after slice while this thread
+        sends the compressed pieces, so compressing and sending overlap.
+
+        Args:
+            sock (socket.socket): The socket over which to send the content.
+            view (memoryview): The whole content.
+            offset (int): The position to start from.
+            codec (int): CODEC_ZLIB or CODEC_LZMA.
+            slice_size (int): The content bytes compressed per piece.
+            progress (function): Optional. Called with (bytes done, total
+            bytes) after every piece.
+        """
+        pieces = queue.Queue(maxsize=COMPRESSION_QUEUE_SIZE)
+        stop = threading.Event()
+
+        def compress():
+            try:
+                for item in FileProtocol.compress_slices(view, offset, codec,
+                                                         slice_size):
+                    if stop.is_set():
+                        return
+                    pieces.put(item)
+                pieces.put(None)
+            except Exception as e:
+                pieces.put(e)
+
+        def compressed():
+            while True:
+                item = pieces.get()
+                if item is None:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item
+
+        worker = threading.Thread(target=compress, daemon=True)
+        worker.start()
+        try:
+            FileProtocol.send_pieces(sock, compressed(), len(view), progress)
+        finally:
+            stop.set()
+            while worker.is_alive():  # Unblock it if the queue is full
+                try:
+                    pieces.get(timeout=0.1)
+                except queue.Empty:
+                    pass
+
+    @staticmethod
+    def compress_slices(view, offset, codec, slice_size=FILE_BUFFER_SIZE):
+        """
+        Compresses content from `offset` as one stream, slice by slice.
+
+        Args:
+            view (memoryview): The whole content.
+            offset (int): The position to start from.
+            codec (int): CODEC_ZLIB or CODEC_LZMA.
+            slice_size (int): The content bytes compressed per piece.
+
+        Yields:
+            tuple: (compressed piece, content bytes done).
+        """
+        size = len(view)
+        compressor = FileProtocol.compressor(codec)
+        for start in range(offset, size, slice_size):
+            end = min(start + slice_size, size)
+            yield compressor.compress(view[start:end]), end
+        yield compressor.flush(), size
+
+    @staticmethod
+    def send_pieces(sock, pieces, size, progress=None):
+        """
+        Sends compressed pieces and the empty piece that ends the stream.
+
+        Args:
+            sock (socket.socket): The socket over which to send the pieces.
+            pieces (iterable): (compressed piece, content bytes done) pairs.
+            size (int): The size of the content, for progress.
+            progress (function): Optional. Called with (bytes done, total
+            bytes) after every piece.
+        """
+        for piece, done in pieces:
+            if piece:
+                Protocol.send_msg(sock, MSG_BINARY, piece)
+            if progress is not None:
+                progress(done, size)
+        Protocol.send_msg(sock, MSG_BINARY, b"")  # End of the stream
+
+    @staticmethod
+    def choose_codec(view, compression=FILE_COMPRESSION):
+        """
+        Picks how to compress content, from a sample of it.
+
+        The sample is compressed with every codec, and the codec that would
+        get the whole content across soonest, counting the measured
+        compression time and COMPRESSION_LINK_SPEED, is picked. Content
+        that is compressed already, such as images or office documents,
+        stays uncompressed.
+
+        Args:
+            view (memoryview): The content.
+            compression (str): "auto" to measure, or the name of a codec.
+
+        Returns:
+            int: The CODEC_* to use.
+        """
+        if compression != "auto":
+            return CODECS[compression]
+        size = len(view)
+        if size < COMPRESSION_MIN_SIZE:
+            return CODEC_NONE
+        # Start, middle and end, content often differs along a file
+        part = COMPRESSION_SAMPLE_SIZE // 3
+        sample = b"".join(view[start:start + part]
+                          for start in (0, (size - part) // 2, size - part))
+        best, best_time = CODEC_NONE, len(sample) / COMPRESSION_LINK_SPEED
+        for codec in (CODEC_ZLIB, CODEC_LZMA):
+            started = time.perf_counter()
+            compressor = FileProtocol.compressor(codec)
+            compressed = len(compressor.compress(sample)) + \
+                len(compressor.flush())
+            estimate = time.perf_counter() - started + \
+                compressed / COMPRESSION_LINK_SPEED
+            if estimate < best_time:
+                best, best_time = codec, estimate
+        return best
+
+    @staticmethod
+    def compressor(codec):
+        """
+        Returns a new streaming compressor for a codec.
+        """
+        if codec == CODEC_ZLIB:
+            return zlib.compressobj(ZLIB_LEVEL)
+        return lzma.LZMACompressor(preset=LZMA_PRESET)
+
+    @staticmethod
+    def decompressor(codec):
+        """
+        Returns a new streaming decompressor for a codec.
+        """
+        if codec == CODEC_ZLIB:
+            return zlib.decompressobj()
+        return lzma.LZMADecompressor()
+
+    @staticmethod
+    def map_file(file_path):
+        """
+        Maps a file read-only.
+
+        Args:
+            file_path (str): The path of the file.
+
+        Returns:
+            memoryview: The content of the file.
+        """
+        with open(file_path, 'rb') as file:
+            if not os.fstat(file.fileno()).st_size:
+                return memoryview(b"")  # An empty file cannot be mapped
+            return memoryview(mmap.mmap(file.fileno(), 0,
+                                        access=mmap.ACCESS_READ))
+
+    @staticmethod
+    def offer_file(sock, file_name, size, digest, codec=CODEC_NONE):
+        """
+        Sends the MSG_FILE header, proposing a codec, and waits for the
+        offset the receiver wants the body from and the codec it accepted.
+
+        Returns:
+            tuple: (offset to send the body from, CODEC_* to send it with).
         """
-        Receives a file over a socket in chunks and saves it to the specified directory
-        using only methods from the Protocol class.
+        file_name_encoded = file_name.encode()
+        Protocol.send_msg(sock, MSG_FILE,
+                          FILE_RECORD.pack(size, digest,
+                                           len(file_name_encoded))
+                          + file_name_encoded, codec)
+        msg_type, flags, payload = Protocol.recv_msg(sock)
+        if msg_type != MSG_FILE_OFFSET:
+            raise ValueError(f"Expected a file offset, got {msg_type}")
+        offset, = OFFSET_RECORD.unpack(payload)
+        # Older receivers always answer 0, an uncompressed body
+        return min(offset, size), flags if flags == codec else CODEC_NONE
+
+    @staticmethod
+    def confirm_file(sock, file_name):
         """
-        # Receive the file name using Protocol.recv_bin
-        file_name_encoded = Protocol.recv_bin(sock)
-        file_name = file_name_encoded.decode()
+        Waits for the receiver to confirm the file matched its hash.
+
+        Raises:
+            ValueError: If it did not.
+        """
+        msg_type, flags, payload = Protocol.recv_msg(sock)
+        if msg_type != MSG_FILE_STATUS or flags != FILE_OK:
+            raise ValueError(f"File {file_name} was not received intact")
+
+    @staticmethod
+    def send_body(sock, file, size, offset=0):
+        """
+        Sends `size` bytes of a file from `offset`.
+
+        Uses sendfile, so the kernel copies the file to the socket, when
+        the socket supports it. Otherwise the file is read into one large
+        reused buffer.
+
+        Args:
+            sock (socket.socket): The socket over which to send the bytes.
+            file (file): The file, opened in binary mode.
+            size (int): The number of bytes to send.
+            offset (int): The file position to start from.
+        """
+        if hasattr(sock, "sendfile"):
+            sent = sock.sendfile(file, offset, size) if size else 0
+        else:
+            file.seek(offset)
+            buffer = bytearray(min(FILE_BUFFER_SIZE, size) or 1)
+            view = memoryview(buffer)
+            sent = 0
+            while sent < size:
+                count = file.readinto(view[:min(len(view), size - sent)])
+                if not count:
+                    break
+                sock.sendall(view[:count])
+                sent += count
+        if sent != size:
+            raise ConnectionError(f"File changed while sending, sent {sent} "
+                                  f"of {size} bytes")
+
+    @staticmethod
+    def recv_file(sock, directory, progress=None, blob_path=None):
+        """
+        Receives a file over a socket and saves it to the specified
+        directory. Bulk and chunked transfers are told apart by their first
+        message.
+
+        Args:
+            sock (socket.socket): The socket from which to receive the file.
+            directory (str): The directory to save the file in.
+            progress (function): Optional. Called with (bytes done, total
+            bytes) as a bulk file arrives.
+            blob_path (function): Optional. Maps the SHA-256 of a bulk file
+            to the path it is stored at instead of `directory`. A file
+            already stored there is not sent again. Called with None for a
+            chunked file, to get a path to receive it to.
+
+        Returns:
+            tuple: (path the file was saved to, SHA-256 of the file or None
+            for a chunked transfer, name of the file).
+
+        Raises:
+            ValueError: If a bulk file did not match its hash.
+        """
+        msg_type, flags, payload = Protocol.recv_msg(sock)
+        if msg_type == MSG_FILE:
+            size, digest, name_length = FILE_RECORD.unpack_from(payload)
+            file_name = payload[FILE_RECORD.size:
+                                FILE_RECORD.size + name_length].decode()
+        else:
+            file_name = payload.decode()
+
+        file_name = os.path.basename(file_name)
+        if msg_type == MSG_FILE and blob_path is not None:
+            save_path = blob_path(digest)
+            if os.path.exists(save_path):
+                FileProtocol.skip_file(sock, size)
+                return save_path, digest, file_name
+        elif blob_path is not None:
+            save_path = blob_path(None)
+        else:
+            save_path = os.path.join(directory, file_name)
 
         # Ensure the directory exists
-        os.makedirs(directory, exist_ok=True)
-        save_path = os.path.join(directory, file_name)
+        os.makedirs(os.path.dirname(save_path), exist_ok=True)
 
-        # Open the file to write the received chunks
+        if msg_type == MSG_FILE:
+            FileProtocol.recv_verified(sock, save_path, size, digest,
+                                       progress, flags)
+            return save_path, digest, file_name
         with open(save_path, 'wb') as file:
+            # Open the file to write the received chunks
             while True:
                 file_data = Protocol.recv_bin(sock)
                 if not file_data:  # Check for the zero-length data as end signal
                     break
                 file.write(file_data)
+        return save_path, None, file_name
+
+    @staticmethod
+    def skip_file(sock, size):
+        """
+        Tells the sender the whole file is already here, so no body is
+        sent.
+
+        Args:
+            sock (socket.socket): The socket of the transfer.
+            size (int): The size of the file.
+        """
+        Protocol.send_msg(sock, MSG_FILE_OFFSET, OFFSET_RECORD.pack(size))
+        Protocol.send_msg(sock, MSG_FILE_STATUS, b"", FILE_OK)
+
+    @staticmethod
+    def recv_verified(sock, save_path, size, digest, progress=None,
+                      codec=CODEC_NONE):
+        """
+        Receives a bulk file body into a partial file, resuming one left by
+        an interrupted transfer, and moves it to `save_path` once it matches
+        its hash.
+
+        The partial file is named after the hash, so it is only resumed by
+        a transfer of the same content. The offset always counts content
+        bytes, so a compressed transfer resumes like any other.
+
+        Args:
+            sock (socket.socket): The socket from which to receive the body.
+            save_path (str): The path to save the file to.
+            size (int): The size of the file.
+            digest (bytes): The SHA-256 of the file.
+            progress (function): Optional. Called with (bytes done, total
+            bytes) as the body arrives.
+            codec (int): The CODEC_* the sender proposed.
+
+        Raises:
+            ValueError: If the file did not match its hash.
+        """
+        part_path = f"{save_path}.{digest.hex()[:16]}.part"
+        hasher = hashlib.sha256()
+        with open(part_path, 'a+b') as file:
+            file.seek(0)
+            offset = FileProtocol.hash_file(hasher, file, size)
+            file.truncate(offset)
+            if codec not in CODECS.values() or offset == size or \
+                    FILE_COMPRESSION == "none":
+                codec = CODEC_NONE
+            Protocol.send_msg(sock, MSG_FILE_OFFSET,
+                              OFFSET_RECORD.pack(offset), codec)
+            if codec == CODEC_NONE:
+                FileProtocol.recv_body(sock, file, size - offset, hasher,
+                                       progress, offset)
+            else:
+                FileProtocol.recv_compressed(sock, file, size - offset,
+                                             codec, hasher, progress, offset)
+        if hasher.digest() != digest:
+            os.remove(part_path)
+            Protocol.send_msg(sock, MSG_FILE_STATUS, b"", FILE_CORRUPT)
+            raise ValueError(f"File {save_path} does not match its hash")
+        try:
+            os.replace(part_path, save_path)
+        except FileNotFoundError:
+            if not os.path.exists(save_path):
+                raise
+            # Another receiver took over and stored the same content
+        Protocol.send_msg(sock, MSG_FILE_STATUS, b"", FILE_OK)
+
+    @staticmethod
+    def recv_body(sock, file, size, hasher=None, progress=None, done=0):
+        """
+        Receives `size` raw bytes into a file through one large reused
+        buffer.
+
+        Args:
+            sock (socket.socket): The socket from which to receive the bytes.
+            file (file): The file to write, opened in binary mode.
+            size (int): The number of bytes to receive.
+            hasher (hashlib.sha256): Optional. Updated with the bytes.
+            progress (function): Optional. Called with (bytes done, total
+            bytes) after every buffer.
+            done (int): The bytes of the file received before this body,
+            for progress.
+        """
+        buffer = bytearray(min(FILE_BUFFER_SIZE, size) or 1)
+        view = memoryview(buffer)
+        remaining = size
+        while remaining:
+            wanted = min(len(view), remaining)
+            count = 0
+            while count < wanted:
+                received = sock.recv_into(view[count:wanted])
+                if not received:
+                    break
+                count += received
+            # Keep what arrived before a cut, a resume continues after it
+            file.write(view[:count])
+            if hasher is not None:
+                hasher.update(view[:count])
+            remaining -= count
+            if progress is not None:
+                progress(done + size - remaining, done + size)
+            if count < wanted:
+                raise ConnectionError(
+                    "Connection closed during data reception")
+
+    @staticmethod
+    def recv_compressed(sock, file, size, codec, hasher=None, progress=None,
+                        done=0):
+        """
+        Receives a compressed body of `size` content bytes into a file.
+
+        Pieces are inflated at most FILE_BUFFER_SIZE bytes at a time, and a
+        body that inflates past `size` is rejected as soon as it does.
+
+        Args:
+            sock (socket.socket): The socket from which to receive the body.
+            file (file): The file to write, opened in binary mode.
+            size (int): The number of content bytes to receive.
+            codec (int): CODEC_ZLIB or CODEC_LZMA.
+            hasher (hashlib.sha256): Optional. Updated with the content.
+            progress (function): Optional. Called with (bytes done, total
+            bytes) after every piece.
+            done (int): The bytes of the file received before this body,
+            for progress.
+
+        Raises:
+            ValueError: If the body holds more than `size` bytes.
+        """
+        decompressor = FileProtocol.decompressor(codec)
+        received = 0
+        while True:
+            msg_type, flags, piece = Protocol.recv_msg(sock)
+            if msg_type != MSG_BINARY:
+                raise ValueError(f"Expected file data, got {msg_type}")
+            if not piece:  # End of the stream
+                break
+            while True:
+                # Bounded, so a small piece cannot inflate into a huge one
+                data = decompressor.decompress(
+                    piece, min(FILE_BUFFER_SIZE, size - received + 1))
+                received += len(data)
+                if received > size:
+                    raise ValueError(
+                        "Compressed file is larger than announced")
+                # Keep what arrived before a cut, a resume continues after it
+                file.write(data)
+                if hasher is not None:
+                    hasher.update(data)
+                if codec == CODEC_ZLIB:
+                    piece = decompressor.unconsumed_tail
+                    if not piece:
+                        break
+                elif decompressor.needs_input or decompressor.eof:
+                    break
+                else:
+                    piece = b""
+            if progress is not None:
+                progress(done + received, done + size)
+
+    @staticmethod
+    def hash_file(hasher, file, size):
+        """
+        Hashes up to `size` bytes from the file's current position.
+
+        Args:
+            hasher (hashlib.sha256): The hash to update.
+            file (file): The file, opened in binary mode.
+            size (int): The most bytes to read.
+
+        Returns:
+            int: The number of bytes hashed.
+        """
+        buffer = bytearray(FILE_BUFFER_SIZE)
+        view = memoryview(buffer)
+        hashed = 0
+        while hashed < size:
+            count = file.readinto(view[:min(len(view), size - hashed)])
+            if not count:
+                break
+            hasher.update(view[:count])
+            hashed += count
+        return hashed
@@ -0,0 +1,174 @@
+"""
+Amit skarbin
+"""
+
+import struct
+from Protocols.protocol import Protocol, MSG_FRAME, MSG_SESSION, MSG_DELTA, \
+    MSG_HEARTBEAT
+
+# Per-frame record: stream id, sequence number, capture time (epoch seconds)
+FRAME_RECORD = struct.Struct("!IId")
+# Session handshake reply: the stream id assigned by the server
+SESSION_RECORD = struct.Struct("!I")
+# Delta record after the frame record: frame width, frame height, tile size
+# and tile count. It is followed by the big-endian uint16 tile indices and
+# one JPEG holding the changed tiles stacked vertically.
+DELTA_RECORD = struct.Struct("!HHHH")
+TILE_INDEX_TYPE = ">u2"
+
+# Channels, carried in the message header flags of frame and delta records
+CHANNEL_COMBINED = 0  # Camera and screen side by side in one frame
+CHANNEL_SCREEN = 1
+CHANNEL_CAMERA = 2
+CHANNELS = (CHANNEL_COMBINED, CHANNEL_SCREEN, CHANNEL_CAMERA)
+
+
+class FrameProtocol:
+
+    @staticmethod
+    def open_session(sock, username):
+        """
+        Starts a streaming session and waits for the server to assign
+        a stream id.
+
+        Args:
+            sock (socket.socket): The stream socket.
+            username (str): The username to be associated with the stream.
+
+        Returns:
+            int: The stream id to put in every frame record.
+        """
+        Protocol.send(sock, "STREAM_SESSION")
+        Protocol.send(sock, username)
+        msg_type, flags, data = Protocol.recv_msg(sock)
+        if msg_type != MSG_SESSION:
+            raise ValueError(f"Unexpected session reply type: {msg_type}")
+        stream_id, = SESSION_RECORD.unpack(data)
+        return stream_id
+
+    @staticmethod
+    def accept_session(sock, stream_id):
+        """
+        Replies to a session handshake with the assigned stream id.
+
+        Args:
+            sock (socket.socket): The client's stream socket.
+            stream_id (int): The stream id assigned to the client.
+        """
+        Protocol.send_msg(sock, MSG_SESSION, SESSION_RECORD.pack(stream_id))
+
+    @staticmethod
+    def send_frame(sock, stream_id, sequence, timestamp, encoded_frame,
+                   channel=CHANNEL_COMBINED):
+        """
+        Sends one encoded frame as a frame record, in a single write.
+
+        Args:
+            sock (socket.socket): The stream socket.
+            stream_id (int): The id assigned at handshake.
+            sequence (int): The frame sequence number.
+            timestamp (float): The capture time of the frame.
+            encoded_frame (bytes): The JPEG bytes of the frame.
+            channel (int): One of the CHANNEL_* values.
+
+        Returns:
+            int: The number of bytes sent.
+        """
+        record = FRAME_RECORD.pack(stream_id, sequence & 0xFFFFFFFF,
+                                   timestamp)
+        encoded_view = memoryview(encoded_frame).cast('B')
+        header = Protocol.pack_header(MSG_FRAME,
+                                      len(record) + len(encoded_view),
+                                      channel)
+        return Protocol.send_buffers(sock, [header, record, encoded_view])
+
+    @staticmethod
+    def send_heartbeat(sock, stream_id, sequence, timestamp,
+                       channel=CHANNEL_COMBINED):
+        """
+        Sends a heartbeat: a frame record without a frame, telling the server
+        the channel's last frame is still current.
+
+        Args:
+            sock (socket.socket): The stream socket.
+            stream_id (int): The id assigned at handshake.
+            sequence (int): The frame sequence number.
+            timestamp (float): The capture time of the unchanged frame.
+            channel (int): One of the CHANNEL_* values.
+
+        Returns:
+            int: The number of bytes sent.
+        """
+        record = FRAME_RECORD.pack(stream_id, sequence & 0xFFFFFFFF,
+                                   timestamp)
+        header = Protocol.pack_header(MSG_HEARTBEAT, len(record), channel)
+        return Protocol.send_buffers(sock, [header, record])
+
+    @staticmethod
+    def unpack_frame(data):
+        """
+        Splits a received frame record without copying the JPEG bytes.
+
+        Args:
+            data (bytearray): The payload of a MSG_FRAME message.
+
+        Returns:
+            tuple: (stream_id, sequence, timestamp, memoryview of the JPEG)
+        """
+        stream_id, sequence, timestamp = FRAME_RECORD.unpack_from(data)
+        return stream_id, sequence, timestamp, \
+            memoryview(data)[FRAME_RECORD.size:]
+
+    @staticmethod
+    def send_delta(sock, stream_id, sequence, timestamp, frame_size,
+                   tile_size, tile_indices, encoded_tiles,
+                   channel=CHANNEL_COMBINED):
+        """
+        Sends the changed tiles of a frame as a delta record, in a single
+        write.
+
+        Args:
+            sock (socket.socket): The stream socket.
+            stream_id (int): The id assigned at handshake.
+            sequence (int): The frame sequence number.
+            timestamp (float): The capture time of the frame.
+            frame_size (tuple): (width, height) of the full frame.
+            tile_size (int): The side of the square tiles in pixels.
+            tile_indices (numpy.ndarray): Row-major indices of the changed
+            tiles, as TILE_INDEX_TYPE.
+            encoded_tiles (bytes): JPEG of the changed tiles stacked
+            vertically, in the order of tile_indices.
+            channel (int): One of the CHANNEL_* values.
+
+        Returns:
+            int: The number of bytes sent.
+        """
+        record = FRAME_RECORD.pack(stream_id, sequence & 0xFFFFFFFF,
+                                   timestamp)
+        delta = DELTA_RECORD.pack(frame_size[0], frame_size[1], tile_size,
+                                  len(tile_indices))
+        indices_view = memoryview(tile_indices).cast('B')
+        tiles_view = memoryview(encoded_tiles).cast('B')
+        header = Protocol.pack_header(
+            MSG_DELTA, len(record) + len(delta) + len(indices_view) +
+            len(tiles_view), channel)
+        return Protocol.send_buffers(sock, [header, record, delta,
+                                            indices_view, tiles_view])
+
+    @staticmethod
+    def unpack_delta(data):
+        """
+        Splits the part of a delta record after the frame record.
+
+        Args:
+            data (memoryview): The bytes after the frame record, as returned
+            by unpack_frame for a MSG_DELTA message.
+
+        Returns:
+            tuple: (frame_size, tile_size, memoryview of the tile indices,
+            memoryview of the JPEG tiles)
+        """
+        width, height, tile_size, count = DELTA_RECORD.unpack_from(data)
+        indices_end = DELTA_RECORD.size + 2 * count
+        return (width, height), tile_size, \
+            data[DELTA_RECORD.size:indices_end], data[indices_end:]
@@ -2,10 +2,35 @@
 Amit skarbin
 """
 
+import socket as socket_module
+import struct
+from Constants.constants import TCP_NODELAY_ENABLED, \
+    SOCKET_SEND_BUFFER_SIZE, SOCKET_RECV_BUFFER_SIZE
+
 SIZE_TO_FILL = 15
 MIN_SIZE = 0
 CHUNK_SIZE = 4096  # Define a reasonable chunk size
 
+# Binary framing: magic, version, message type, flags, payload length.
+# The magic is never a digit, so a receiver can tell a binary header from
+# the zero-filled ASCII length header used by older clients.
+BINARY_MAGIC = b"SK"
+BINARY_VERSION = 1
+BINARY_HEADER = struct.Struct("!2sBBHI")
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024  # Reject absurd lengths early
+
+# Message types
+MSG_LEGACY = 0  # Received with the old ASCII length header
+MSG_TEXT = 1
+MSG_BINARY = 2
+MSG_FRAME = 3
+MSG_SESSION = 4
+MSG_DELTA = 5
+MSG_HEARTBEAT = 6  # A frame record without a frame, nothing changed
+MSG_FILE = 7  # A file header, the raw file body follows unframed
+MSG_FILE_OFFSET = 8  # Receiver to sender, the offset to send the body from
+MSG_FILE_STATUS = 9  # Receiver to sender, FILE_* status in the flags
+
 
 class Protocol:
 
@@ -19,17 +44,19 @@ class Protocol:
         Args:
             socket (socket.socket): The socket over which to send the data.
             data (str): The data to send.
+
+        Returns:
+            int: The number of bytes sent.
         """
         encoded_msg = data.encode()
-        length_str = str(len(encoded_msg)).zfill(SIZE_TO_FILL)
-        length_bytes = length_str.encode()
-        socket.send(length_bytes + encoded_msg)
+        return Protocol.send_buffers(socket,
+                                     Protocol.legacy_buffers(encoded_msg))
 
     @staticmethod
     def recv(sock):
         """
         Receive data over a socket with a fixed-size header indicating the
-        data length.
+        data length. Accepts both the ASCII and the binary header.
 
         Args:
             sock (socket.socket): The socket from which to receive the data.
@@ -37,19 +64,8 @@ class Protocol:
         Returns:
             str: The received data.
         """
-        total_size = b""
-        size = SIZE_TO_FILL
-        while size > MIN_SIZE:
-            data = sock.recv(size)
-            size -= len(data)
-            total_size += data
-        size = int(total_size.decode())
-        total_data = b""
-        while size > MIN_SIZE:
-            data = sock.recv(size)
-            size -= len(data)
-            total_data += data
-        return total_data.decode()
+        msg_type, flags, payload = Protocol.recv_msg(sock)
+        return payload.decode()
 
     @staticmethod
     def send_bin(sock, data):
@@ -60,36 +76,198 @@ class Protocol:
         Args:
             sock (socket.socket): The socket over which to send the data.
             data (bytes): The binary data to send.
+
+        Returns:
+            int: The number of bytes sent.
         """
-        length_str = str(len(data)).zfill(SIZE_TO_FILL)
-        sock.send(length_str.encode('utf-8'))  # Send size info
-        sock.send(data)  # Send actual data
+        return Protocol.send_buffers(sock, Protocol.legacy_buffers(data))
 
     @staticmethod
     def recv_bin(sock):
         """
         Receive binary data over a socket with a fixed-size header indicating
-        the data length.
+        the data length. Accepts both the ASCII and the binary header.
 
         Args:
             sock (socket.socket): The socket from which to receive the data.
 
         Returns:
-            bytes: The received binary data.
-        """
-        data_size_bytes = sock.recv(SIZE_TO_FILL)
-        data_size_str = data_size_bytes.decode('utf-8')
-        if not data_size_str.isdigit():
-            raise ValueError(f"Invalid data size received: {data_size_bytes}")
-
-        size = int(data_size_str)
-        total_data = b''
-        while size > 0:
-            part = sock.recv(size)
-            if not part:
+            bytearray: The received binary data.
+        """
+        msg_type, flags, payload = Protocol.recv_msg(sock)
+        return payload
+
+    @staticmethod
+    def send_msg(sock, msg_type, data, flags=0):
+        """
+        Send a message with the binary header.
+
+        Args:
+            sock (socket.socket): The socket over which to send the data.
+            msg_type (int): One of the MSG_* message types.
+            data (bytes): The payload to send.
+            flags (int): Message specific flags.
+
+        Returns:
+            int: The number of bytes sent.
+        """
+        return Protocol.send_buffers(
+            sock, Protocol.msg_buffers(msg_type, data, flags))
+
+    @staticmethod
+    def legacy_buffers(data):
+        """
+        Build the buffer list for a message with the ASCII header.
+
+        Args:
+            data (bytes): The payload.
+
+        Returns:
+            list: The header and payload buffers.
+        """
+        length_str = str(len(data)).zfill(SIZE_TO_FILL)
+        return [length_str.encode('utf-8'), data]
+
+    @staticmethod
+    def msg_buffers(msg_type, data, flags=0):
+        """
+        Build the buffer list for a message with the binary header.
+
+        Args:
+            msg_type (int): One of the MSG_* message types.
+            data (bytes): The payload.
+            flags (int): Message specific flags.
+
+        Returns:
+            list: The header and payload buffers.
+        """
+        return [Protocol.pack_header(msg_type, len(data), flags), data]
+
+    @staticmethod
+    def pack_header(msg_type, size, flags=0):
+        """
+        Build a binary header for a payload that is sent as several buffers.
+
+        Args:
+            msg_type (int): One of the MSG_* message types.
+            size (int): The total payload length.
+            flags (int): Message specific flags.
+
+        Returns:
+            bytes: The packed header.
+        """
+        return BINARY_HEADER.pack(BINARY_MAGIC, BINARY_VERSION, msg_type,
+                                  flags, size)
+
+    @staticmethod
+    def send_buffers(sock, buffers):
+        """
+        Send a list of buffers as one vectored write, resuming after short
+        writes until everything has been sent.
+
+        Args:
+            sock (socket.socket): The socket over which to send the data.
+            buffers (list): Bytes-like objects to send in order.
+
+        Returns:
+            int: The number of bytes sent.
+        """
+        views = [memoryview(buffer).cast('B') for buffer in buffers]
+        total = sum(len(view) for view in views)
+        if not hasattr(sock, "sendmsg"):
+            # No vectored write on this platform (Windows), join once
+            sock.sendall(b"".join(views))
+            return total
+        sent = 0
+        while views:
+            count = sock.sendmsg(views)
+            sent += count
+            # Drop the buffers that went out and trim a partial one
+            while views and count >= len(views[0]):
+                count -= len(views[0])
+                views.pop(0)
+            if views and count:
+                views[0] = views[0][count:]
+        return sent
+
+    @staticmethod
+    def configure_socket(sock):
+        """
+        Apply the configured TCP options to a connected or listening socket.
+
+        Args:
+            sock (socket.socket): The socket to configure.
+        """
+        if TCP_NODELAY_ENABLED:
+            sock.setsockopt(socket_module.IPPROTO_TCP,
+                            socket_module.TCP_NODELAY, 1)
+        if SOCKET_SEND_BUFFER_SIZE:
+            sock.setsockopt(socket_module.SOL_SOCKET, socket_module.SO_SNDBUF,
+                            SOCKET_SEND_BUFFER_SIZE)
+        if SOCKET_RECV_BUFFER_SIZE:
+            sock.setsockopt(socket_module.SOL_SOCKET, socket_module.SO_RCVBUF,
+                            SOCKET_RECV_BUFFER_SIZE)
+
+    @staticmethod
+    def recv_msg(sock):
+        """
+        Receive one message, detecting the header format from its first
+        two bytes.
+
+        Args:
+            sock (socket.socket): The socket from which to receive the data.
+
+        Returns:
+            tuple: (msg_type, flags, payload) where payload is a bytearray.
+            Messages with the ASCII header are returned as MSG_LEGACY.
+        """
+        header = Protocol.recv_exact(sock, BINARY_HEADER.size)
+        if header[:len(BINARY_MAGIC)] == BINARY_MAGIC:
+            magic, version, msg_type, flags, size = \
+                BINARY_HEADER.unpack(header)
+            if version != BINARY_VERSION:
+                raise ValueError(f"Unsupported protocol version: {version}")
+        else:
+            # Old ASCII header, read the rest of its digits
+            header += Protocol.recv_exact(sock,
+                                          SIZE_TO_FILL - len(header))
+            if not header.isdigit():
+                raise ValueError(f"Invalid data size received: {header}")
+            msg_type, flags, size = MSG_LEGACY, 0, int(header)
+        if size > MAX_MESSAGE_SIZE:
+            raise ValueError(f"Message too large: {size}")
+        return msg_type, flags, Protocol.recv_exact(sock, size)
+
+    @staticmethod
+    def recv_exact(sock, size):
+        """
+        Receive exactly `size` bytes into a preallocated buffer.
+
+        Args:
+            sock (socket.socket): The socket from which to receive the data.
+            size (int): The number of bytes to receive.
+
+        Returns:
+            bytearray: The received data.
+        """
+        buffer = bytearray(size)
+        Protocol.recv_into(sock, memoryview(buffer))
+        return buffer
+
+    @staticmethod
+    def recv_into(sock, view):
+        """
+        Fill a writable buffer from the socket without intermediate copies.
+
+        Args:
+            sock (socket.socket): The socket from which to receive the data.
+            view (memoryview): The buffer to fill completely.
+        """
+        received = 0
+        size = len(view)
+        while received < size:
+            count = sock.recv_into(view[received:], size - received)
+            if not count:
                 raise ConnectionError(
                     "Connection closed during data reception")
-            total_data += part
-            size -= len(part)
-
-        return total_data
+            received += count
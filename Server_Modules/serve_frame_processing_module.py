@@ -3,9 +3,18 @@ Server for frame processing
 Amit Skarbin
 """
 
-import pickle
+import itertools
+import threading
 import cv2
+import numpy as np
 from Constants.constants import FRAME_DECODE_COLOR_MODE
+from Protocols.protocol import MSG_FRAME, MSG_DELTA, MSG_HEARTBEAT
+from Protocols.frame_protocol import FrameProtocol, CHANNEL_COMBINED, \
+    CHANNELS
+from Server_Modules.server_frame_slot_module import ServerFrameSlotModule
+from Server_Modules.server_decode_module import ServerDecodeModule
+from Server_Modules.server_delta_module import ServerDeltaModule
+from Server_Modules.server_composite_module import ServerCompositeModule
 
 
 class ServerFrameProcessingModule:
@@ -18,9 +27,27 @@ class ServerFrameProcessingModule:
     Attributes:
         new_frame_callback (function): A callback function that is called when
         a new frame is received.
+        streams (dict): Maps the stream id assigned at handshake to the
+        username of the streaming client.
+        heartbeats (int): Heartbeats received, each one a frame that did not
+        need to be sent or decoded.
+        frame_slots (ServerFrameSlotModule): Latest encoded frame per client
+        and channel when frames are pulled by a display instead of pushed to
+        the callback, otherwise None.
+        decode_module (ServerDecodeModule): Decodes pulled frames on a worker
+        pool at display size, present together with frame_slots.
+        delta_module (ServerDeltaModule): Patches delta frames into
+        per-stream canvases.
+        composite_module (ServerCompositeModule): Joins a client's screen
+        and camera channels into the frame passed to the callback.
+        recording_module (ServerRecordingModule): Records received frames,
+        or None.
+        rewind_module (ServerRewindModule): Keeps the last received frames
+        to scrub back through, or None.
     """
 
-    def __init__(self, new_frame_callback=None):
+    def __init__(self, new_frame_callback=None, use_frame_slots=False,
+                 recording_module=None, rewind_module=None):
         """
         Initializes the ServerFrameProcessingModule with an optional callback
         function.
@@ -28,22 +55,150 @@ class ServerFrameProcessingModule:
         Args:
             new_frame_callback (function): Optional. A function to be called
             when a new frame is received.
+            use_frame_slots (bool): Keep only the latest encoded frame per
+            client for the display to take, instead of decoding every frame
+            and passing it to the callback.
+            recording_module (ServerRecordingModule): Optional. Records
+            every received frame.
+            rewind_module (ServerRewindModule): Optional. Keeps the last
+            received frames of every client.
         """
         self.new_frame_callback = new_frame_callback
+        self.delta_module = ServerDeltaModule()
+        self.composite_module = ServerCompositeModule()
+        self.recording_module = recording_module
+        self.rewind_module = rewind_module
+        self.frame_slots = None
+        self.decode_module = None
+        if use_frame_slots:
+            self.frame_slots = ServerFrameSlotModule()
+            self.decode_module = ServerDecodeModule()
+        self.streams = {}
+        self.heartbeats = 0
+        self.stream_ids = itertools.count(1)
+        self.streams_lock = threading.Lock()
 
-    def process_received_frame(self, data, client_address):
+    def register_stream(self, username):
+        """
+        Assigns a stream id to a client starting a streaming session.
+
+        Args:
+            username (str): The username of the streaming client.
+
+        Returns:
+            int: The assigned stream id.
+        """
+        with self.streams_lock:
+            stream_id = next(self.stream_ids)
+            self.streams[stream_id] = username
+        return stream_id
+
+    def unregister_stream(self, stream_id):
+        """
+        Forgets a stream id when its session ends.
+
+        Args:
+            stream_id (int): The stream id to remove.
+        """
+        with self.streams_lock:
+            self.streams.pop(stream_id, None)
+        for channel in CHANNELS:
+            self.delta_module.forget((stream_id, channel))
+
+    def process_received_frame(self, data, client_address,
+                               msg_type=MSG_FRAME, channel=CHANNEL_COMBINED):
         """
         Processes a received video frame.
 
         Args:
-            data (bytes): The data containing the encoded video frame.
+            data (bytearray): The frame record containing the encoded video
+            frame.
             client_address (tuple): The address of the client that
              sent the frame.
+            msg_type (int): MSG_FRAME for a full frame, MSG_DELTA for the
+            changed tiles of one, MSG_HEARTBEAT when the channel's last
+            frame is unchanged.
+            channel (int): The CHANNEL_* value from the message flags.
         """
         try:
-            frame_data, username = pickle.loads(data)
-            frame = cv2.imdecode(frame_data, FRAME_DECODE_COLOR_MODE)
+            stream_id, sequence, timestamp, encoded_frame = \
+                FrameProtocol.unpack_frame(data)
+            username = self.streams.get(stream_id)
+            if username is None:
+                print(f"Frame for unknown stream {stream_id} "
+                      f"from client {client_address}")
+                return
+            if channel not in CHANNELS:
+                print(f"Frame for unknown channel {channel} "
+                      f"from client {client_address}")
+                return
+            if msg_type == MSG_HEARTBEAT:
+                # The last frame stays on display, nothing to decode
+                self.heartbeats += 1
+                return
+            if self.recording_module is not None:
+                self.recording_module.record(username, channel, msg_type,
+                                             timestamp, encoded_frame)
+            if self.rewind_module is not None:
+                self.rewind_module.add((client_address, channel), timestamp,
+                                       msg_type, encoded_frame)
+            if msg_type == MSG_DELTA:
+                # Every delta is applied, so it is decoded on arrival
+                frame = self.delta_module.apply_delta((stream_id, channel),
+                                                      encoded_frame)
+                if frame is None:
+                    return
+            else:
+                self.delta_module.keyframe_received((stream_id, channel),
+                                                    encoded_frame)
+                frame = encoded_frame
+            if self.frame_slots is not None:
+                # Decoded later, and only if it is still the latest frame
+                self.frame_slots.put((client_address, channel), username,
+                                     frame)
+                return
+            if msg_type != MSG_DELTA:
+                frame = self.decode_frame(encoded_frame)
             if frame is not None and self.new_frame_callback is not None:
+                frame = self.composite_module.update(client_address, channel,
+                                                     frame)
                 self.new_frame_callback(client_address, frame, username)
         except Exception as e:
             print(f"Error decoding frame from client {client_address}: {e}")
+
+    def decode_frame(self, encoded_frame):
+        """
+        Decodes JPEG bytes without copying them.
+
+        Args:
+            encoded_frame (memoryview): The JPEG bytes of the frame.
+
+        Returns:
+            numpy.ndarray: The decoded frame, or None if decoding failed.
+        """
+        return cv2.imdecode(np.frombuffer(encoded_frame, np.uint8),
+                            FRAME_DECODE_COLOR_MODE)
+
+    def shutdown(self):
+        """
+        Stops the decode workers, if any.
+        """
+        if self.decode_module is not None:
+            self.decode_module.shutdown()
+
+    def client_disconnected(self, client_address):
+        """
+        Drops a client's pending and buffered frames and notifies the
+        callback with a None frame.
+
+        Args:
+            client_address (tuple): The address of the client.
+        """
+        if self.frame_slots is not None:
+            for channel in CHANNELS:
+                self.frame_slots.remove((client_address, channel))
+        self.composite_module.forget(client_address)
+        if self.rewind_module is not None:
+            self.rewind_module.forget(client_address)
+        if self.new_frame_callback is not None:
+            self.new_frame_callback(client_address, None, None)
@@ -3,13 +3,28 @@ Server
 Amit Skarbin
 """
 
+import asyncio
 import socket
-from Protocols.protocol import Protocol
+from Constants.constants import SERVER_NETWORK_ENGINE, RECORDING_ENABLED, \
+    TARGET_BITRATE
+from Protocols.protocol import Protocol, MSG_FRAME, MSG_SESSION, MSG_DELTA, \
+    MSG_HEARTBEAT
+from Protocols.async_protocol import AsyncProtocol
+from Protocols.frame_protocol import FrameProtocol, SESSION_RECORD
 from Server_Modules.server_network_module import ServerNetworkModule
+from Server_Modules.server_async_network_module \
+    import ServerAsyncNetworkModule
 from Server_Modules.server_file_management_module \
     import ServerFileManagementModule
 from Server_Modules.serve_frame_processing_module \
     import ServerFrameProcessingModule
+from Server_Modules.server_recording_module import ServerRecordingModule
+from Server_Modules.server_rewind_module import ServerRewindModule
+
+# Commands run by handle_file_command, "REQUEST_LAST_FILE" may be followed
+# by ":" and the hash of the version the client already has, "UPLOAD_FILE"
+# by ":" and the username of the submitting client
+FILE_COMMANDS = ("REQUEST_LAST_FILE", "UPLOAD_FILE")
 
 
 class Server:
@@ -20,14 +35,25 @@ class Server:
     file management, and frame processing.
 
     Attributes:
-        network_module (ServerNetworkModule): Manages network communication.
+        network_module (ServerNetworkModule or ServerAsyncNetworkModule):
+        Manages network communication.
         file_management_module (ServerFileManagementModule):
         Handles file operations.
         frame_processing_module (ServerFrameProcessingModule):
         Manages frame processing.
+        recording_module (ServerRecordingModule): Records every student's
+        stream, or None when recording is off.
+        rewind_module (ServerRewindModule): Keeps the last seconds of every
+        student's stream, or None.
+        listen_clients (dict): Maps usernames to the address of the socket
+        their client listens on for server messages.
+        target_bitrate (int): The bitrate cap asked of every stream, in bits
+        per second, or 0 for none.
     """
 
-    def __init__(self, host, port, new_frame_callback=None):
+    def __init__(self, host, port, new_frame_callback=None,
+                 engine=SERVER_NETWORK_ENGINE, use_frame_slots=False,
+                 record=RECORDING_ENABLED, use_rewind=False):
         """
         Initializes the Server with host, port, and frame callback.
 
@@ -35,12 +61,30 @@ class Server:
             host (str): Host address of the server.
             port (int): Port number the server listens on.
             new_frame_callback (function): Callback function for new frames.
+            engine (str): "threaded" for a thread per connection or
+            "asyncio" for a single event loop serving all connections.
+            use_frame_slots (bool): Keep only the latest encoded frame per
+            client for a display to pull, see ServerFrameSlotModule.
+            record (bool): Record every student's stream, see
+            ServerRecordingModule.
+            use_rewind (bool): Keep the last seconds of every student's
+            stream to scrub back through, see ServerRewindModule.
         """
-        self.network_module = ServerNetworkModule(host,
-                                                  port, self.client_handler)
+        if engine == "asyncio":
+            self.network_module = ServerAsyncNetworkModule(
+                host, port, self.async_client_handler)
+        else:
+            self.network_module = ServerNetworkModule(host,
+                                                      port,
+                                                      self.client_handler)
         self.file_management_module = ServerFileManagementModule()
+        self.recording_module = ServerRecordingModule() if record else None
+        self.rewind_module = ServerRewindModule() if use_rewind else None
         self.frame_processing_module = ServerFrameProcessingModule(
-            new_frame_callback)
+            new_frame_callback, use_frame_slots, self.recording_module,
+            self.rewind_module)
+        self.listen_clients = {}
+        self.target_bitrate = TARGET_BITRATE
 
     def start_server(self):
         """
@@ -53,6 +97,53 @@ class Server:
         Stops the server and closes all resources.
         """
         self.network_module.stop_server()
+        self.frame_processing_module.shutdown()
+        if self.recording_module is not None:
+            self.recording_module.stop()
+
+    def publish_target_bitrate(self, bitrate, username=None):
+        """
+        Asks clients to keep their stream under a bitrate. A cap for all
+        clients is also sent to clients that connect later.
+
+        Args:
+            bitrate (int): Bits per second, or None to remove the cap.
+            username (str): The client to notify, or None for all clients.
+        """
+        if username is None:
+            self.target_bitrate = int(bitrate or 0)
+        for name, client_address in list(self.listen_clients.items()):
+            if username is not None and name != username:
+                continue
+            try:
+                self.network_module.send_text(
+                    client_address, f"TARGET_BITRATE:{int(bitrate or 0)}")
+            except Exception as e:
+                print(f"Error sending bitrate to client {name}: {e}")
+
+    def register_listen_client(self, username, client_address):
+        """
+        Remembers the socket a client listens on for server messages, and
+        sends it the bitrate cap if there is one.
+
+        Args:
+            username (str): The username of the client.
+            client_address (tuple): The address of its listen socket.
+        """
+        self.listen_clients[username] = client_address
+        if self.target_bitrate:
+            self.publish_target_bitrate(self.target_bitrate, username)
+
+    def forget_listen_client(self, client_address):
+        """
+        Forgets a listen socket when it disconnects.
+
+        Args:
+            client_address (tuple): The address of the socket.
+        """
+        for name, address in list(self.listen_clients.items()):
+            if address == client_address:
+                del self.listen_clients[name]
 
     def client_handler(self, client_socket, client_address):
         """
@@ -65,14 +156,15 @@ class Server:
         while self.network_module.running:
             try:
                 data = Protocol.recv(client_socket)
-                if data == "REQUEST_LAST_FILE":  # if client request file
-                    self.file_management_module.send_stored_file(client_socket)
-                elif data == "STREAM":  # client start stream
-                    self.handle_client_communication(client_socket,
-                                                     client_address)
-                elif data == "UPLOAD_FILE":  # server upload file
-                    self.file_management_module. \
-                        store_client_file(client_socket)
+                if data.partition(":")[0] in FILE_COMMANDS:
+                    self.handle_file_command(data, client_socket)
+                elif data == "LISTEN_SESSION":  # server to client messages
+                    self.register_listen_client(Protocol.recv(client_socket),
+                                                client_address)
+                elif data == "STREAM_SESSION":  # frames until "STOP"
+                    self.handle_stream_session(client_socket, client_address)
+                    self.network_module.remove_client(client_address)
+                    break
                 elif data == "STOP":  # client finish test or teacher stop test
                     self.handle_disconnection(client_socket, client_address)
             except ConnectionError as e:
@@ -83,16 +175,121 @@ class Server:
                 break
         self.cleanup_connection(client_socket, client_address)
 
-    def handle_client_communication(self, client_socket, client_address):
+    async def async_client_handler(self, reader, writer, client_address):
         """
-            Processes data received from a client.
-            Args:
-                client_socket (socket.socket): The client's socket.
-                client_address (tuple): The client's address.
-            """
-        data = Protocol.recv_bin(client_socket)
-        self.frame_processing_module. \
-            process_received_frame(data, client_address)
+        Handles communication with a client on the asyncio engine.
+
+        Frames are decoded on the engine's executor and file commands run
+        on its file executor through a blocking socket bridge, so the event
+        loop only moves bytes and transfers never hold up decoding.
+
+        Args:
+            reader (asyncio.StreamReader): The client's reader.
+            writer (asyncio.StreamWriter): The client's writer.
+            client_address (tuple): Address of the client.
+        """
+        try:
+            while self.network_module.running:
+                data = await AsyncProtocol.recv(reader)
+                if data.partition(":")[0] in FILE_COMMANDS:
+                    await self.network_module.run_file_transfer(
+                        self.handle_file_command, data,
+                        self.network_module.blocking_socket(reader, writer))
+                elif data == "LISTEN_SESSION":  # server to client messages
+                    username = await AsyncProtocol.recv(reader)
+                    self.register_listen_client(username, client_address)
+                elif data == "STREAM_SESSION":  # frames until "STOP"
+                    await self.handle_stream_session_async(reader, writer,
+                                                           client_address)
+                    break
+                elif data == "STOP":
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError) as e:
+            print(f"Client {client_address} disconnected: {e}")
+        except Exception as e:
+            print(f"Error handling client {client_address}: {e}")
+        self.forget_listen_client(client_address)
+        self.frame_processing_module.client_disconnected(client_address)
+
+    def handle_file_command(self, command, client_socket):
+        """
+        Runs a file transfer command on a blocking socket.
+
+        Args:
+            command (str): "REQUEST_LAST_FILE", optionally with the hash of
+            the client's version, or "UPLOAD_FILE", optionally with the
+            client's username.
+            client_socket (socket.socket): The client's socket, or a socket
+            bridge on the asyncio engine.
+        """
+        command, _, argument = command.partition(":")
+        if command == "REQUEST_LAST_FILE":  # if client request file
+            known_digest = bytes.fromhex(argument) if argument else None
+            self.file_management_module.send_stored_file(client_socket,
+                                                         known_digest)
+        elif command == "UPLOAD_FILE":  # server upload file
+            self.file_management_module.store_client_file(client_socket,
+                                                          argument or None)
+
+    async def handle_stream_session_async(self, reader, writer,
+                                          client_address):
+        """
+        Receives frames from a client's streaming session on the asyncio
+        engine. Decoding runs on the executor.
+
+        Args:
+            reader (asyncio.StreamReader): The client's reader.
+            writer (asyncio.StreamWriter): The client's writer.
+            client_address (tuple): The client's address.
+        """
+        username = await AsyncProtocol.recv(reader)
+        stream_id = self.frame_processing_module.register_stream(username)
+        await AsyncProtocol.send_msg(writer, MSG_SESSION,
+                                     SESSION_RECORD.pack(stream_id))
+        try:
+            while self.network_module.running:
+                msg_type, flags, data = await AsyncProtocol.recv_msg(reader)
+                if msg_type == MSG_HEARTBEAT:
+                    # Nothing to decode, not worth an executor hop
+                    self.frame_processing_module.process_received_frame(
+                        data, client_address, msg_type, flags)
+                elif msg_type in (MSG_FRAME, MSG_DELTA):
+                    await self.network_module.run_blocking(
+                        self.frame_processing_module.process_received_frame,
+                        data, client_address, msg_type, flags)
+                elif data == b"STOP":
+                    print(f"Client {client_address} ended its stream")
+                    return
+        finally:
+            self.frame_processing_module.unregister_stream(stream_id)
+
+    def handle_stream_session(self, client_socket, client_address):
+        """
+        Receives frames from a client's streaming session.
+
+        The handshake carries the username once and replies with a stream
+        id. After it every message on the socket is a binary frame record,
+        so no text command is parsed per frame. Returns when the client
+        sends "STOP" or the server stops.
+
+        Args:
+            client_socket (socket.socket): The client's socket.
+            client_address (tuple): The client's address.
+        """
+        username = Protocol.recv(client_socket)
+        stream_id = self.frame_processing_module.register_stream(username)
+        FrameProtocol.accept_session(client_socket, stream_id)
+        try:
+            while self.network_module.running:
+                msg_type, flags, data = Protocol.recv_msg(client_socket)
+                if msg_type in (MSG_FRAME, MSG_DELTA, MSG_HEARTBEAT):
+                    self.frame_processing_module.process_received_frame(
+                        data, client_address, msg_type, flags)
+                elif data == b"STOP":
+                    print(f"Client {client_address} ended its stream")
+                    return
+        finally:
+            self.frame_processing_module.unregister_stream(stream_id)
 
     def diconnection(self, client_socket, client_address):
         """
@@ -105,9 +302,7 @@ class Server:
         # Remove client from the dictionary when disconnected
         del self.network_module.clients[client_address]
         print(f"Client {client_address} disconnecte")
-        if self.frame_processing_module.new_frame_callback is not None:
-            self.frame_processing_module \
-                .new_frame_callback(client_address, None, None)
+        self.frame_processing_module.client_disconnected(client_address)
         client_socket.close()
 
     def handle_disconnection(self, client_socket, client_address, error=None):
@@ -136,9 +331,7 @@ class Server:
                error (str): The error message.
         """
         print(f"Error handling client {client_address}: {error}")
-        if self.frame_processing_module.new_frame_callback is not None:
-            self.frame_processing_module \
-                .new_frame_callback(client_address, None, None)
+        self.frame_processing_module.client_disconnected(client_address)
 
     def cleanup_connection(self, client_socket, client_address):
         """
@@ -153,6 +346,5 @@ class Server:
             client_address (tuple): The client's address.
         """
         client_socket.close()
-        if self.frame_processing_module.new_frame_callback is not None:
-            self.frame_processing_module \
-                .new_frame_callback(client_address, None, None)
+        self.forget_listen_client(client_address)
+        self.frame_processing_module.client_disconnected(client_address)
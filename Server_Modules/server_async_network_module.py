@@ -0,0 +1,248 @@
+"""
+Server for network communication with asyncio
+Amit Skarbin
+"""
+
+import asyncio
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from Constants.constants import SERVER_LISTEN_BACKLOG, SERVER_WORKER_THREADS, \
+    FILE_WORKER_THREADS
+from Protocols.protocol import Protocol
+
+
+class ServerAsyncNetworkModule:
+    """
+    Network engine that serves every connection from one asyncio event loop.
+
+    It has the same interface as ServerNetworkModule, but the thread count
+    stays flat as clients connect: sockets are served by coroutines on a
+    single loop thread and blocking or CPU heavy work goes to a small,
+    fixed executor. File transfers block a thread for as long as they last,
+    so they run on an executor of their own and never hold up decoding.
+
+    Attributes:
+        clients (dict): Maps client addresses to their stream writers.
+        running (bool): Indicates whether the server is accepting clients.
+        executor (ThreadPoolExecutor): Runs decoding.
+        file_executor (ThreadPoolExecutor): Runs file transfers.
+    """
+
+    def __init__(self, host, port, client_handler_callback):
+        """
+        Initializes the network module with server host and port.
+
+        Args:
+            host (str): The IP address or hostname of the server.
+            port (int): The port number on which the server listens.
+            client_handler_callback (function): A coroutine function called
+            with (reader, writer, client_address) for every connection.
+        """
+        self.host = host
+        self.port = port
+        self.client_handler_callback = client_handler_callback
+        self.clients = {}  # Dictionary to store connected clients
+        self.running = False
+        self.loop = None
+        self.server = None
+        self.loop_thread = None
+        self.executor = ThreadPoolExecutor(max_workers=SERVER_WORKER_THREADS)
+        self.file_executor = ThreadPoolExecutor(
+            max_workers=FILE_WORKER_THREADS)
+
+    def start_server(self):
+        """
+        Starts the event loop thread and listens for incoming connections.
+        """
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self.loop.run_forever,
+                                            daemon=True)
+        self.loop_thread.start()
+        self.running = True
+        asyncio.run_coroutine_threadsafe(self.listen(), self.loop).result()
+        print(f"Server started on {self.host}:{self.port}")
+
+    async def listen(self):
+        """
+        Opens the listening socket on the event loop.
+        """
+        self.server = await asyncio.start_server(
+            self.accept_connection, self.host, self.port,
+            backlog=SERVER_LISTEN_BACKLOG)
+
+    async def accept_connection(self, reader, writer):
+        """
+        Registers a new connection and runs the client handler for it.
+
+        Args:
+            reader (asyncio.StreamReader): The connection's reader.
+            writer (asyncio.StreamWriter): The connection's writer.
+        """
+        client_address = writer.get_extra_info('peername')
+        Protocol.configure_socket(writer.get_extra_info('socket'))
+        print(f"Client connected from {client_address}")
+        self.clients[client_address] = writer
+        try:
+            await self.client_handler_callback(reader, writer, client_address)
+        finally:
+            self.remove_client(client_address)
+            writer.close()
+
+    async def run_blocking(self, function, *args):
+        """
+        Runs a blocking or CPU heavy function on the executor.
+
+        Args:
+            function (function): The function to run.
+            *args: Arguments for the function.
+
+        Returns:
+            The function's return value.
+        """
+        return await self.loop.run_in_executor(self.executor, function, *args)
+
+    async def run_file_transfer(self, function, *args):
+        """
+        Runs a file transfer, which blocks until the transfer ends, on the
+        file executor.
+
+        Args:
+            function (function): The function to run.
+            *args: Arguments for the function.
+
+        Returns:
+            The function's return value.
+        """
+        return await self.loop.run_in_executor(self.file_executor, function,
+                                               *args)
+
+    def blocking_socket(self, reader, writer):
+        """
+        Wraps a connection for code that expects a blocking socket.
+
+        Args:
+            reader (asyncio.StreamReader): The connection's reader.
+            writer (asyncio.StreamWriter): The connection's writer.
+
+        Returns:
+            StreamSocketBridge: A socket-like object usable from the executor.
+        """
+        return StreamSocketBridge(reader, writer, self.loop)
+
+    def notify_clients_test_over(self):
+        """
+        Notify all connected clients that the test is over.
+        """
+        data = b"".join(Protocol.legacy_buffers(b"TEST_OVER"))
+        for client_address, writer in list(self.clients.items()):
+            self.loop.call_soon_threadsafe(writer.write, data)
+
+    def send_text(self, client_address, data):
+        """
+        Sends a text message to one connected client.
+
+        Args:
+            client_address (tuple): The address of the client.
+            data (str): The message to send.
+        """
+        writer = self.clients[client_address]
+        message = b"".join(Protocol.legacy_buffers(data.encode()))
+        self.loop.call_soon_threadsafe(writer.write, message)
+
+    def stop_server(self):
+        """
+        Stops the server and closes all resources.
+        """
+        self.running = False
+        self.notify_clients_test_over()
+        asyncio.run_coroutine_threadsafe(self.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.executor.shutdown(wait=False)
+        self.file_executor.shutdown(wait=False)
+        print("Server stopped")
+
+    async def close(self):
+        """
+        Closes the listening socket and every client connection.
+        """
+        self.server.close()
+        for writer in list(self.clients.values()):
+            writer.close()
+        await self.server.wait_closed()
+
+    def remove_client(self, client_address):
+        """
+        Removes a client from the connected clients dictionary.
+
+        Args:
+            client_address (tuple): The address of the client to remove.
+        """
+        if client_address in self.clients:
+            del self.clients[client_address]
+            print(f"Client {client_address} removed")
+
+
+class StreamSocketBridge:
+    """
+    A blocking socket-like view of an asyncio connection.
+
+    Lets the socket based FileProtocol run unchanged on an executor thread
+    while the connection itself stays on the event loop.
+    """
+
+    def __init__(self, reader, writer, loop):
+        """
+        Initializes the bridge.
+
+        Args:
+            reader (asyncio.StreamReader): The connection's reader.
+            writer (asyncio.StreamWriter): The connection's writer.
+            loop (asyncio.AbstractEventLoop): The loop serving the connection.
+        """
+        self.reader = reader
+        self.writer = writer
+        self.loop = loop
+        # Makes drain wait until the socket took everything, so no data is
+        # still referenced by the transport once sendall returns
+        writer.transport.set_write_buffer_limits(0)
+
+    def recv(self, size):
+        """
+        Receives up to `size` bytes.
+        """
+        return self.call(self.reader.read(size))
+
+    def recv_into(self, view, size=0):
+        """
+        Receives up to `size` bytes into a writable buffer.
+        """
+        data = self.recv(size or len(view))
+        view[:len(data)] = data
+        return len(data)
+
+    def sendall(self, data):
+        """
+        Sends all of `data` without copying it, waiting until the socket
+        took all of it.
+        """
+        self.call(self.write(data))
+
+    def send(self, data):
+        """
+        Sends all of `data` and returns its length.
+        """
+        self.sendall(data)
+        return len(data)
+
+    async def write(self, data):
+        """
+        Writes on the event loop and applies flow control.
+        """
+        self.writer.write(data)
+        await self.writer.drain()
+
+    def call(self, coroutine):
+        """
+        Runs a coroutine on the connection's loop and waits for its result.
+        """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
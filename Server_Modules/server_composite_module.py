@@ -0,0 +1,77 @@
+"""
+Server for compositing channels
+Amit Skarbin
+"""
+
+import threading
+import cv2
+import numpy as np
+from Protocols.frame_protocol import CHANNEL_COMBINED, CHANNEL_CAMERA
+
+
+class ServerCompositeModule:
+    """
+    Composites a client's independent screen and camera channels for display.
+
+    Each channel arrives at its own rate, so the newest decoded frame of both
+    is kept and every update returns them side by side, camera on the left
+    scaled to the screen's height like the combined frames clients used to
+    send. Combined frames pass through unchanged.
+
+    Attributes:
+        frames (dict): Maps keys to {channel: newest decoded frame}.
+    """
+
+    def __init__(self):
+        """
+        Initializes the module with no clients.
+        """
+        self.frames = {}
+        self.lock = threading.Lock()
+
+    def update(self, key, channel, frame):
+        """
+        Stores a channel's newest frame and returns the client's composite.
+
+        Args:
+            key: The client the frame belongs to.
+            channel (int): The CHANNEL_* value of the frame.
+            frame (numpy.ndarray): The decoded frame.
+
+        Returns:
+            numpy.ndarray: The frame to display, a new array unless the
+            frame is a combined one, which is not stored. The caller may
+            draw on it.
+        """
+        if channel == CHANNEL_COMBINED:
+            return frame
+        with self.lock:
+            channels = self.frames.setdefault(key, {})
+            channels[channel] = frame
+            camera = channels.get(CHANNEL_CAMERA)
+            screen = next((channels[other] for other in channels
+                           if other != CHANNEL_CAMERA), None)
+        if camera is None or screen is None:
+            return frame.copy()  # The stored frame is composited later
+        height = screen.shape[0]
+        camera_width = max(camera.shape[1] * height // camera.shape[0], 1)
+        composite = np.empty((height, camera_width + screen.shape[1], 3),
+                             np.uint8)
+        camera_view = composite[:, :camera_width]
+        if camera.shape[:2] == camera_view.shape[:2]:
+            camera_view[:] = camera
+        else:
+            cv2.resize(camera, (camera_width, height), dst=camera_view,
+                       interpolation=cv2.INTER_AREA)
+        composite[:, camera_width:] = screen
+        return composite
+
+    def forget(self, key):
+        """
+        Drops a client's frames when it disconnects.
+
+        Args:
+            key: The client to forget.
+        """
+        with self.lock:
+            self.frames.pop(key, None)
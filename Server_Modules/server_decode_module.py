@@ -0,0 +1,215 @@
+"""
+Server for frame decoding
+Amit Skarbin
+"""
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import cv2
+import numpy as np
+from Constants.constants import FRAME_DECODE_COLOR_MODE, DECODE_WORKER_KIND, \
+    DECODE_WORKERS
+
+# Reduced decode modes by scale factor, largest first
+REDUCED_DECODE_MODES = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                        (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+def decode_jpeg(encoded_frame, color_mode):
+    """
+    Decodes JPEG bytes. Module level so it can run in a process pool.
+
+    Args:
+        encoded_frame (bytes): The JPEG bytes of the frame.
+        color_mode (int): The cv2.IMREAD_* mode to decode with.
+
+    Returns:
+        numpy.ndarray: The decoded frame, or None if decoding failed.
+    """
+    return cv2.imdecode(np.frombuffer(encoded_frame, np.uint8), color_mode)
+
+
+def scale_frame(frame, factor):
+    """
+    Downscales an already decoded frame like a reduced decode would.
+
+    Args:
+        frame (numpy.ndarray): The decoded frame.
+        factor (int): The scale factor, 1 returns the frame unchanged.
+
+    Returns:
+        numpy.ndarray: The scaled frame.
+    """
+    if factor == 1:
+        return frame
+    height, width = frame.shape[:2]
+    return cv2.resize(frame, (max(width // factor, 1),
+                              max(height // factor, 1)),
+                      interpolation=cv2.INTER_AREA)
+
+
+class ServerDecodeModule:
+    """
+    Decodes frames on a worker pool, at the size they will be displayed.
+
+    JPEG can be decoded at 1/2, 1/4 or 1/8 scale for a fraction of the work,
+    so a frame shown in a small grid tile is decoded reduced and only a
+    fullscreen stream is decoded at full size. One frame per key is decoded
+    at a time. A frame submitted meanwhile waits as the key's pending frame,
+    replacing an older pending one, and is decoded next, so the newest frame
+    is always shown even when the stream goes quiet after it. Only the
+    newest decoded frame per key is kept.
+
+    Attributes:
+        frame_sizes (dict): Full (width, height) of each key's frames,
+        learned from earlier decodes.
+        dropped_frames (dict): Pending frames replaced by a newer one before
+        they were decoded.
+    """
+
+    def __init__(self, worker_kind=DECODE_WORKER_KIND, workers=DECODE_WORKERS):
+        """
+        Initializes the worker pool.
+
+        Args:
+            worker_kind (str): "thread" or "process".
+            workers (int): The number of decode workers.
+        """
+        self.use_processes = worker_kind == "process"
+        if self.use_processes:
+            self.executor = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=workers)
+        self.frame_sizes = {}
+        self.dropped_frames = {}
+        self.in_flight = set()
+        self.forgotten = set()  # Keys forgotten while a decode was running
+        self.pending = {}
+        self.decoded = {}
+        self.lock = threading.Lock()
+
+    def decode_mode(self, key, tile_size):
+        """
+        Picks the smallest decode that still covers the tile.
+
+        Args:
+            key: The stream the frame belongs to.
+            tile_size (tuple): (width, height) the frame is shown at, or None
+            to decode at full size.
+
+        Returns:
+            tuple: (scale factor, cv2.IMREAD_* mode).
+        """
+        frame_size = self.frame_sizes.get(key)
+        if tile_size is None or frame_size is None:
+            return 1, FRAME_DECODE_COLOR_MODE
+        scale = min(frame_size[0] / max(tile_size[0], 1),
+                    frame_size[1] / max(tile_size[1], 1))
+        for factor, mode in REDUCED_DECODE_MODES:
+            if scale >= factor:
+                return factor, mode
+        return 1, FRAME_DECODE_COLOR_MODE
+
+    def submit(self, key, encoded_frame, tile_size, context=None):
+        """
+        Queues a frame for decoding, or keeps it as the key's pending frame
+        while the key's previous frame is still being decoded.
+
+        Args:
+            key: The stream the frame belongs to.
+            encoded_frame (memoryview): The JPEG bytes of the frame, or a
+            decoded frame (numpy.ndarray) that only needs scaling.
+            tile_size (tuple): (width, height) the frame is shown at, or None
+            for full size.
+            context: Passed back with the decoded frame.
+
+        Returns:
+            bool: True if the frame was queued, False if it is pending.
+        """
+        with self.lock:
+            if key in self.in_flight:
+                if key in self.pending:
+                    self.dropped_frames[key] = \
+                        self.dropped_frames.get(key, 0) + 1
+                self.pending[key] = (encoded_frame, tile_size, context)
+                return False
+            self.in_flight.add(key)
+        self.start_decode(key, encoded_frame, tile_size, context)
+        return True
+
+    def start_decode(self, key, encoded_frame, tile_size, context):
+        """
+        Hands a frame to the worker pool. The key must be in flight.
+        """
+        factor, mode = self.decode_mode(key, tile_size)
+        if isinstance(encoded_frame, np.ndarray):
+            future = self.executor.submit(scale_frame, encoded_frame, factor)
+        else:
+            if self.use_processes:
+                encoded_frame = bytes(encoded_frame)  # Must be picklable
+            future = self.executor.submit(decode_jpeg, encoded_frame, mode)
+        future.add_done_callback(
+            lambda done: self.frame_decoded(key, factor, context, done))
+
+    def frame_decoded(self, key, factor, context, future):
+        """
+        Stores a finished decode as the key's newest frame and starts
+        decoding the key's pending frame.
+        """
+        try:
+            frame = future.result()
+        except Exception as e:
+            print(f"Error decoding frame for {key}: {e}")
+            frame = None
+        with self.lock:
+            if key in self.forgotten:
+                # Only frames submitted after the key was forgotten count
+                self.forgotten.discard(key)
+                frame = None
+            if frame is not None:
+                self.frame_sizes[key] = (frame.shape[1] * factor,
+                                         frame.shape[0] * factor)
+                self.decoded[key] = (frame, context)
+            pending = self.pending.pop(key, None)
+            if pending is None:
+                self.in_flight.discard(key)
+                return
+        try:
+            self.start_decode(key, *pending)
+        except RuntimeError:  # The pool was shut down
+            with self.lock:
+                self.in_flight.discard(key)
+
+    def take_decoded(self):
+        """
+        Takes the newest decoded frame of every key.
+
+        Returns:
+            dict: Maps keys to (frame, context).
+        """
+        with self.lock:
+            decoded, self.decoded = self.decoded, {}
+        return decoded
+
+    def forget(self, key):
+        """
+        Drops a key's state. A decode still in progress keeps the key in
+        flight until it finishes, and its frame is discarded.
+
+        Args:
+            key: The stream to forget.
+        """
+        with self.lock:
+            if key in self.in_flight:
+                self.forgotten.add(key)
+            self.pending.pop(key, None)
+            self.decoded.pop(key, None)
+            self.frame_sizes.pop(key, None)
+            self.dropped_frames.pop(key, None)
+
+    def shutdown(self):
+        """
+        Stops the worker pool.
+        """
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,119 @@
+"""
+Server for delta frames
+Amit Skarbin
+"""
+
+import threading
+import cv2
+import numpy as np
+from Constants.constants import FRAME_DECODE_COLOR_MODE
+from Protocols.frame_protocol import FrameProtocol, TILE_INDEX_TYPE
+
+
+def patch_tiles(canvas, tile_size, tile_indices, tiles):
+    """
+    Copies decoded tiles into a canvas.
+
+    Args:
+        canvas (numpy.ndarray): The full frame to patch in place.
+        tile_size (int): The side of the square tiles in pixels.
+        tile_indices (numpy.ndarray): Row-major indices of the tiles.
+        tiles (numpy.ndarray): The tiles stacked vertically.
+    """
+    height, width = canvas.shape[:2]
+    cols = -(-width // tile_size)
+    for position, index in enumerate(tile_indices):
+        row, col = divmod(int(index), cols)
+        top, left = row * tile_size, col * tile_size
+        target = canvas[top:top + tile_size, left:left + tile_size]
+        strip_top = position * tile_size
+        target[:] = tiles[strip_top:strip_top + target.shape[0],
+                          :target.shape[1]]
+
+
+class ServerDeltaModule:
+    """
+    Keeps a per-stream canvas that delta frames are patched into.
+
+    Keyframes are only remembered when they arrive; the canvas is decoded
+    from the latest keyframe when the first delta after it needs it, so
+    streams that send no deltas cost nothing here.
+
+    Attributes:
+        canvases (dict): Maps (stream id, channel) keys to their current
+        full frame.
+        keyframes (dict): Maps (stream id, channel) keys to a keyframe not
+        yet decoded into the canvas.
+    """
+
+    def __init__(self):
+        """
+        Initializes the module with no streams.
+        """
+        self.canvases = {}
+        self.keyframes = {}
+        self.lock = threading.Lock()
+
+    def keyframe_received(self, stream_key, encoded_frame):
+        """
+        Remembers a stream's newest keyframe.
+
+        Args:
+            stream_key (tuple): The (stream id, channel) the keyframe
+            belongs to.
+            encoded_frame (memoryview): The JPEG bytes of the keyframe.
+        """
+        with self.lock:
+            self.keyframes[stream_key] = encoded_frame
+
+    def apply_delta(self, stream_key, data):
+        """
+        Patches a delta into the stream's canvas.
+
+        Args:
+            stream_key (tuple): The (stream id, channel) the delta belongs to.
+            data (memoryview): The delta part of the frame record.
+
+        Returns:
+            numpy.ndarray: A copy of the patched canvas, or None if the
+            stream has no keyframe to patch.
+        """
+        frame_size, tile_size, indices, encoded_tiles = \
+            FrameProtocol.unpack_delta(data)
+        with self.lock:
+            canvas = self.current_canvas(stream_key)
+            if canvas is None or \
+                    (canvas.shape[1], canvas.shape[0]) != frame_size:
+                return None
+            if len(encoded_tiles):
+                tiles = cv2.imdecode(np.frombuffer(encoded_tiles, np.uint8),
+                                     FRAME_DECODE_COLOR_MODE)
+                if tiles is None:
+                    return None
+                patch_tiles(canvas, tile_size,
+                            np.frombuffer(indices, TILE_INDEX_TYPE), tiles)
+            return canvas.copy()
+
+    def current_canvas(self, stream_key):
+        """
+        Returns the stream's canvas, decoding a pending keyframe into it.
+        Called with the lock held.
+        """
+        encoded_frame = self.keyframes.pop(stream_key, None)
+        if encoded_frame is not None:
+            frame = cv2.imdecode(np.frombuffer(encoded_frame, np.uint8),
+                                 FRAME_DECODE_COLOR_MODE)
+            if frame is not None:
+                self.canvases[stream_key] = frame
+        return self.canvases.get(stream_key)
+
+    def forget(self, stream_key):
+        """
+        Drops a stream channel's canvas when its session ends.
+
+        Args:
+            stream_key (tuple): The (stream id, channel) to forget.
+        """
+        with self.lock:
+            self.canvases.pop(stream_key, None)
+            self.keyframes.pop(stream_key, None)
@@ -0,0 +1,170 @@
+"""
+Server for exam file distribution
+Amit Skarbin
+"""
+
+import hashlib
+import mmap
+import os
+import threading
+from Constants.constants import DISTRIBUTION_SLICE_SIZE
+from Protocols.protocol import Protocol
+from Protocols.file_protocol import FileProtocol
+
+
+class ServerDistributionModule:
+    """
+    Serves the teacher's current exam file to every student who asks.
+
+    The file is memory-mapped and hashed once when the teacher publishes
+    it. Every request is then served from that one shared mapping, so
+    students downloading together cost no extra disk reads or copies. Each
+    connection sends it in DISTRIBUTION_SLICE_SIZE slices, so concurrent
+    downloads interleave instead of one waiting for another. A file worth
+    compressing is compressed once, by its first download, and every
+    download from the start is sent those same compressed pieces. A student
+    that sends the hash of the version it already has is told so and not
+    sent the file again. A replaced file stays mapped until the last
+    download of it finishes, then its mapping is closed.
+
+    Attributes:
+        current (DistributedFile): The published file, or None.
+        served (int): Downloads sent.
+        skipped (int): Downloads skipped because the student had the file.
+    """
+
+    def __init__(self):
+        """
+        Initializes the module with no published file.
+        """
+        self.current = None
+        self.served = 0
+        self.skipped = 0
+        self.lock = threading.Lock()
+
+    def publish(self, file_path):
+        """
+        Maps and hashes a file and makes it the one served.
+
+        Downloads already in progress finish with the previous file.
+
+        Args:
+            file_path (str): The path of the file.
+        """
+        published = DistributedFile(file_path)
+        with self.lock:
+            previous, self.current = self.current, published
+        if previous is not None:
+            previous.release()  # Closed now or by its last download
+
+    def send_current(self, sock, known_digest=None):
+        """
+        Answers a student's download request.
+
+        Replies "NO_FILE" when nothing is published, "SAME_FILE" when the
+        student already has the published version, otherwise "FILE" and
+        the file itself.
+
+        Args:
+            sock (socket.socket): The student's socket, or a socket bridge
+            on the asyncio engine.
+            known_digest (bytes): The SHA-256 of the version the student
+            already has, or None.
+        """
+        with self.lock:
+            current = self.current
+            if current is not None:
+                current.acquire()
+        if current is None:
+            Protocol.send(sock, "NO_FILE")
+            print("No file has been uploaded yet.")
+            return
+        try:
+            if known_digest == current.digest:
+                Protocol.send(sock, "SAME_FILE")
+                with self.lock:
+                    self.skipped += 1
+            else:
+                Protocol.send(sock, "FILE")
+                FileProtocol.send_view(sock, current.name, current.view,
+                                       current.digest,
+                                       DISTRIBUTION_SLICE_SIZE,
+                                       codec=current.codec,
+                                       compressed=current.compressed,
+                                       file_path=current.path)
+                with self.lock:
+                    self.served += 1
+        finally:
+            current.release()
+
+
+class DistributedFile:
+    """
+    A published file: its name, shared read-only content and hash.
+
+    The file counts its users, the module while it is published and every
+    download in progress, and closes its mapping when the last one is done.
+
+    Attributes:
+        path (str): The path of the file.
+        name (str): The name students save it as.
+        view (memoryview): The mapped content.
+        digest (bytes): The SHA-256 of the content.
+        codec (int): The codec it is sent with, chosen once.
+        pieces (list): The content compressed with the codec, as from
+        FileProtocol.compress_slices, once a download needed it.
+    """
+
+    def __init__(self, path):
+        """
+        Maps and hashes a file and chooses how to compress it.
+
+        Args:
+            path (str): The path of the file.
+        """
+        self.path = path
+        self.name = os.path.basename(path)
+        self.view = FileProtocol.map_file(path)
+        self.digest = hashlib.sha256(self.view).digest()
+        self.codec = FileProtocol.choose_codec(self.view)
+        self.pieces = None
+        self.users = 1  # The module, until the file is replaced
+        self.lock = threading.Lock()
+        self.compress_lock = threading.Lock()
+
+    def compressed(self):
+        """
+        Returns the content compressed with the file's codec, compressing
+        it on the first call. Concurrent first downloads wait for that one
+        pass instead of compressing the file each.
+
+        Returns:
+            list: (compressed piece, content bytes done) pairs.
+        """
+        with self.compress_lock:
+            if self.pieces is None:
+                self.pieces = list(FileProtocol.compress_slices(
+                    self.view, 0, self.codec, DISTRIBUTION_SLICE_SIZE))
+            return self.pieces
+
+    def acquire(self):
+        """
+        Counts a new user of the file.
+        """
+        with self.lock:
+            self.users += 1
+
+    def release(self):
+        """
+        Counts a user done with the file, closing the mapping after the
+        last one.
+        """
+        with self.lock:
+            self.users -= 1
+            if self.users:
+                return
+        self.pieces = None
+        mapping = self.view.obj
+        self.view.release()
+        if isinstance(mapping, mmap.mmap):  # Empty files are not mapped
+            mapping.close()
@@ -5,9 +5,9 @@ Amit Skarbin
 
 import os
 
-from Protocols.file_protocol import FileProtocol
-from Protocols.protocol import Protocol
-
+from Server_Modules.server_distribution_module \
+    import ServerDistributionModule
+from Server_Modules.server_submission_module import ServerSubmissionModule
 
 
 class ServerFileManagementModule:
@@ -20,6 +20,10 @@ class ServerFileManagementModule:
     Attributes:
         last_uploaded_file (str): The path of the last file uploaded
         by a client.
+        distribution_module (ServerDistributionModule): Serves the last
+        uploaded file to students.
+        submission_module (ServerSubmissionModule): Stores the files
+        students submit.
     """
 
     def __init__(self):
@@ -27,35 +31,32 @@ class ServerFileManagementModule:
         Initializes the ServerFileManagementModule.
         """
         self.last_uploaded_file = None
+        self.distribution_module = ServerDistributionModule()
+        self.submission_module = ServerSubmissionModule()
 
-    def store_client_file(self, client_socket):
+    def store_client_file(self, client_socket, username=None):
         """
         Stores a file received from a client.
 
         Args:
             client_socket (socket.socket): The client socket from which to
             receive the file.
+            username (str): The username of the submitting client.
         """
-        directory = "C:/client_files"
-        if not os.path.exists(directory):
-            os.makedirs(directory)
-        FileProtocol.recv_file(client_socket, directory)
-        print("File stored successfully in " + directory)
+        path = self.submission_module.store(client_socket, username)
+        print("File stored successfully in " + path)
 
-    def send_stored_file(self, client_socket):
+    def send_stored_file(self, client_socket, known_digest=None):
         """
         Sends the last uploaded file to a client.
 
         Args:
             client_socket (socket.socket): The client socket to which to send
             the file.
+            known_digest (bytes): The SHA-256 of the version the client
+            already has, or None.
         """
-        if self.last_uploaded_file:
-            Protocol.send(client_socket, "FILE")
-            FileProtocol.send_file(client_socket, self.last_uploaded_file)
-        else:
-            Protocol.send(client_socket, "NO_FILE")
-            print("No file has been uploaded yet.")
+        self.distribution_module.send_current(client_socket, known_digest)
 
     def upload_file(self, file_path):
         """
@@ -67,4 +68,9 @@ class ServerFileManagementModule:
         """
 
         self.last_uploaded_file = file_path
+        self.distribution_module.publish(file_path)
+        self.submission_module.add_blob(
+            file_path, self.distribution_module.current.digest)
+        self.submission_module.set_exam(
+            os.path.splitext(os.path.basename(file_path))[0])
         print("Uploading file " + file_path)
@@ -0,0 +1,69 @@
+"""
+Server for latest frame slots
+Amit Skarbin
+"""
+
+import threading
+
+
+class ServerFrameSlotModule:
+    """
+    Holds the latest encoded frame of every client channel until the display
+    takes it.
+
+    Network threads put frames in and the display pump takes them out. A new
+    frame replaces one that was not displayed yet, so memory stays at one
+    frame per client and the display never falls behind the live stream.
+    Replaced frames are never decoded, only counted.
+
+    Attributes:
+        slots (dict): Maps (client address, channel) keys to
+        (username, encoded_frame).
+        dropped_frames (dict): Maps keys to the number of frames replaced
+        before they were displayed.
+    """
+
+    def __init__(self):
+        """
+        Initializes empty slots.
+        """
+        self.slots = {}
+        self.dropped_frames = {}
+        self.lock = threading.Lock()
+
+    def put(self, key, username, encoded_frame):
+        """
+        Stores a channel's newest frame, dropping the one it replaces.
+
+        Args:
+            key (tuple): The (client address, channel) of the frame.
+            username (str): The username of the client.
+            encoded_frame (memoryview): The JPEG bytes of the frame, or an
+            already decoded frame (numpy.ndarray) for delta streams.
+        """
+        with self.lock:
+            if key in self.slots:
+                self.dropped_frames[key] = self.dropped_frames.get(key, 0) + 1
+            self.slots[key] = (username, encoded_frame)
+
+    def take_all(self):
+        """
+        Takes the pending frame of every channel, emptying the slots.
+
+        Returns:
+            dict: Maps keys to (username, encoded_frame).
+        """
+        with self.lock:
+            slots, self.slots = self.slots, {}
+        return slots
+
+    def remove(self, key):
+        """
+        Forgets a disconnected client channel's slot and counters.
+
+        Args:
+            key (tuple): The (client address, channel) to forget.
+        """
+        with self.lock:
+            self.slots.pop(key, None)
+            self.dropped_frames.pop(key, None)
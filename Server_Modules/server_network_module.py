@@ -5,6 +5,7 @@ Amit Skarbin
 
 import socket
 import threading
+from Constants.constants import SERVER_LISTEN_BACKLOG
 from Protocols.protocol import Protocol
 
 
@@ -25,23 +26,47 @@ class ServerNetworkModule:
         self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.server_socket.bind((self.host, self.port))
         self.clients = {}  # Dictionary to store connected clients
+        self.send_locks = {}  # Serialize messages sent to one client
         self.running = False
 
+    def send_locked(self, client_address, client_socket, data):
+        """
+        Sends a text message to a client, one message at a time, so
+        messages sent from different threads never interleave.
+
+        Args:
+            client_address (tuple): The address of the client.
+            client_socket (socket.socket): The client's socket.
+            data (str): The message to send.
+        """
+        with self.send_locks.setdefault(client_address, threading.Lock()):
+            Protocol.send(client_socket, data)
+
     def notify_clients_test_over(self):
         """
         Notify all connected clients that the test is over.
         """
-        for client_address, client_socket in self.clients.items():
+        for client_address, client_socket in list(self.clients.items()):
             try:
-                Protocol.send(client_socket, "TEST_OVER")
+                self.send_locked(client_address, client_socket, "TEST_OVER")
             except Exception as e:
                 print(f"Error notifying client at {client_address}: {e}")
 
+    def send_text(self, client_address, data):
+        """
+        Sends a text message to one connected client.
+
+        Args:
+            client_address (tuple): The address of the client.
+            data (str): The message to send.
+        """
+        self.send_locked(client_address, self.clients[client_address], data)
+
     def start_server(self):
         """
         Starts the server to listen for incoming connections and handle them.
         """
-        self.server_socket.listen()
+        self.server_socket.listen(SERVER_LISTEN_BACKLOG)
         self.running = True
         print(f"Server started on {self.host}:{self.port}")
         accept_thread = threading.Thread(target=self.accept_connections)
@@ -54,6 +79,7 @@ class ServerNetworkModule:
         while self.running:
             try:
                 client_socket, client_address = self.server_socket.accept()
+                Protocol.configure_socket(client_socket)
 
                 print(f"Client connected from {client_address}")
                 # Add client to the dictionary
@@ -87,6 +113,7 @@ class ServerNetworkModule:
         Args:
             client_address (tuple): The address of the client to remove.
         """
+        self.send_locks.pop(client_address, None)
         if client_address in self.clients:
             del self.clients[client_address]
             print(f"Client {client_address} removed")
@@ -0,0 +1,280 @@
+"""
+Server for stream recording
+Amit Skarbin
+"""
+
+import mmap
+import os
+import queue
+import re
+import struct
+import threading
+import time
+import numpy as np
+from Constants.constants import RECORDINGS_ROOT, RECORDING_QUEUE_SIZE, \
+    RECORDING_BATCH_SIZE, RECORDING_SEGMENT_SIZE
+from Protocols.protocol import MSG_FRAME
+
+# Index entry per recorded frame: capture time, offset in the segment,
+# length and message type (MSG_FRAME or MSG_DELTA). Little-endian and
+# fixed size so an index file can be memory-mapped as INDEX_DTYPE.
+INDEX_RECORD = struct.Struct("<dQIB3x")
+INDEX_DTYPE = np.dtype([("timestamp", "<f8"), ("offset", "<u8"),
+                        ("length", "<u4"), ("kind", "u1"), ("pad", "V3")])
+
+STOP_ITEM = object()  # Tells the writer thread to finish
+
+
+class ServerRecordingModule:
+    """
+    Records every student's encoded frames to disk, without re-encoding.
+
+    The network threads only put the received frame, a view of the buffer it
+    arrived in, on a bounded queue. A background writer thread drains the
+    queue in batches and appends each frame to its stream's segment file and
+    an index entry to the segment's index file, so recording adds no disk
+    latency to the live path. When the writer falls behind and the queue is
+    full, frames are dropped rather than slowing the stream down.
+
+    Every student channel gets its own segment files, started on a keyframe
+    once the current segment is full, so each segment can be played on its
+    own:
+        <root>/<session>/<username>/<channel>-<segment>.seg and .idx
+
+    Attributes:
+        directory (str): The directory of this server session's recordings.
+        dropped_frames (int): Frames dropped because the queue was full.
+    """
+
+    def __init__(self, root=RECORDINGS_ROOT, queue_size=RECORDING_QUEUE_SIZE,
+                 segment_size=RECORDING_SEGMENT_SIZE):
+        """
+        Initializes the module and starts the writer thread.
+
+        Args:
+            root (str): The directory recordings are stored under.
+            queue_size (int): The frames that may wait for the writer.
+            segment_size (int): The bytes after which a new segment starts.
+        """
+        self.directory = os.path.join(root, time.strftime("%Y%m%d-%H%M%S"))
+        self.segment_size = segment_size
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.streams = {}
+        self.dropped_frames = 0
+        self.writer_thread = threading.Thread(target=self.write_frames,
+                                              daemon=True)
+        self.writer_thread.start()
+
+    def record(self, username, channel, msg_type, timestamp, encoded_frame):
+        """
+        Queues a received frame for recording. Never blocks.
+
+        Args:
+            username (str): The username of the streaming client.
+            channel (int): The CHANNEL_* value of the frame.
+            msg_type (int): MSG_FRAME or MSG_DELTA.
+            timestamp (float): The capture time of the frame.
+            encoded_frame (memoryview): The frame as received, after the
+            frame record.
+        """
+        try:
+            self.queue.put_nowait((username, channel, msg_type, timestamp,
+                                   encoded_frame))
+        except queue.Full:
+            self.dropped_frames += 1
+
+    def write_frames(self):
+        """
+        Writes queued frames in batches until stopped. Runs on the writer
+        thread.
+        """
+        running = True
+        while running:
+            batch = [self.queue.get()]
+            size = 0
+            while size < RECORDING_BATCH_SIZE:
+                try:
+                    item = self.queue.get_nowait()
+                except queue.Empty:
+                    break
+                batch.append(item)
+                if item is not STOP_ITEM:
+                    size += len(item[4])
+            if STOP_ITEM in batch:
+                running = False
+                batch = [item for item in batch if item is not STOP_ITEM]
+            try:
+                self.write_batch(batch)
+            except Exception as e:
+                print(f"Error writing recording: {e}")
+        for stream in self.streams.values():
+            stream.close()
+        self.streams.clear()
+
+    def write_batch(self, batch):
+        """
+        Appends a batch of frames to their segments, one write per file.
+
+        Args:
+            batch (list): Queued (username, channel, msg_type, timestamp,
+            encoded_frame) items.
+        """
+        pending = {}
+        for username, channel, msg_type, timestamp, encoded_frame in batch:
+            stream = self.stream(username, channel)
+            if stream.size >= self.segment_size and msg_type == MSG_FRAME:
+                self.flush(pending.pop(stream, None), stream)
+                stream.next_segment()
+            frames, entries = pending.setdefault(stream, ([], []))
+            frames.append(encoded_frame)
+            entries.append(INDEX_RECORD.pack(timestamp, stream.size,
+                                             len(encoded_frame), msg_type))
+            stream.size += len(encoded_frame)
+        for stream, buffers in pending.items():
+            self.flush(buffers, stream)
+
+    def flush(self, buffers, stream):
+        """
+        Writes a stream's pending frames and index entries.
+        """
+        if buffers is None:
+            return
+        frames, entries = buffers
+        stream.segment_file.writelines(frames)
+        stream.index_file.write(b"".join(entries))
+        stream.segment_file.flush()
+        stream.index_file.flush()
+
+    def stream(self, username, channel):
+        """
+        Returns the recording of a student channel, opening it on first use.
+        """
+        key = (username, channel)
+        stream = self.streams.get(key)
+        if stream is None:
+            name = re.sub(r"[^\w-]", "_", username or "unknown")
+            directory = os.path.join(self.directory, name)
+            os.makedirs(directory, exist_ok=True)
+            stream = RecordingStream(directory, channel)
+            self.streams[key] = stream
+        return stream
+
+    def stop(self):
+        """
+        Writes the frames still queued and closes every recording.
+        """
+        self.queue.put(STOP_ITEM)
+        self.writer_thread.join()
+
+
+class RecordingStream:
+    """
+    The open segment and index files of one recorded student channel.
+
+    Attributes:
+        size (int): The bytes written to the current segment.
+    """
+
+    def __init__(self, directory, channel):
+        """
+        Opens the first free segment of the channel.
+
+        Args:
+            directory (str): The student's recording directory.
+            channel (int): The CHANNEL_* value of the recording.
+        """
+        self.directory = directory
+        self.channel = channel
+        self.segment = -1
+        self.segment_file = None
+        self.index_file = None
+        self.size = 0
+        self.next_segment()
+
+    def path(self, segment):
+        """
+        Returns the segment file path, without extension.
+        """
+        return os.path.join(self.directory,
+                            f"{self.channel}-{segment:04d}")
+
+    def next_segment(self):
+        """
+        Closes the current segment and starts the next one.
+        """
+        self.close()
+        self.segment += 1
+        while os.path.exists(self.path(self.segment) + ".seg"):
+            self.segment += 1
+        path = self.path(self.segment)
+        self.segment_file = open(path + ".seg", "ab")
+        self.index_file = open(path + ".idx", "ab")
+        self.size = 0
+
+    def close(self):
+        """
+        Closes the segment and index files.
+        """
+        if self.segment_file is not None:
+            self.segment_file.close()
+            self.index_file.close()
+
+
+class RecordingReader:
+    """
+    Reads a recorded segment through its memory-mapped index.
+
+    Attributes:
+        index (numpy.ndarray): The index entries, as INDEX_DTYPE.
+    """
+
+    def __init__(self, path):
+        """
+        Maps a segment and its index.
+
+        Args:
+            path (str): The segment path without extension.
+        """
+        self.segment_file = open(path + ".seg", "rb")
+        self.segment = None  # An empty file cannot be mapped
+        if os.fstat(self.segment_file.fileno()).st_size:
+            self.segment = mmap.mmap(self.segment_file.fileno(), 0,
+                                     access=mmap.ACCESS_READ)
+        entries = os.path.getsize(path + ".idx") // INDEX_DTYPE.itemsize
+        if entries:
+            self.index = np.memmap(path + ".idx", INDEX_DTYPE, "r",
+                                   shape=(entries,))
+        else:
+            self.index = np.empty(0, INDEX_DTYPE)
+
+    def seek(self, timestamp):
+        """
+        Finds the frames needed to show the stream at a point in time: the
+        last keyframe at or before it and the deltas after that keyframe.
+
+        Args:
+            timestamp (float): The capture time to seek to.
+
+        Returns:
+            list: (msg_type, timestamp, memoryview of the frame) tuples,
+            starting with a keyframe, or an empty list.
+        """
+        end = int(np.searchsorted(self.index["timestamp"], timestamp,
+                                  side="right"))
+        keyframes = np.flatnonzero(self.index["kind"][:end] == MSG_FRAME)
+        if not len(keyframes):
+            return []
+        view = memoryview(self.segment if self.segment is not None
+                          else b"")
+        return [(int(entry["kind"]), float(entry["timestamp"]),
+                 view[entry["offset"]:entry["offset"] + entry["length"]])
+                for entry in self.index[keyframes[-1]:end]]
+
+    def close(self):
+        """
+        Unmaps the segment.
+        """
+        del self.index
+        if self.segment is not None:
+            self.segment.close()
+        self.segment_file.close()
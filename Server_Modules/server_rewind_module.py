@@ -0,0 +1,210 @@
+"""
+Server for the rewind buffer
+Amit Skarbin
+"""
+
+import collections
+import heapq
+import itertools
+import threading
+import time
+import numpy as np
+from Constants.constants import REWIND_SECONDS, REWIND_MEMORY_LIMIT, \
+    FRAME_DECODE_COLOR_MODE
+from Protocols.protocol import MSG_DELTA
+from Protocols.frame_protocol import FrameProtocol, TILE_INDEX_TYPE
+from Server_Modules.server_decode_module import decode_jpeg
+from Server_Modules.server_delta_module import patch_tiles
+
+
+class ServerRewindModule:
+    """
+    Keeps the last seconds of every student's stream, still encoded.
+
+    Frames are kept as the JPEG and delta bytes they arrived as, so a
+    minute of a student costs about as much as a minute of its bandwidth,
+    and a frame is only decoded when someone scrubs to it. Memory is bounded
+    twice: frames older than the rewind window are evicted, and the oldest
+    frames of all students are evicted first whenever the total passes the
+    memory limit. Deltas left without their keyframe are evicted with it.
+    Each stream is kept in arrival order, so the oldest frame of all is the
+    oldest first frame of any stream, found on a heap of the streams' first
+    frames without scanning every stream.
+
+    Attributes:
+        streams (dict): Maps (client address, channel) keys to a deque of
+        (received, timestamp, msg_type, encoded_frame) records.
+        heads (list): A heap of (received, order, stream, key) for the first
+        record of every stream. Entries of forgotten streams stay until they
+        reach the top.
+        size (int): The bytes held by all records.
+    """
+
+    def __init__(self, seconds=REWIND_SECONDS,
+                 memory_limit=REWIND_MEMORY_LIMIT):
+        """
+        Initializes an empty buffer.
+
+        Args:
+            seconds (float): How long a frame is kept.
+            memory_limit (int): The bytes kept for all students together.
+        """
+        self.seconds = seconds
+        self.memory_limit = memory_limit
+        self.streams = {}
+        self.heads = []
+        self.order = itertools.count()  # Orders heads received together
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def add(self, key, timestamp, msg_type, encoded_frame):
+        """
+        Keeps a received frame, evicting old ones as needed.
+
+        Args:
+            key (tuple): The (client address, channel) of the frame.
+            timestamp (float): The capture time of the frame.
+            msg_type (int): MSG_FRAME or MSG_DELTA.
+            encoded_frame (memoryview): The frame as received, after the
+            frame record.
+        """
+        now = time.monotonic()
+        record = (now, timestamp, msg_type, encoded_frame)
+        with self.lock:
+            stream = self.streams.get(key)
+            if stream is None:
+                if msg_type == MSG_DELTA:
+                    return  # Nothing to patch it into
+                stream = self.streams[key] = collections.deque()
+            stream.append(record)
+            if len(stream) == 1:
+                self.push_head(key)
+            self.size += len(encoded_frame)
+            while self.heads:
+                received, _, stream, oldest = self.heads[0]
+                if self.streams.get(oldest) is not stream:
+                    heapq.heappop(self.heads)  # Forgotten meanwhile
+                    continue
+                if self.size <= self.memory_limit and \
+                        received >= now - self.seconds:
+                    break
+                heapq.heappop(self.heads)
+                self.evict(oldest)
+
+    def push_head(self, key):
+        """
+        Puts a stream's first record on the heap. Called with the lock held.
+        """
+        stream = self.streams[key]
+        heapq.heappush(self.heads,
+                       (stream[0][0], next(self.order), stream, key))
+
+    def evict(self, key):
+        """
+        Drops a stream's oldest record and the deltas that depended on it.
+        Called with the lock held, after its heap entry was popped.
+        """
+        stream = self.streams[key]
+        self.size -= len(stream.popleft()[3])
+        while stream and stream[0][2] == MSG_DELTA:
+            self.size -= len(stream.popleft()[3])
+        if stream:
+            self.push_head(key)
+        else:
+            del self.streams[key]
+
+    def timeline(self, client_address):
+        """
+        Returns the capture times a client can be rewound between.
+
+        Args:
+            client_address (tuple): The address of the client.
+
+        Returns:
+            tuple: (first, last) capture time over all its channels, or None
+            if nothing is buffered.
+        """
+        with self.lock:
+            ends = [(stream[0][1], stream[-1][1])
+                    for (address, _), stream in self.streams.items()
+                    if address == client_address and stream]
+        if not ends:
+            return None
+        return min(start for start, _ in ends), max(end for _, end in ends)
+
+    def channels(self, client_address):
+        """
+        Returns the channels buffered for a client.
+        """
+        with self.lock:
+            return sorted(channel for address, channel in self.streams
+                          if address == client_address)
+
+    def frames_at(self, key, timestamp):
+        """
+        Finds the records needed to show a channel at a point in time.
+
+        Args:
+            key (tuple): The (client address, channel) to look up.
+            timestamp (float): The capture time to show.
+
+        Returns:
+            list: (msg_type, encoded_frame) from the last keyframe at or
+            before the time up to the last frame at or before it, or an
+            empty list.
+        """
+        with self.lock:
+            records = list(self.streams.get(key, ()))
+        frames = []
+        for _, record_time, msg_type, encoded_frame in records:
+            if record_time > timestamp:
+                break
+            if msg_type != MSG_DELTA:
+                frames = []
+            frames.append((msg_type, encoded_frame))
+        return frames
+
+    def decode_at(self, key, timestamp):
+        """
+        Decodes a channel's frame at a point in time, replaying deltas from
+        the keyframe before it.
+
+        Args:
+            key (tuple): The (client address, channel) to decode.
+            timestamp (float): The capture time to show.
+
+        Returns:
+            numpy.ndarray: The decoded frame, or None if it is not buffered.
+        """
+        frames = self.frames_at(key, timestamp)
+        if not frames:
+            return None
+        frame = decode_jpeg(frames[0][1], FRAME_DECODE_COLOR_MODE)
+        for _, data in frames[1:]:
+            if frame is None:
+                break
+            frame_size, tile_size, indices, encoded_tiles = \
+                FrameProtocol.unpack_delta(data)
+            if (frame.shape[1], frame.shape[0]) != frame_size:
+                return None
+            if len(encoded_tiles):
+                tiles = decode_jpeg(encoded_tiles, FRAME_DECODE_COLOR_MODE)
+                if tiles is None:
+                    return None
+                patch_tiles(frame, tile_size,
+                            np.frombuffer(indices, TILE_INDEX_TYPE), tiles)
+        return frame
+
+    def forget(self, client_address):
+        """
+        Drops everything buffered for a client.
+
+        Args:
+            client_address (tuple): The address of the client.
+        """
+        with self.lock:
+            for key in [key for key in self.streams
+                        if key[0] == client_address]:
+                stream = self.streams.pop(key)
+                self.size -= sum(len(record[3]) for record in stream)
+                stream.clear()  # Its heap entry holds no frames
@@ -0,0 +1,312 @@
+"""
+Server for student submissions
+Amit Skarbin
+"""
+
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import zipfile
+from Constants.constants import SUBMISSIONS_ROOT, DEFAULT_EXAM_NAME, \
+    SUBMISSION_CLAIM_TIMEOUT
+from Protocols.file_protocol import FileProtocol
+
+MANIFEST_NAME = "manifest.jsonl"
+BLOBS_DIRECTORY = "blobs"
+
+
+def safe_name(name):
+    """
+    Turns a username or exam name into a directory name.
+    """
+    return re.sub(r"[^\w-]", "_", name or "unknown")
+
+
+class ServerSubmissionModule:
+    """
+    Stores the files students submit, indexed per exam.
+
+    File contents are stored once, by their SHA-256, however many students
+    submit them or how many times:
+        <root>/blobs/<first 2 hex digits>/<hash>
+    A submission's hash travels in the file header, so when its content is
+    already stored the client is told before sending the body and nothing
+    more is transferred. New content is received into a partial file and
+    renamed into place only once complete and verified. Uploads of content
+    already being received wait for that upload, but only for
+    SUBMISSION_CLAIM_TIMEOUT: a stalled upload is then taken over into a
+    partial file of its own, resuming from a copy of what the stalled one
+    received, so the two never write the same file. The stalled partial
+    file is removed once the content is stored. Chunked uploads, sent
+    without a hash, are received into a temporary file of their own and
+    stored by their hash once complete. The exam file
+    students download is stored too, so an unchanged copy of it is never
+    uploaded.
+
+    Every submission is appended to its exam's manifest, which references
+    the stored content:
+        <root>/<exam>/manifest.jsonl
+    with the student, file name, size, hash and time of each one, so the
+    exam's submissions are listed without scanning directories. A
+    re-submitted file replaces the earlier one.
+
+    Attributes:
+        root (str): The directory submissions are stored under.
+        exam (str): The exam new submissions are stored for.
+        deduplicated (int): Submissions whose content was already stored.
+    """
+
+    def __init__(self, root=SUBMISSIONS_ROOT):
+        """
+        Initializes the store.
+
+        Args:
+            root (str): The directory submissions are stored under.
+        """
+        self.root = root
+        self.exam = DEFAULT_EXAM_NAME
+        self.deduplicated = 0
+        self.receiving = {}  # Hashes being received, to their receiver
+        self.lock = threading.Lock()
+        self.received = threading.Condition(self.lock)
+        self.export_lock = threading.Lock()  # Held while exporting
+
+    def set_exam(self, exam_name):
+        """
+        Stores following submissions for another exam.
+
+        Args:
+            exam_name (str): The name of the exam, usually the name of the
+            teacher's exam file.
+        """
+        self.exam = safe_name(exam_name)
+
+    def blob_path(self, digest):
+        """
+        Returns where content with a hash is stored.
+
+        Args:
+            digest (bytes): The SHA-256 of the content.
+        """
+        digest = digest.hex()
+        return os.path.join(self.root, BLOBS_DIRECTORY, digest[:2], digest)
+
+    def add_blob(self, file_path, digest):
+        """
+        Stores a file the server already has, such as the published exam
+        file, so students submitting it unchanged do not upload it.
+
+        Args:
+            file_path (str): The path of the file.
+            digest (bytes): The SHA-256 of the file.
+        """
+        path = self.blob_path(digest)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            shutil.copyfile(file_path, path + ".copy")
+            os.replace(path + ".copy", path)
+
+    def store(self, client_socket, username):
+        """
+        Receives a submission and records it in the manifest.
+
+        Args:
+            client_socket (socket.socket): The client's socket, or a socket
+            bridge on the asyncio engine.
+            username (str): The username of the submitting student.
+
+        Returns:
+            str: The path the submission's content is stored at.
+        """
+        exam, student = self.exam, safe_name(username)
+        receiver = object()  # Identifies this upload's claims
+        claimed = []
+        temporary = []
+
+        def claim_blob(digest):
+            if digest is None:
+                # Chunked upload, hashed once received into a file of its own
+                temporary.append(self.temp_path())
+                return temporary[-1]
+            # One receiver per content, the others then find it stored
+            path = self.blob_path(digest)
+            deadline = time.monotonic() + SUBMISSION_CLAIM_TIMEOUT
+            with self.lock:
+                while digest in self.receiving and \
+                        self.received.wait(deadline - time.monotonic()):
+                    pass
+                stalled = digest in self.receiving
+                self.receiving[digest] = receiver
+                if not stalled and os.path.exists(path):
+                    self.deduplicated += 1
+            claimed.append(digest)
+            if not stalled:
+                return path
+            return self.take_over(path, digest, receiver)
+
+        try:
+            path, digest, file_name = FileProtocol.recv_file(
+                client_socket, os.path.join(self.root, BLOBS_DIRECTORY),
+                blob_path=claim_blob)
+        except Exception:
+            for path in temporary:
+                os.remove(path)
+            raise
+        finally:
+            with self.lock:
+                for digest in claimed:
+                    if self.receiving.get(digest) is receiver:
+                        del self.receiving[digest]
+                self.received.notify_all()
+        if digest is None:
+            # Chunked transfer from an older client, hashed once stored
+            path, digest = self.move_to_blob(path)
+        elif path != self.blob_path(digest):
+            # Received after taking over a stalled upload, whose partial
+            # file is not needed anymore
+            os.replace(path, self.blob_path(digest))
+            path = self.blob_path(digest)
+            try:
+                os.remove(f"{path}.{digest.hex()[:16]}.part")
+            except OSError:
+                pass  # Still open on Windows, or never written
+        entry = {"student": student, "file": file_name,
+                 "size": os.path.getsize(path), "sha256": digest.hex(),
+                 "time": time.time()}
+        os.makedirs(os.path.join(self.root, exam), exist_ok=True)
+        with self.lock:
+            with open(self.manifest_path(exam), 'a') as manifest:
+                manifest.write(json.dumps(entry) + "\n")
+        return path
+
+    def temp_path(self):
+        """
+        Creates an empty file to receive a chunked upload into.
+
+        Returns:
+            str: The path of the file.
+        """
+        directory = os.path.join(self.root, BLOBS_DIRECTORY)
+        os.makedirs(directory, exist_ok=True)
+        descriptor, path = tempfile.mkstemp(".upload", dir=directory)
+        os.close(descriptor)
+        return path
+
+    def take_over(self, path, digest, receiver):
+        """
+        Starts receiving content a stalled upload was receiving.
+
+        The stalled upload may still wake up and write its partial file, so
+        this upload gets its own, starting from a copy of what was received.
+
+        Args:
+            path (str): The path the content is stored at.
+            digest (bytes): The SHA-256 of the content.
+            receiver (object): Identifies the upload taking over.
+
+        Returns:
+            str: The path to receive the content to, moved to `path` once
+            received.
+        """
+        save_path = f"{path}.{id(receiver):x}"
+        part = f".{digest.hex()[:16]}.part"
+        try:
+            shutil.copyfile(path + part, save_path + part)
+        except OSError:
+            pass  # Nothing received yet
+        return save_path
+
+    def move_to_blob(self, file_path):
+        """
+        Moves a received file into the blob store.
+
+        Returns:
+            tuple: (blob path, SHA-256 of the file).
+        """
+        hasher = hashlib.sha256()
+        with open(file_path, 'rb') as file:
+            FileProtocol.hash_file(hasher, file, os.path.getsize(file_path))
+        digest = hasher.digest()
+        path = self.blob_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(file_path, path)
+        return path, digest
+
+    def manifest_path(self, exam):
+        """
+        Returns the path of an exam's manifest.
+        """
+        return os.path.join(self.root, exam, MANIFEST_NAME)
+
+    def submissions(self, exam=None):
+        """
+        Lists an exam's submissions from its manifest.
+
+        Args:
+            exam (str): The exam, or None for the current one.
+
+        Returns:
+            list: Manifest entries, the latest per student and file, in the
+            order they were stored.
+        """
+        path = self.manifest_path(exam or self.exam)
+        if not os.path.exists(path):
+            return []
+        latest = {}
+        with self.lock, open(path) as manifest:
+            for line in manifest:
+                if line.strip():
+                    entry = json.loads(line)
+                    key = (entry["student"], entry["file"])
+                    latest.pop(key, None)  # Keep the re-submission's order
+                    latest[key] = entry
+        return list(latest.values())
+
+    def export(self, archive_path, exam=None):
+        """
+        Writes every submission of an exam into one zip archive.
+
+        The stored contents are read once, in manifest order, and streamed
+        into the archive uncompressed, since most submissions are
+        compressed already. The archive is written under a temporary name
+        and renamed into place once complete, so an earlier archive is only
+        replaced by a whole one.
+
+        Args:
+            archive_path (str): The path of the archive to write.
+            exam (str): The exam, or None for the current one.
+
+        Returns:
+            int: The number of files exported.
+
+        Raises:
+            RuntimeError: If another export is running.
+        """
+        if not self.export_lock.acquire(blocking=False):
+            raise RuntimeError("Another export is still running")
+        try:
+            entries = self.submissions(exam)
+            directory = os.path.dirname(archive_path) or "."
+            os.makedirs(directory, exist_ok=True)
+            descriptor, temp_path = tempfile.mkstemp(".zip.part",
+                                                     dir=directory)
+            try:
+                with os.fdopen(descriptor, 'wb') as file, \
+                        zipfile.ZipFile(file, 'w', zipfile.ZIP_STORED,
+                                        allowZip64=True) as archive:
+                    for entry in entries:
+                        archive.write(
+                            self.blob_path(bytes.fromhex(entry["sha256"])),
+                            f"{entry['student']}/{entry['file']}")
+                os.replace(temp_path, archive_path)
+            except Exception:
+                os.remove(temp_path)
+                raise
+        finally:
+            self.export_lock.release()
+        return len(entries)